@@ -1,173 +1,133 @@
 # app.py
 import streamlit as st
-from langchain_core.messages import AIMessage, HumanMessage
-import asyncio
-from graph import app as graph
-from langgraph.errors import NodeInterrupt
+from worker import GraphWorker, Session
 
 DEBUG_MODE = False
+# Seconds between polls of the session's event queue while the graph is running
+POLL_INTERVAL = 0.5
 
 def debug_print(container, message):
     if DEBUG_MODE:
         container.write(f"Debug: {message}")
 
-thread_config = {"configurable": {"thread_id": "1"}}
-
-def display_text_chunks(chunks, container):
-    debug_print(container, f"Displaying {len(chunks)} chunks")
-    with container.expander(f"Text is split into {len(chunks)} chunks:", expanded=True):
-        for i, chunk in enumerate(chunks, 0):
-            if f"title_placeholder_{i}" not in st.session_state:
-                st.session_state[f"title_placeholder_{i}"] = st.empty()
-            st.session_state[f"title_placeholder_{i}"].markdown(f"**Chunk {i+1}:**")
-            if f"metadata_placeholder_{i}" not in st.session_state:
-                debug_print(container, f"Creating metadata placeholder for chunk {i}")
-                st.session_state[f"metadata_placeholder_{i}"] = st.empty()
-            if chunk.metadata:
-                st.session_state[f"metadata_placeholder_{i}"].write(chunk.metadata)
-            if f"chunk_{i}_text" not in st.session_state:
-                debug_print(container, f"Creating text placeholder for chunk {i}")
-                st.session_state[f"text_placeholder_{i}"] = st.empty()
-            if chunk.text:
-                st.session_state[f"text_placeholder_{i}"].text_area(
-                    label=f"Chunk {i}",
-                    value=chunk.text,
-                    height=100,
-                    label_visibility="collapsed",
-                    key=f"chunk_{i}_text"
-            )
-
-async def process_graph_events(text_input, placeholder, chunks_container, shared_state):
-    """Handle graph events and UI updates"""
-    container = placeholder
-    
-    try:
-        debug_print(container, "Starting graph processing...")
-        
-        config = {
-            "configurable": {"thread_id": "1"}
-        }
-        
-        if shared_state.get("graph_resume"):
-            answer = shared_state.get("user_answer")
-            debug_print(container, f"Resuming with answer: {answer}")
-            graph.update_state(config, {"answer": answer})
-            input_data = None
-        else:
-            input_data = {"text": text_input}
-        
-        async for event in graph.astream_events(input_data, config, version="v2"):
-            name = event["name"]
-            debug_print(container, f"Received event: {name}")
-            
-            if name == "on_text_split":
-                st.session_state.text_chunks = event['data']['chunks']
-                st.session_state.chunks_received = True
-                display_text_chunks(st.session_state.text_chunks, chunks_container)
-
-            elif name == "on_chunk_metadata_update":
-                index = event['data']['chunk_index']
-                st.session_state.text_chunks[event['data']['chunk_index']].metadata = event['data']['chunk'].metadata
-                st.session_state[f"metadata_placeholder_{index}"].write(st.session_state.text_chunks[event['data']['chunk_index']].metadata)
-            
-            elif name == "on_similar_chunk_found":
-                chunk_num = event['data']['chunk_index'] + 1  # Convert to 1-based index
-                container.warning(f"Found existing item similat to Chunk #{chunk_num}:")
-                
-                container.subheader(f"Existing Item:")
-                container.info(f"Keywords: {event['data']['chunk_keywords']}")
-                container.code(event['data']['chunk_text'], wrap_lines=True)
-                
-                container.write("Decision required:")
-                col1, col2 = st.columns(2)
-                store = col1.button("Store Chunk", key=f"store_{chunk_num}")
-                skip = col2.button("Skip Chunk", key=f"skip_{chunk_num}")
-                
-                if store or skip:
-                    answer = "y" if store else "n"
-                    debug_print(container, f"Button clicked, answer: {answer}")
-                    return {"status": "resume", "answer": answer}
-                return {"status": "waiting", "message": "Do you want to index this chunk?"}
-    
-        return {"status": "completed"}
-        
-    except NodeInterrupt as e:
-        debug_print(container, f"NodeInterrupt caught with message: {str(e)}")
-        
+@st.cache_resource
+def get_worker() -> GraphWorker:
+    # One worker per server process; every browser session submits its runs to it
+    return GraphWorker()
+
+def display_text_chunks(session: Session, container):
+    chunks = session.chunks
+    expander = container.expander("Text chunks:", expanded=True)
+    expander.markdown(f"Text is split into {len(chunks)} chunks:")
+    for i, chunk in enumerate(chunks):
+        expander.markdown(f"**Chunk {i+1}:**" + (f" _{session.results[i]}_" if i in session.results else ""))
+        if chunk.metadata:
+            expander.write(chunk.metadata)
+        expander.text_area(
+            label=f"Chunk {i}",
+            value=chunk.text,
+            height=100,
+            label_visibility="collapsed",
+            disabled=True,
+            key=f"{session.thread_id}_chunk_{i}_text"
+        )
+
+def display_prompt(session: Session, worker: GraphWorker, container):
+    name, data = session.prompt
+    key = session.thread_id
+
+    if name == "on_similar_chunk_found":
+        chunk_num = data['chunk_index'] + 1  # Convert to 1-based index
+        container.warning(f"Found existing item similat to Chunk #{chunk_num}:")
+
+        container.subheader(f"Existing Item:")
+        if data.get('score') is not None:
+            container.caption(f"Similarity: {data['score']:.3f}")
+        container.info(f"Keywords: {data['chunk_keywords']}")
+        container.code(data['chunk_text'], wrap_lines=True)
+
         container.write("Decision required:")
-        col1, col2 = st.columns(2)
-        store = col1.button("Store Chunk", key=f"store_interrupt_{chunk_num}")
-        skip = col2.button("Skip Chunk", key=f"skip_interrupt_{chunk_num}")
-        
+        col1, col2 = container.columns(2)
+        store = col1.button("Store Chunk", key=f"{key}_store_{chunk_num}")
+        skip = col2.button("Skip Chunk", key=f"{key}_skip_{chunk_num}")
+
         if store or skip:
             answer = "y" if store else "n"
-            debug_print(container, f"Button clicked in interrupt handler, answer: {answer}")
-            return {"status": "resume", "answer": answer}
-        
-        return {"status": "waiting", "message": str(e)}
+            debug_print(container, f"Button clicked, answer: {answer}")
+            worker.resume(session, {"answer": answer})
+            st.rerun()
+        container.info("Do you want to index this chunk?")
+
+    elif name == "on_review_required":
+        items = data['items']
+        container.warning(f"{len(items)} chunks are similar to existing items:")
+
+        for item in items:
+            index = item['chunk_index']
+            container.subheader(f"Chunk #{index + 1}:")
+            container.code(item['current_chunk'].text, wrap_lines=True)
+            if item.get('score') is not None:
+                container.caption(f"Similarity: {item['score']:.3f}")
+            container.info(f"Existing item keywords: {item['similar_chunk'].metadata}")
+            container.code(item['similar_chunk'].text, wrap_lines=True)
+            container.checkbox("Store this chunk", key=f"{key}_review_store_{index}")
+
+        if container.button("Submit decisions", key=f"{key}_review_submit"):
+            answers = {
+                item['chunk_index']: "y" if st.session_state.get(f"{key}_review_store_{item['chunk_index']}") else "n"
+                for item in items
+            }
+            debug_print(container, f"Review submitted, answers: {answers}")
+            worker.resume(session, {"review_answers": answers})
+            st.rerun()
+        container.info("Select the chunks to store and submit your decisions.")
 
 # Main Streamlit app
 st.title("Text Processing with LangGraph")
 
-# Initialize session state
-if "graph_resume" not in st.session_state:
-    st.session_state.graph_resume = False
-if "user_answer" not in st.session_state:
-    st.session_state.user_answer = None
-if "text_chunks" not in st.session_state:
-    st.session_state.text_chunks = None
-if "input_text" not in st.session_state:
-    st.session_state.input_text = None
-if "chunks_received" not in st.session_state:
-    st.session_state.chunks_received = False
-
-# Create main layout containers
-form_container = st.container()
-chunks_container = st.container()
-process_container = st.container()
+worker = get_worker()
+# Every browser session has its own graph thread and event queue
+if "graph_session" not in st.session_state:
+    st.session_state.graph_session = Session()
+session = st.session_state.graph_session
 
 # Input form
-with form_container:
-    with st.form(key="text_input_form"):
-        text_input = st.text_area(
-            "Enter text to process",
-            height=200,
-            placeholder="Enter your text here..."
-        )
-        submit_button = st.form_submit_button("Process Text")
-        if submit_button:
-            st.session_state.input_text = text_input
-            st.session_state.chunks_received = False  # Reset chunks flag on new submission
-
-# Always show chunks container
-if st.session_state.text_chunks and st.session_state.chunks_received:
-    display_text_chunks(st.session_state.text_chunks, chunks_container)
-
-# Process text and handle decisions
-if submit_button or st.session_state.graph_resume:
-    with process_container:
-        with st.spinner("Processing..."):
-            shared_state = {
-                "graph_resume": st.session_state.graph_resume,
-                "user_answer": st.session_state.user_answer
-            }
-            
-            result = asyncio.run(process_graph_events(
-                st.session_state.input_text or text_input,
-                process_container,
-                chunks_container,
-                shared_state
-            ))
-            
-            if result["status"] == "waiting":
-                st.session_state.graph_resume = True
-                st.info(result["message"])
-            elif result["status"] == "resume":
-                st.session_state.user_answer = result["answer"]
-                st.session_state.graph_resume = True
-                st.rerun()
-            elif result["status"] == "completed":
-                st.session_state.graph_resume = False
-                st.session_state.user_answer = None
-                st.session_state.chunks_received = False
-                st.success("Text processing completed!")
\ No newline at end of file
+with st.form(key="text_input_form"):
+    text_input = st.text_area(
+        "Enter text to process",
+        height=200,
+        placeholder="Enter your text here..."
+    )
+    st.checkbox("Review similar chunks together at the end", key="deferred_review")
+    submit_button = st.form_submit_button("Process Text", disabled=session.busy)
+    if submit_button and text_input.strip():
+        worker.start(session, text_input, {
+            "review_mode": "deferred" if st.session_state.get("deferred_review") else "immediate"
+        })
+
+# The graph runs in the worker; while it does, only this fragment reruns to show its progress
+polling = session.busy
+
+@st.fragment(run_every=POLL_INTERVAL if polling else None)
+def live_view():
+    # Events are queued before the status changes, so this poll sees all of them
+    status = session.status
+    session.poll()
+    if session.chunks:
+        display_text_chunks(session, st.container())
+
+    container = st.container()
+    if status == "running":
+        container.info("Processing...")
+    elif status == "waiting" and session.prompt:
+        display_prompt(session, worker, container)
+    elif status == "completed":
+        container.success("Text processing completed!")
+    elif status == "failed":
+        container.error(f"Processing failed: {session.error}")
+
+    if polling and status != "running":
+        # Rerun the whole script so polling stops and the form is enabled again
+        st.rerun()
+
+live_view()
@@ -0,0 +1,220 @@
+"""Lazily created, per-process backends for the graph.
+
+Nothing here runs at import time. Each client is built on first use and cached
+for the lifetime of the process, so importing graph.py makes no network calls.
+The backend is selected through Configuration.backend:
+
+- "pinecone": Anthropic/OpenAI models, OpenAI embeddings and a Pinecone index
+- "local": the same models and embeddings with an in-memory ChunkLocalStore
+- "fake": deterministic offline models, embeddings and an in-memory store
+- "fake-pinecone": the same fakes in front of ChunkPineconeStore over an
+  in-memory index, to exercise the Pinecone store layer offline
+
+The fakes wait FAKE_LLM_LATENCY, FAKE_EMBEDDING_LATENCY and FAKE_INDEX_LATENCY
+seconds per request (default 0) to stand in for API round trips.
+
+Every model, embedding and index request goes through the process's
+scheduler.Scheduler, which applies the per-provider rate limits.
+"""
+
+from functools import lru_cache
+import os
+
+from dotenv import load_dotenv
+
+from decisions import DecisionLog
+from embedding_cache import CachedEmbeddings
+from fingerprints import FingerprintIndex
+from instrumentation import LLMInstrumentation, log
+from keywords import DocumentFrequencies
+from llm_cache import ResponseCache
+from minhash import MinHashLSH
+from revisions import DocumentManifest
+from scheduler import ScheduledChatModel, ScheduledEmbeddings, ScheduledIndex, Scheduler
+
+load_dotenv()
+
+BACKENDS = ("pinecone", "local", "fake", "fake-pinecone")
+FAKE_BACKENDS = ("fake", "fake-pinecone")
+
+def _check_backend(backend: str):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}', expected one of {', '.join(BACKENDS)}")
+
+@lru_cache(maxsize=None)
+def get_scheduler() -> Scheduler:
+    return Scheduler()
+
+PROVIDERS = {"sonnet": "anthropic", "openai": "openai"}
+
+@lru_cache(maxsize=None)
+def get_chat_model(name: str, backend: str = "pinecone"):
+    """Return the chat model called `name` ("sonnet" or "openai")."""
+    _check_backend(backend)
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown chat model '{name}'")
+    if backend in FAKE_BACKENDS:
+        from fakes import FakeChatModel
+        model = FakeChatModel(
+            latency=float(os.getenv("FAKE_LLM_LATENCY", "0")),
+            token_latency=float(os.getenv("FAKE_TOKEN_LATENCY", "0"))
+        )
+    elif name == "sonnet":
+        from langchain_anthropic import ChatAnthropic
+        # Retries are left to the scheduler, which sees every provider's throttling
+        model = ChatAnthropic(model='claude-3-5-sonnet-20241022', temperature=0, max_retries=0)
+    else:
+        from langchain_openai import ChatOpenAI
+        model = ChatOpenAI(model="gpt-4o-mini", temperature=0, max_retries=0)
+    return ScheduledChatModel(
+        inner=model,
+        provider=PROVIDERS[name],
+        scheduler=get_scheduler(),
+        callbacks=[LLMInstrumentation(name)]
+    )
+
+@lru_cache(maxsize=None)
+def get_embeddings(backend: str = "pinecone") -> CachedEmbeddings:
+    _check_backend(backend)
+    if backend in FAKE_BACKENDS:
+        from fakes import FakeEmbeddings
+        embeddings = FakeEmbeddings(size=1536, latency=float(os.getenv("FAKE_EMBEDDING_LATENCY", "0")))
+    else:
+        from langchain_openai import OpenAIEmbeddings
+        embeddings = OpenAIEmbeddings(max_retries=0)
+    # Only cache misses reach the scheduler
+    return CachedEmbeddings(
+        ScheduledEmbeddings(embeddings, get_scheduler(), "openai-embeddings"),
+        max_size=int(os.getenv("EMBEDDING_CACHE_SIZE", "10000")),
+        path=os.getenv("EMBEDDING_CACHE_PATH") if backend not in FAKE_BACKENDS else None
+    )
+
+@lru_cache(maxsize=None)
+def get_response_cache() -> ResponseCache:
+    ttl = os.getenv("LLM_CACHE_TTL_SECONDS")
+    return ResponseCache(
+        max_size=int(os.getenv("LLM_CACHE_SIZE", "1000")),
+        path=os.getenv("LLM_CACHE_PATH"),
+        ttl=float(ttl) if ttl else None,
+        max_rows=int(os.getenv("LLM_CACHE_MAX_ROWS", "100000"))
+    )
+
+@lru_cache(maxsize=None)
+def get_keyword_frequencies(backend: str = "pinecone") -> DocumentFrequencies:
+    """Document frequencies of the chunks stored in `backend`, for the local keyword engine."""
+    _check_backend(backend)
+    return DocumentFrequencies(os.getenv("KEYWORD_STATS_PATH") if backend == "pinecone" else None)
+
+@lru_cache(maxsize=None)
+def get_decision_log() -> DecisionLog:
+    """Return the decision log, appended to DECISION_LOG_PATH when it is set and kept in memory otherwise."""
+    return DecisionLog(os.getenv("DECISION_LOG_PATH") or None)
+
+def get_checkpointer():
+    """Return a SQLite checkpointer when CHECKPOINT_PATH is set, otherwise an in-memory one."""
+    from checkpointer import ChunkSerializer, SqliteCheckpointer
+
+    path = os.getenv("CHECKPOINT_PATH")
+    if not path:
+        from langgraph.checkpoint.memory import MemorySaver
+        return MemorySaver(serde=ChunkSerializer())
+    return SqliteCheckpointer(path, keep=int(os.getenv("CHECKPOINT_KEEP", "3")), serde=ChunkSerializer())
+
+@lru_cache(maxsize=None)
+def get_pinecone_index():
+    """Return the Pinecone index, creating it on first use if it doesn't exist."""
+    from pinecone import Pinecone, ServerlessSpec
+
+    pc = Pinecone()
+    pc_index_name = os.getenv("PINECONE_INDEX_NAME")
+
+    if pc_index_name not in pc.list_indexes().names():
+        # Sparse-dense queries need the dotproduct metric; OpenAI embeddings are unit
+        # length, so dense scores are the same as with cosine
+        pc.create_index(
+            name=pc_index_name,
+            dimension=1536,
+            metric="dotproduct" if os.getenv("KEYWORD_SEARCH") == "hybrid" else "cosine",
+            spec=ServerlessSpec(cloud="aws", region="us-east-1"),
+        )
+        log("pinecone_index_created", "info", index=pc_index_name)
+    else:
+        log("pinecone_index_exists", "info", index=pc_index_name)
+
+    return pc.Index(pc_index_name)
+
+def _namespaced(path, namespace: str):
+    # Local indexes of a namespace live next to those of the default namespace
+    return f"{path}.{namespace}" if path and namespace else path
+
+@lru_cache(maxsize=None)
+def get_fake_pinecone_index():
+    # One in-memory index for every namespace, like the real one
+    from fakes import FakePineconeIndex
+    return FakePineconeIndex(latency=float(os.getenv("FAKE_INDEX_LATENCY", "0")))
+
+@lru_cache(maxsize=None)
+def get_store(backend: str = "pinecone", namespace: str = ""):
+    """Return the chunk store for `backend` and `namespace`, shared by every graph run in the process.
+
+    Namespaces partition the stored chunks, e.g. by source or tenant: lookups
+    only see chunks stored in the same namespace.
+    """
+    _check_backend(backend)
+    from chunk_store import ChunkLocalStore, ChunkPineconeStore
+
+    embeddings = get_embeddings(backend)
+    if backend in ("local", "fake"):
+        # Only the local backend's store is kept on disk, loaded here and saved after every flush
+        path = _namespaced(os.getenv("LOCAL_STORE_PATH"), namespace) if backend == "local" else None
+        frequencies = get_keyword_frequencies(backend)
+        if path and os.path.exists(f"{path}.json"):
+            store = ChunkLocalStore.load(path, embeddings, frequencies=frequencies)
+            store.path = path
+            return store
+        return ChunkLocalStore(embeddings, frequencies=frequencies, path=path)
+
+    # Local index files are only used with the real Pinecone index
+    persistent = backend == "pinecone"
+    if persistent:
+        from langchain_pinecone import PineconeVectorStore
+
+        index = ScheduledIndex(get_pinecone_index(), get_scheduler())
+        vectorstore = PineconeVectorStore(
+            index=index,
+            embedding=embeddings,
+            text_key="text"
+        )
+    else:
+        from fakes import FakeVectorStore
+
+        index = ScheduledIndex(get_fake_pinecone_index(), get_scheduler())
+        vectorstore = FakeVectorStore(index)
+    lsh = None
+    if os.getenv("LSH_PREFILTER", "").lower() in ("1", "true", "yes"):
+        lsh = MinHashLSH(path=_namespaced(os.getenv("LSH_INDEX_PATH"), namespace) if persistent else None)
+    store = ChunkPineconeStore(
+        vectorstore,
+        embeddings,
+        index,
+        batch_size=int(os.getenv("UPSERT_BATCH_SIZE", "50")),
+        batch_bytes=int(os.getenv("UPSERT_BATCH_BYTES", "1000000")),
+        flush_interval=float(os.getenv("UPSERT_FLUSH_SECONDS", "5")),
+        fingerprints=FingerprintIndex(_namespaced(os.getenv("FINGERPRINT_INDEX_PATH"), namespace) if persistent else None),
+        lsh=lsh,
+        namespace=namespace or None,
+        keyword_search=os.getenv("KEYWORD_SEARCH", "off"),
+        hybrid_alpha=float(os.getenv("HYBRID_ALPHA", "0.8")),
+        frequencies=get_keyword_frequencies(backend)
+    )
+    # A new LSH index over a non-empty namespace would reject every chunk already stored there
+    if lsh is not None and not len(lsh) and next(iter(index.list(namespace=namespace)), None):
+        log("lsh_index_rebuilt", "info", namespace=namespace, chunks=store.rebuildLocalIndexes())
+    return store
+
+@lru_cache(maxsize=None)
+def get_document_manifest(backend: str = "pinecone", namespace: str = "") -> DocumentManifest:
+    """Paragraph fingerprints and stored chunk IDs of the documents ingested into get_store(backend, namespace)."""
+    _check_backend(backend)
+    path = os.getenv("DOCUMENT_MANIFEST_PATH") if backend == "pinecone" else None
+    return DocumentManifest(_namespaced(path, namespace))
@@ -0,0 +1,216 @@
+"""Benchmark the compiled graph offline over synthetic corpora of increasing size.
+
+    python bench.py --sizes 10,100,1000 --llm-latency 0.05 --store pinecone
+
+Runs on the fake backends (no API calls) and reports per-node latency,
+documents and chunks per second, peak RSS and checkpoint bytes per document.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import resource
+import sys
+import time
+from collections import defaultdict
+from typing import Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+WORDS = (
+    "index vector chunk keyword model latency store query batch graph node token window "
+    "summary context document stream cache embedding signature review decision score"
+).split()
+NAMES = ["Apple", "Google", "Meta", "Pinecone", "Anthropic", "OpenAI", "Streamlit", "LangGraph", "Python", "Europe"]
+
+
+def make_corpus(documents: int, paragraphs: int = 6, duplicate_rate: float = 0.2, seed: int = 0) -> list:
+    """Synthetic documents where about `duplicate_rate` of the paragraphs repeat earlier ones."""
+    from ingest import Document
+
+    rng = random.Random(seed)
+    seen: list[str] = []
+    corpus = []
+    for d in range(documents):
+        parts = []
+        for _ in range(paragraphs):
+            if seen and rng.random() < duplicate_rate:
+                parts.append(rng.choice(seen))
+                continue
+            sentences = [
+                f"{rng.choice(NAMES)} {' '.join(rng.choice(WORDS) for _ in range(rng.randint(6, 14)))}."
+                for _ in range(rng.randint(1, 3))
+            ]
+            paragraph = " ".join(sentences)
+            seen.append(paragraph)
+            parts.append(paragraph)
+        corpus.append(Document(f"bench-{seed}-{d}", "\n\n".join(parts)))
+    return corpus
+
+
+class NodeTimer(BaseCallbackHandler):
+    """Collects the wall time of every graph node run."""
+
+    def __init__(self):
+        self.started: dict = {}
+        self.timings: dict[str, list[float]] = defaultdict(list)
+
+    def on_chain_start(self, serialized, inputs, *, run_id, metadata=None, **kwargs):
+        node = (metadata or {}).get("langgraph_node")
+        if node and kwargs.get("name") == node:
+            self.started[run_id] = (node, time.perf_counter())
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        started = self.started.pop(run_id, None)
+        if started:
+            self.timings[started[0]].append(time.perf_counter() - started[1])
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        # Interrupts end a node run with an error; they still count as a run
+        self.on_chain_end(None, run_id=run_id)
+
+
+def checkpoint_bytes(checkpointer, thread_id: str) -> int:
+    """Bytes the checkpointer actually keeps for a thread: checkpoints, channel value blobs and pending writes."""
+    if hasattr(checkpointer, "storage"):
+        # MemorySaver keeps serialized (type, bytes) pairs
+        total = sum(
+            len(checkpoint[1]) + len(metadata[1])
+            for checkpoints in checkpointer.storage.get(thread_id, {}).values()
+            for checkpoint, metadata, _ in checkpoints.values()
+        )
+        total += sum(len(blob[1]) for key, blob in checkpointer.blobs.items() if key[0] == thread_id)
+        total += sum(
+            len(write[2][1])
+            for key, writes in checkpointer.writes.items() if key[0] == thread_id
+            for write in writes.values()
+        )
+        return total
+    with checkpointer.cursor(transaction=False) as cur:
+        tables = {row[0] for row in cur.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        queries = ["SELECT SUM(LENGTH(checkpoint) + LENGTH(metadata)) FROM checkpoints WHERE thread_id = ?",
+                   "SELECT SUM(LENGTH(value)) FROM writes WHERE thread_id = ?"]
+        if "blobs" in tables:
+            queries.append("SELECT SUM(LENGTH(value)) FROM blobs WHERE thread_id = ?")
+        return sum(cur.execute(query, (thread_id,)).fetchone()[0] or 0 for query in queries)
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def run_size(corpus: list, concurrency: int, configurable: dict, policy: str) -> dict:
+    import backends
+    from graph import create_app
+    from ingest import ingest_document
+    from scheduler import priority
+
+    # Every size starts from an empty store and caches
+    for getter in (backends.get_store, backends.get_embeddings, backends.get_response_cache, backends.get_scheduler,
+                   backends.get_chat_model, backends.get_keyword_frequencies, backends.get_fake_pinecone_index):
+        getter.cache_clear()
+
+    app = create_app()
+    timer = NodeTimer()
+    semaphore = asyncio.Semaphore(concurrency)
+    entries = []
+    sizes = []
+
+    async def run(document):
+        async with semaphore:
+            entry = await ingest_document(app, document, configurable, policy, 10000, [timer], keep_thread=True)
+            sizes.append(checkpoint_bytes(app.checkpointer, document.thread_id))
+            await app.checkpointer.adelete_thread(document.thread_id)
+            entries.append(entry)
+
+    started = time.perf_counter()
+    with priority("bulk"):
+        await asyncio.gather(*(run(document) for document in corpus))
+    elapsed = time.perf_counter() - started
+    chunks = sum(entry["chunks"] for entry in entries)
+    return {
+        "documents": len(corpus),
+        "chunks": chunks,
+        "stored": sum(entry["stored"] for entry in entries),
+        "seconds": elapsed,
+        "docs_per_second": len(corpus) / elapsed,
+        "chunks_per_second": chunks / elapsed,
+        "peak_rss_mb": peak_rss_mb(),
+        "checkpoint_kb_per_document": sum(sizes) / len(sizes) / 1024 if sizes else 0.0,
+        "nodes": {
+            node: {
+                "calls": len(values),
+                "mean_ms": 1000 * sum(values) / len(values),
+                "p95_ms": 1000 * percentile(values, 0.95),
+                "total_s": sum(values)
+            }
+            for node, values in sorted(timer.timings.items())
+        }
+    }
+
+def print_report(result: dict):
+    print(
+        f"\n{result['documents']} documents, {result['chunks']} chunks ({result['stored']} stored) "
+        f"in {result['seconds']:.2f}s: {result['docs_per_second']:.1f} docs/s, "
+        f"{result['chunks_per_second']:.1f} chunks/s, peak RSS {result['peak_rss_mb']:.0f} MB, "
+        f"checkpoints {result['checkpoint_kb_per_document']:.1f} KB/document"
+    )
+    print(f"  {'node':<10} {'calls':>7} {'mean ms':>9} {'p95 ms':>9} {'total s':>9}")
+    for node, stats in result["nodes"].items():
+        print(f"  {node:<10} {stats['calls']:>7} {stats['mean_ms']:>9.2f} {stats['p95_ms']:>9.2f} {stats['total_s']:>9.2f}")
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(description="Benchmark the graph offline on synthetic corpora")
+    parser.add_argument("--sizes", default="10,100", help="comma separated corpus sizes, in documents")
+    parser.add_argument("--paragraphs", type=int, default=6, help="paragraphs per document")
+    parser.add_argument("--duplicate-rate", type=float, default=0.2)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--store", choices=("local", "pinecone"), default="local",
+                        help="ChunkLocalStore, or ChunkPineconeStore over an in-memory index")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="seconds per chat model call")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="seconds per streamed word")
+    parser.add_argument("--embedding-latency", type=float, default=0.0, help="seconds per embedding request")
+    parser.add_argument("--index-latency", type=float, default=0.0, help="seconds per index request")
+    parser.add_argument("--on-duplicate", choices=("skip", "store"), default="skip")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="Configuration option")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the graph's own output")
+    args = parser.parse_args(argv)
+
+    from ingest import parse_value
+
+    # Benchmark decisions stay out of the audit log
+    os.environ["DECISION_LOG_PATH"] = ""
+    # The fake backends read their latencies when they are first created
+    os.environ["FAKE_LLM_LATENCY"] = str(args.llm_latency)
+    os.environ["FAKE_TOKEN_LATENCY"] = str(args.token_latency)
+    os.environ["FAKE_EMBEDDING_LATENCY"] = str(args.embedding_latency)
+    os.environ["FAKE_INDEX_LATENCY"] = str(args.index_latency)
+    configurable = {key: parse_value(value) for key, value in (item.split("=", 1) for item in args.set)}
+    configurable["backend"] = "fake" if args.store == "local" else "fake-pinecone"
+
+    results = []
+    for size in (int(size) for size in args.sizes.split(",")):
+        corpus = make_corpus(size, args.paragraphs, args.duplicate_rate, seed=size)
+        with contextlib.redirect_stdout(sys.stdout if args.verbose else open(os.devnull, "w")):
+            result = asyncio.run(run_size(corpus, args.concurrency, configurable, args.on_duplicate))
+        print_report(result)
+        results.append(result)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""Checkpoint serialization and a disk-backed checkpointer for long-running graph workers."""
+
+import asyncio
+import json
+import sqlite3
+from typing import Any, AsyncIterator, Optional, Sequence
+
+import ormsgpack
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer, _msgpack_default, _option
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+from chunk import Chunk
+
+# msgpack extension type for Chunk; JsonPlusSerializer uses the codes below 10
+EXT_CHUNK = 64
+
+
+class ChunkSerializer(JsonPlusSerializer):
+    """JsonPlusSerializer that writes a Chunk as one binary msgpack extension.
+
+    The default serializer stores a chunk as its module, class name and a dict
+    of fields, and rebuilds it through the msgpack allowlist. Embeddings are left
+    out; they come back from the embedding cache if a resumed run needs them.
+    Other objects go through JsonPlusSerializer's own msgpack hooks, which are
+    private, so requirements.txt pins langgraph-checkpoint.
+    """
+
+    def _default(self, obj):
+        if isinstance(obj, Chunk):
+            return ormsgpack.Ext(EXT_CHUNK, obj.to_bytes(include_embedding=False))
+        return _msgpack_default(obj)
+
+    def _ext_hook(self, code: int, data: bytes):
+        if code == EXT_CHUNK:
+            return Chunk.from_bytes(data)
+        return self._unpack_ext_hook(code, data)
+
+    def dumps_typed(self, obj: Any) -> tuple[str, bytes]:
+        if obj is None or isinstance(obj, (bytes, bytearray)):
+            return super().dumps_typed(obj)
+        return "msgpack", ormsgpack.packb(obj, default=self._default, option=_option)
+
+    def loads_typed(self, data: tuple[str, bytes]) -> Any:
+        type_, data_ = data
+        if type_ == "msgpack":
+            return ormsgpack.unpackb(data_, ext_hook=self._ext_hook, option=ormsgpack.OPT_NON_STR_KEYS)
+        return super().loads_typed(data)
+
+
+class SqliteCheckpointer(SqliteSaver):
+    """SqliteSaver that stores channel values once per version and keeps only recent checkpoints.
+
+    Like MemorySaver, a checkpoint row holds only the channel versions; every
+    channel value is written to the blobs table once, when its version changes.
+    A step that updates `index` therefore writes that value alone, not the
+    chunks and the text again. The async methods run the synchronous ones in a
+    worker thread; SqliteSaver already serializes access to its connection.
+    After every checkpoint the thread's history is pruned to the `keep` most
+    recent ones, which is all that is needed to resume an interrupted run, plus
+    the ancestors their delta channels are replayed from (back to the channels'
+    last snapshot), and the blobs they no longer reference are dropped, so the
+    file stays bounded.
+    """
+
+    def __init__(self, path: str, keep: Optional[int] = 3, serde=None):
+        super().__init__(sqlite3.connect(path, check_same_thread=False), serde=serde)
+        self.keep = keep
+
+    def setup(self) -> None:
+        if self.is_setup:
+            return
+        super().setup()
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS blobs (thread_id TEXT NOT NULL, checkpoint_ns TEXT NOT NULL DEFAULT '', "
+            "channel TEXT NOT NULL, version TEXT NOT NULL, type TEXT, value BLOB, "
+            "PRIMARY KEY (thread_id, checkpoint_ns, channel, version))"
+        )
+        self.conn.commit()
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        checkpoint = checkpoint.copy()
+        values = checkpoint.pop("channel_values")
+        configurable = config["configurable"]
+        rows = []
+        for channel, version in new_versions.items():
+            # A channel without a value (e.g. cleared) is stored as "empty", like MemorySaver does
+            type_, value = self.serde.dumps_typed(values[channel]) if channel in values else ("empty", b"")
+            rows.append((str(configurable["thread_id"]), configurable["checkpoint_ns"], channel, str(version), type_, value))
+        with self.cursor() as cur:
+            cur.executemany(
+                "INSERT OR REPLACE INTO blobs (thread_id, checkpoint_ns, channel, version, type, value) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+        next_config = super().put(config, {**checkpoint, "channel_values": {}}, metadata, new_versions)
+        if self.keep:
+            configurable = next_config["configurable"]
+            self._prune(configurable["thread_id"], configurable.get("checkpoint_ns", ""), self.keep)
+        return next_config
+
+    def _load(self, item):
+        # Fill a stored checkpoint's channel values from the blobs of its channel versions
+        if item is None:
+            return None
+        configurable = item.config["configurable"]
+        versions = item.checkpoint["channel_versions"]
+        with self.cursor(transaction=False) as cur:
+            cur.execute(
+                "SELECT channel, version, type, value FROM blobs WHERE thread_id = ? AND checkpoint_ns = ?",
+                (str(configurable["thread_id"]), configurable.get("checkpoint_ns", ""))
+            )
+            values = {
+                channel: self.serde.loads_typed((type_, value))
+                for channel, version, type_, value in cur.fetchall()
+                if str(versions.get(channel)) == version and type_ != "empty"
+            }
+        return item._replace(checkpoint={**item.checkpoint, "channel_values": values})
+
+    def get_tuple(self, config):
+        return self._load(super().get_tuple(config))
+
+    def list(self, config, *, filter: Optional[dict[str, Any]] = None, before=None, limit: Optional[int] = None):
+        # The parent's generator holds the connection lock until it is exhausted
+        items = list(super().list(config, filter=filter, before=before, limit=limit))
+        for item in items:
+            yield self._load(item)
+
+    def get_delta_channel_history(self, *, config, channels):
+        # SqliteSaver's fast path reads values inline from checkpoint rows; here they live in blobs
+        return BaseCheckpointSaver.get_delta_channel_history(self, config=config, channels=channels)
+
+    def delete_thread(self, thread_id: str) -> None:
+        super().delete_thread(thread_id)
+        with self.cursor() as cur:
+            cur.execute("DELETE FROM blobs WHERE thread_id = ?", (str(thread_id),))
+
+    def _prune(self, thread_id: str, checkpoint_ns: str, keep: int):
+        with self.cursor() as cur:
+            # Checkpoint ids are time ordered, so the newest ones sort first
+            cur.execute(
+                "SELECT checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata FROM checkpoints "
+                "WHERE thread_id = ? AND checkpoint_ns = ? ORDER BY checkpoint_id DESC",
+                (thread_id, checkpoint_ns)
+            )
+            rows = cur.fetchall()
+            if len(rows) <= keep:
+                return
+            versions = {row[0]: self.serde.loads_typed((row[2], row[3]))["channel_versions"] for row in rows}
+            by_id = {row[0]: row for row in rows}
+            # Delta channels are rebuilt by replaying writes since their last snapshot, so the
+            # ancestors back to it are kept too
+            oldest = rows[keep - 1]
+            pending = self._unsnapshotted(oldest, versions[oldest[0]])
+            while pending and oldest[1] in by_id:
+                oldest = by_id[oldest[1]]
+                pending &= self._unsnapshotted(oldest, versions[oldest[0]])
+            for table in ("checkpoints", "writes"):
+                cur.execute(
+                    f"DELETE FROM {table} WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id < ?",
+                    (thread_id, checkpoint_ns, oldest[0])
+                )
+            # Drop the blobs no remaining checkpoint refers to
+            referenced = {
+                (channel, str(version))
+                for checkpoint_id, channel_versions in versions.items() if checkpoint_id >= oldest[0]
+                for channel, version in channel_versions.items()
+            }
+            cur.execute(
+                "SELECT channel, version FROM blobs WHERE thread_id = ? AND checkpoint_ns = ?",
+                (thread_id, checkpoint_ns)
+            )
+            unreferenced = [key for key in cur.fetchall() if tuple(key) not in referenced]
+            cur.executemany(
+                "DELETE FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?",
+                [(thread_id, checkpoint_ns, channel, version) for channel, version in unreferenced]
+            )
+
+    @staticmethod
+    def _unsnapshotted(row, channel_versions) -> set[str]:
+        # Delta channels updated since their last snapshot, whose value at this checkpoint
+        # depends on the writes of its ancestors
+        counters = json.loads(row[4]).get("counters_since_delta_snapshot") or {}
+        return {channel for channel, (updates, _) in counters.items() if updates and channel in channel_versions}
+
+    def prune(self, thread_ids: Sequence[str], *, strategy: str = "keep_latest") -> None:
+        """Drop old checkpoints of `thread_ids` ("keep_latest") or the threads entirely ("delete")."""
+        self.setup()
+        for thread_id in thread_ids:
+            if strategy == "delete":
+                self.delete_thread(thread_id)
+                continue
+            with self.cursor(transaction=False) as cur:
+                cur.execute("SELECT DISTINCT checkpoint_ns FROM checkpoints WHERE thread_id = ?", (thread_id,))
+                namespaces = [row[0] for row in cur.fetchall()]
+            for checkpoint_ns in namespaces:
+                self._prune(thread_id, checkpoint_ns, 1)
+
+    async def aget_tuple(self, config):
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config, *, filter: Optional[dict[str, Any]] = None, before=None,
+                    limit: Optional[int] = None) -> AsyncIterator:
+        items = await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for item in items:
+            yield item
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+    async def aprune(self, thread_ids: Sequence[str], *, strategy: str = "keep_latest") -> None:
+        await asyncio.to_thread(self.prune, thread_ids, strategy=strategy)
@@ -1,19 +1,110 @@
-from dataclasses import dataclass
+import re
+import struct
+from typing import Iterable, Optional
+
+import numpy as np
+
+from fingerprints import fingerprint
+
+# Lengths of the text, the keywords and the embedding (in floats) that start a serialized chunk
+_HEADER = struct.Struct("<III")
+
 
-@dataclass
 class Chunk:
-    text: str
-    metadata: str
+    """A chunk of text, its keywords and, once a store has embedded it, its embedding.
+
+    The text is fixed at construction, so its fingerprint is computed once and
+    used as the hash. The embedding is a float32 array shared by every lookup
+    and write of the chunk, and by its `with_metadata` copies, so its text is
+    embedded at most once.
+    """
 
-    def __init__(self, metadata: str = "", text: str = ""):
-        self.text = text
+    __slots__ = ("_text", "metadata", "_embedding", "_fingerprint")
+
+    def __init__(self, metadata: str = "", text: str = "", embedding=None):
+        self._text = text
         self.metadata = metadata
+        self._fingerprint = None
+        # One-element cell, so copies see an embedding attached after they were made
+        self._embedding = [None]
+        self.embedding = embedding
+
+    @property
+    def text(self) -> str:
+        return self._text
+
+    @property
+    def fingerprint(self) -> str:
+        if self._fingerprint is None:
+            self._fingerprint = fingerprint(self._text)
+        return self._fingerprint
+
+    @property
+    def embedding(self) -> Optional[np.ndarray]:
+        return self._embedding[0]
+
+    @embedding.setter
+    def embedding(self, value):
+        self._embedding[0] = None if value is None else np.asarray(value, dtype=np.float32)
+
+    @property
+    def keywords(self) -> tuple[str, ...]:
+        """The comma separated keywords of `metadata` as a tuple."""
+        return tuple(keyword for keyword in (part.strip(" -*\t") for part in re.split(r"[,\n]", self.metadata)) if keyword)
+
+    @keywords.setter
+    def keywords(self, keywords: Iterable[str]):
+        self.metadata = ", ".join(keywords)
+
+    def with_metadata(self, metadata: str) -> "Chunk":
+        """A copy with other keywords that shares the fingerprint and embedding."""
+        chunk = Chunk(metadata, self._text)
+        chunk._fingerprint = self._fingerprint
+        chunk._embedding = self._embedding
+        return chunk
+
+    def to_bytes(self, include_embedding: bool = True) -> bytes:
+        text = self._text.encode("utf-8")
+        metadata = self.metadata.encode("utf-8")
+        embedding = self.embedding.tobytes() if include_embedding and self.embedding is not None else b""
+        return _HEADER.pack(len(text), len(metadata), len(embedding) // 4) + text + metadata + embedding
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "Chunk":
+        text_length, metadata_length, size = _HEADER.unpack_from(data)
+        start = _HEADER.size
+        text = data[start:start + text_length].decode("utf-8")
+        start += text_length
+        metadata = data[start:start + metadata_length].decode("utf-8")
+        start += metadata_length
+        chunk = cls(metadata, text)
+        if size:
+            chunk.embedding = np.frombuffer(data, dtype=np.float32, count=size, offset=start).copy()
+        return chunk
+
+    @classmethod
+    def coerce(cls, value) -> "Chunk":
+        """Accept a Chunk or the dict form older checkpoints and events carry."""
+        if isinstance(value, dict):
+            return cls(value.get("metadata", ""), value.get("text", ""))
+        return value
 
     def to_dict(self) -> dict:
         return {
             "text": self.text,
             "metadata": self.metadata
         }
-    
+
+    def __eq__(self, other):
+        if not isinstance(other, Chunk):
+            return NotImplemented
+        return self._text == other._text and self.metadata == other.metadata
+
+    def __hash__(self):
+        return hash(self.fingerprint)
+
+    def __repr__(self):
+        return f"Chunk(metadata={self.metadata!r}, text={self.text!r})"
+
     def __str__(self):
         return f"\033[92m{self.metadata}\033[0m\n{self.text}"
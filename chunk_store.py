@@ -1,52 +1,581 @@
 from chunk import Chunk
+from concurrent.futures import ThreadPoolExecutor
+from fingerprints import FingerprintIndex, fingerprint
+from instrumentation import count, log, observe, span
+from keywords import keyword_terms, sparse_vector
 from langchain_core.documents import Document
+from scheduler import with_context
+import json
+import numpy as np
+import os
+import threading
+import uuid
+
+def embed_chunks(embeddings, chunks):
+  """Return the embedding of every chunk, embedding the ones without one in a single request."""
+  missing = [chunk for chunk in chunks if chunk.embedding is None]
+  if missing:
+    for chunk, vector in zip(missing, embeddings.embed_documents([chunk.text for chunk in missing])):
+      chunk.embedding = vector
+  return [chunk.embedding for chunk in chunks]
+
+def embed_chunk(embeddings, chunk):
+  if chunk.embedding is None:
+    chunk.embedding = embeddings.embed_query(chunk.text)
+  return chunk.embedding
 
 class ChunkLocalStore:
-  def __init__(self):
+  """In-memory vector index with the same interface as ChunkPineconeStore.
+
+  Embeddings are kept normalized in one contiguous float32 matrix, so a lookup
+  is a single matrix-vector product. Exact duplicates (same text up to case
+  and whitespace) are answered from a fingerprint index without embedding the
+  chunk. Chunks keep the embedding computed for their lookup, so storing them
+  does not embed them again. Without an embeddings model the store only does
+  exact matching. With a path, the store is saved there after every flush.
+  """
+
+  def __init__(self, embeddings=None, similarity_threshold=0.90, capacity=1024, frequencies=None, path=None):
+    self.embeddings = embeddings
+    self.similarity_threshold = similarity_threshold  # Adjust this threshold as needed (0-1)
     self.chunks: list[Chunk] = []
+    self.ids: list[str] = []
+    self._capacity = capacity
+    self._vectors = None
+    self._fingerprints: dict[str, int] = {}
+    # Rows of removed chunks, kept so row numbers stay stable
+    self._removed: set[int] = set()
+    # Optional DocumentFrequencies kept in step with the stored chunks, for the local keyword engine
+    self.frequencies = frequencies
+    self.path = path
+    self._lock = threading.Lock()
+
+  @staticmethod
+  def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+  def _append(self, stored_id, chunk, vector):
+    with self._lock:
+      row = len(self.chunks)
+      if vector is not None:
+        if self._vectors is None:
+          self._vectors = np.zeros((self._capacity, vector.shape[0]), dtype=np.float32)
+        elif row >= self._vectors.shape[0] or not self._vectors.flags.writeable:
+          # Grow by doubling; this also copies a read-only memory-mapped matrix on first write
+          grown = np.zeros((max(row * 2, self._capacity), self._vectors.shape[1]), dtype=np.float32)
+          grown[:row] = self._vectors[:row]
+          self._vectors = grown
+        self._vectors[row] = vector
+      self.chunks.append(chunk)
+      self.ids.append(stored_id)
+      self._fingerprints.setdefault(chunk.fingerprint, row)
 
   def addChunk(self, chunk: Chunk):
-    self.chunks.append(chunk)
+    stored_id = str(uuid.uuid4())
+    vector = None
+    if self.embeddings is not None:
+      vector = self._normalize(embed_chunk(self.embeddings, chunk))
+    self._append(stored_id, chunk, vector)
+    if self.frequencies is not None:
+      self.frequencies.add(chunk.text)
+    return stored_id
+
+  def flush(self):
+    # Writes are applied immediately, so a flush only persists them
+    if self.path:
+      self.save(self.path)
+    return []
+
+  def removeChunks(self, stored_ids, tombstone=False):
+    """Stop the given chunks from matching; rows are zeroed in place, so tombstoning is the same as deleting."""
+    stored_ids = set(stored_ids)
+    with self._lock:
+      rows = [row for row, stored_id in enumerate(self.ids) if stored_id in stored_ids and row not in self._removed]
+      if self._vectors is not None and rows:
+        if not self._vectors.flags.writeable:
+          self._vectors = np.array(self._vectors)
+        self._vectors[rows] = 0.0
+      self._removed.update(rows)
+      self._fingerprints = {}
+      for row, chunk in enumerate(self.chunks):
+        if row not in self._removed:
+          self._fingerprints.setdefault(chunk.fingerprint, row)
+    if self.frequencies is not None:
+      for row in rows:
+        self.frequencies.remove(self.chunks[row].text)
+    return len(rows)
+
+  def _document(self, row, score):
+    chunk = self.chunks[row]
+    return Document(id=self.ids[row], page_content=chunk.text, metadata={"keywords": chunk.metadata, "score": float(score)})
+
+  def findExact(self, chunk):
+    row = self._fingerprints.get(chunk.fingerprint)
+    return self._document(row, 1.0) if row is not None else None
+
+  def _bestMatches(self, queries, k=3):
+    # Snapshot the matrix so concurrent appends don't change it under the product
+    with self._lock:
+      size = len(self.chunks)
+      vectors = self._vectors
+    if vectors is None or size == 0:
+      return [None] * len(queries)
+
+    scores = queries @ vectors[:size].T
+    k = min(k, size)
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    found = []
+    for i, candidates in enumerate(top):
+      best = max(candidates, key=lambda row: scores[i, row])
+      observe("similarity_score", float(scores[i, best]), store="local")
+      found.append(self._document(best, scores[i, best]) if scores[i, best] >= self.similarity_threshold else None)
+    return found
 
   def findChunk(self, chunk: Chunk):
-    for c in self.chunks:
-      if c.metadata == chunk.metadata and c.text == chunk.text:
-        return c
-    return None
+    exact = self.findExact(chunk)
+    if exact or self.embeddings is None:
+      return exact
+    query = self._normalize([embed_chunk(self.embeddings, chunk)])
+    return self._bestMatches(query)[0]
+
+  def findChunks(self, chunks):
+    if not chunks:
+      return []
+    found = [self.findExact(chunk) for chunk in chunks]
+    if self.embeddings is None:
+      return found
+
+    # Exact duplicates are answered from the fingerprint index and never embedded
+    missing = [i for i, doc in enumerate(found) if doc is None]
+    if not missing:
+      return found
+
+    queries = self._normalize(embed_chunks(self.embeddings, [chunks[i] for i in missing]))
+    remaining = self._findWithin([chunks[i] for i in missing], self._bestMatches(queries), queries, missing)
+    for i, doc in zip(missing, remaining):
+      found[i] = doc
+    return found
+
+  def findWithinDocument(self, chunks, found):
+    """Fill the gaps in `found` with matches against earlier chunks of the same document."""
+    if self.embeddings is None:
+      return found
+    queries = self._normalize(embed_chunks(self.embeddings, chunks))
+    return self._findWithin(chunks, list(found), queries, range(len(chunks)))
+
+  def _findWithin(self, chunks, found, queries, positions):
+    # positions holds the document index of each chunk, for reporting the match
+    within = queries @ queries.T
+    fps = [chunk.fingerprint for chunk in chunks]
+    for i in range(len(chunks)):
+      if found[i] is None:
+        for j in range(i):
+          if fps[i] == fps[j] or within[i, j] >= self.similarity_threshold:
+            found[i] = Document(
+                page_content=chunks[j].text,
+                metadata={"keywords": chunks[j].metadata, "chunk_index": positions[j], "score": float(within[i, j])}
+            )
+            break
+    return found
+
+  def save(self, path):
+    """Write the matrix to <path>.npy and the chunk metadata to <path>.json."""
+    with self._lock:
+      size = len(self.chunks)
+      vectors = self._vectors[:size] if self._vectors is not None else np.zeros((0, 0), dtype=np.float32)
+      # Written to temporary files and renamed, since the matrix may be memory-mapped from <path>.npy
+      with open(f"{path}.npy.tmp", "wb") as f:
+        np.save(f, vectors)
+      with open(f"{path}.json.tmp", "w", encoding="utf-8") as f:
+        json.dump({
+            "ids": self.ids,
+            "texts": [chunk.text for chunk in self.chunks],
+            "keywords": [chunk.metadata for chunk in self.chunks],
+            "removed": sorted(self._removed)
+        }, f)
+      os.replace(f"{path}.npy.tmp", f"{path}.npy")
+      os.replace(f"{path}.json.tmp", f"{path}.json")
+
+  @classmethod
+  def load(cls, path, embeddings=None, similarity_threshold=0.90, frequencies=None):
+    """Load a saved store, memory-mapping the matrix instead of reading it into memory.
+
+    The texts of the chunks that are not removed are added to `frequencies`.
+    """
+    store = cls(embeddings, similarity_threshold, frequencies=frequencies)
+    with open(f"{path}.json", encoding="utf-8") as f:
+      meta = json.load(f)
+    vectors = np.load(f"{path}.npy", mmap_mode="r")
+    store._vectors = vectors if vectors.size else None
+    store.ids = meta["ids"]
+    store.chunks = [Chunk(keywords, text) for text, keywords in zip(meta["texts"], meta["keywords"])]
+    # Removed rows were saved zeroed; their fingerprints must not match either
+    store._removed = set(meta.get("removed", []))
+    for row, chunk in enumerate(store.chunks):
+      if row not in store._removed:
+        store._fingerprints.setdefault(chunk.fingerprint, row)
+        if frequencies is not None:
+          frequencies.add(chunk.text)
+    return store
 
   def __str__(self):
     chunk_strs = [str(chunk) for chunk in self.chunks]
     return "\n".join(chunk_strs)
   
 class ChunkPineconeStore:
-  def __init__(self, vectorstore):
+  def __init__(self, vectorstore, embeddings, index, text_key="text",
+               batch_size=50, batch_bytes=1_000_000, flush_interval=5.0, query_concurrency=8,
+               fingerprints=None, lsh=None, max_candidates=20, namespace=None, keyword_search="off",
+               hybrid_alpha=0.8, frequencies=None):
+    # embeddings is expected to be the CachedEmbeddings the vectorstore was built with;
+    # chunks also keep the embedding from their lookup, so flush reuses it
     self.vectorstore = vectorstore
+    self.embeddings = embeddings
+    self.index = index
+    self.text_key = text_key
+    # Every read and write goes to this namespace, e.g. one per source or tenant
+    self.namespace = namespace
+    # "off" queries by embedding only, "filter" only considers stored chunks sharing a
+    # keyword, and "hybrid" ranks candidates by a sparse-dense query weighted by
+    # hybrid_alpha (sparse values are then stored too, which needs a dotproduct index)
+    if keyword_search not in ("off", "filter", "hybrid"):
+      raise ValueError(f"Unknown keyword search '{keyword_search}'")
+    self.keyword_search = keyword_search
+    self.hybrid_alpha = hybrid_alpha
     self.similarity_threshold = 0.90  # Adjust this threshold as needed (0-1)
+    self.query_concurrency = query_concurrency
+    # Local index of content fingerprints, so exact duplicates skip embedding and querying
+    self.fingerprints = fingerprints if fingerprints is not None else FingerprintIndex()
+    # Optional MinHashLSH prefilter: chunks with no bucket match skip embedding and
+    # querying, and up to max_candidates bucket matches are reranked without an ANN query
+    self.lsh = lsh
+    self.max_candidates = max_candidates
+    # Optional DocumentFrequencies kept in step with the stored chunks, for the local keyword engine
+    self.frequencies = frequencies
+
+    # Write-behind buffer: chunks are upserted in batches once batch_size chunks
+    # or batch_bytes of text are pending, or flush_interval seconds have passed
+    self.batch_size = batch_size
+    self.batch_bytes = batch_bytes
+    self.flush_interval = flush_interval
+    self._pending: list[tuple[str, Chunk]] = []
+    self._pending_bytes = 0
+    self._lock = threading.Lock()
+    self._timer = None
 
   def addChunk(self, chunk):
-    document = Document(
-        page_content=chunk.text,
-        metadata={"keywords": chunk.metadata}
-    )
-    stored_id = self.vectorstore.add_documents([document])[0]
+    # The ID is assigned up front so callers can record it before the chunk is flushed
+    stored_id = str(uuid.uuid4())
+    self.fingerprints.add(chunk.fingerprint, stored_id, chunk.text, chunk.metadata)
+    if self.lsh is not None:
+      self.lsh.add(stored_id, chunk.text)
+    if self.frequencies is not None:
+      self.frequencies.add(chunk.text)
+    with self._lock:
+      self._pending.append((stored_id, chunk))
+      self._pending_bytes += len(chunk.text.encode("utf-8")) + len(chunk.metadata.encode("utf-8"))
+      full = len(self._pending) >= self.batch_size or self._pending_bytes >= self.batch_bytes
+      if not full and self._timer is None and self.flush_interval:
+        self._timer = threading.Timer(self.flush_interval, self._flush_on_deadline)
+        self._timer.daemon = True
+        self._timer.start()
+    if full:
+      self.flush()
     return stored_id
 
+  def flush(self):
+    with self._lock:
+      pending = self._pending
+      self._pending = []
+      self._pending_bytes = 0
+      if self._timer is not None:
+        self._timer.cancel()
+        self._timer = None
+    if not pending:
+      return []
+
+    try:
+      # Chunks carry the embedding from findChunk, so this is one batched upsert
+      vectors = embed_chunks(self.embeddings, [chunk for _, chunk in pending])
+      with span("vector_db", operation="upsert") as values:
+        values["batch_size"] = len(pending)
+        self.index.upsert(vectors=[self._record(stored_id, chunk, vector) for (stored_id, chunk), vector in zip(pending, vectors)],
+                          namespace=self.namespace)
+    except Exception:
+      # Put the batch back so a later flush can retry it
+      with self._lock:
+        self._pending = pending + self._pending
+        self._pending_bytes += sum(len(c.text.encode("utf-8")) + len(c.metadata.encode("utf-8")) for _, c in pending)
+      raise
+
+    log("flushed", "info", chunks=len(pending))
+    return [stored_id for stored_id, _ in pending]
+
+  def removeChunks(self, stored_ids, tombstone=False):
+    """Delete stored chunks, or with tombstone mark them "removed" so lookups ignore them but they can be audited."""
+    stored_ids = set(stored_ids)
+    if not stored_ids:
+      return 0
+    with self._lock:
+      # Buffered chunks are dropped before they ever reach Pinecone
+      texts = [chunk.text for stored_id, chunk in self._pending if stored_id in stored_ids]
+      self._pending = [(stored_id, chunk) for stored_id, chunk in self._pending if stored_id not in stored_ids]
+      self._pending_bytes = sum(len(c.text.encode("utf-8")) + len(c.metadata.encode("utf-8")) for _, c in self._pending)
+    self.fingerprints.discard(stored_ids)
+    if self.lsh is not None:
+      for stored_id in stored_ids:
+        self.lsh.remove(stored_id)
+    if self.frequencies is not None:
+      texts += self._storedTexts(stored_ids)
+      for text in texts:
+        self.frequencies.remove(text)
+    with span("vector_db", operation="update" if tombstone else "delete") as values:
+      values["batch_size"] = len(stored_ids)
+      if tombstone:
+        for stored_id in stored_ids:
+          self.index.update(id=stored_id, set_metadata={"removed": True}, namespace=self.namespace)
+      else:
+        self.index.delete(ids=list(stored_ids), namespace=self.namespace)
+    log("chunks_removed", "info", chunks=len(stored_ids), tombstone=tombstone)
+    return len(stored_ids)
+
+  def _storedTexts(self, stored_ids, batch_size=100):
+    # Texts of flushed chunks that are not tombstoned already
+    stored_ids = list(stored_ids)
+    texts = []
+    for start in range(0, len(stored_ids), batch_size):
+      fetched = self.index.fetch(ids=stored_ids[start:start + batch_size], namespace=self.namespace)
+      for vector in fetched.vectors.values():
+        metadata = vector.metadata or {}
+        if not metadata.get("removed"):
+          texts.append(metadata.get(self.text_key, ""))
+    return texts
+
+  def _record(self, stored_id, chunk, vector):
+    terms = keyword_terms(chunk.keywords)
+    # keyword_terms is the normalized list the keyword filter matches; keywords stays as extracted
+    record = {
+        "id": stored_id,
+        "values": vector.tolist(),
+        "metadata": {"keywords": chunk.metadata, "keyword_terms": terms, "fingerprint": chunk.fingerprint, self.text_key: chunk.text}
+    }
+    if self.keyword_search == "hybrid" and terms:
+      record["sparse_values"] = sparse_vector(terms)
+    return record
+
+  def _flush_on_deadline(self):
+    with self._lock:
+      self._timer = None
+    try:
+      self.flush()
+    except Exception as e:
+      log("deadline_flush_failed", "warning", error=str(e))
+
+  def findExact(self, chunk):
+    # Also covers buffered chunks, which are not searchable in Pinecone yet
+    entry = self.fingerprints.get(chunk.fingerprint)
+    if entry is None:
+      return None
+    stored_id, text, keywords = entry
+    return Document(id=stored_id, page_content=text, metadata={"keywords": keywords, "score": 1.0})
+
+  def rebuildLocalIndexes(self, namespace=None):
+    """Fill the fingerprint and LSH indexes from the vectors already stored in Pinecone."""
+    count = 0
+    namespace = namespace or self.namespace or ""
+    for ids in self.index.list(namespace=namespace):
+      fetched = self.index.fetch(ids=list(ids), namespace=namespace)
+      for stored_id, vector in fetched.vectors.items():
+        metadata = vector.metadata or {}
+        text = metadata.get(self.text_key, "")
+        fp = metadata.get("fingerprint") or fingerprint(text)
+        self.fingerprints.add(fp, stored_id, text, metadata.get("keywords", ""))
+        if self.lsh is not None:
+          self.lsh.add(stored_id, text)
+        count += 1
+    return count
+
   def findChunk(self, chunk):
-    # Get more results to filter
-    results = self.vectorstore.similarity_search_with_score(
-        chunk.text,
-        k=3  # Get top 5 results to filter
+    exact = self.findExact(chunk)
+    if exact:
+      return exact
+    return self._search(chunk)
+
+  def _search(self, chunk, vector=None):
+    candidates = None
+    if self.lsh is not None:
+      candidates = self.lsh.candidates(chunk.text)
+      if not candidates:
+        count("lsh_prefilter", result="no_candidates")
+        return None
+      if len(candidates) > self.max_candidates:
+        count("lsh_prefilter", result="too_many")
+        candidates = None
+      else:
+        count("lsh_prefilter", result="rerank")
+
+    if vector is None:
+      vector = embed_chunk(self.embeddings, chunk)
+    if candidates is not None:
+      return self._bestMatch(self._rerank(vector, [stored_id for stored_id, _ in candidates]))
+    # Buffered chunks are not searchable in Pinecone yet, so they are scored here; the
+    # buffer is read before the query so a chunk flushed in between is not missed
+    pending = self._pendingRecords(self._terms(chunk))
+    results = self._query(vector, chunk) + self._score(vector, pending)
+    return self._bestMatch(sorted(results, key=lambda result: result[1], reverse=True))
+
+  def _pendingRecords(self, terms=None, ids=None):
+    # (stored_id, text, keywords, embedding) of buffered chunks, which carry their own embeddings;
+    # with terms, only those sharing a keyword, like the query's metadata filter
+    with self._lock:
+      pending = [
+          (stored_id, chunk) for stored_id, chunk in self._pending
+          if (ids is None or stored_id in ids) and (not terms or set(terms) & set(keyword_terms(chunk.keywords)))
+      ]
+    if not pending:
+      return []
+    vectors = embed_chunks(self.embeddings, [chunk for _, chunk in pending])
+    return [(stored_id, chunk.text, chunk.metadata, vector) for (stored_id, chunk), vector in zip(pending, vectors)]
+
+  @staticmethod
+  def _score(vector, records):
+    # Exact cosine similarity of the query to each (stored_id, text, keywords, embedding) record
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(vector)) or 1.0
+    results = []
+    for stored_id, text, keywords, values in records:
+      values = np.asarray(values, dtype=np.float32)
+      score = float(vector @ values) / (norm * (float(np.linalg.norm(values)) or 1.0))
+      results.append((Document(id=stored_id, page_content=text, metadata={"keywords": keywords}), score))
+    return results
+
+  def _rerank(self, vector, ids):
+    # Score LSH candidates by exact cosine similarity instead of running an ANN query
+    records = self._pendingRecords(ids=set(ids))
+    pending = {record[0] for record in records}
+    fetch_ids = [stored_id for stored_id in ids if stored_id not in pending]
+    if fetch_ids:
+      with span("vector_db", operation="fetch") as values:
+        values["batch_size"] = len(fetch_ids)
+        fetched = self.index.fetch(ids=fetch_ids, namespace=self.namespace)
+      for stored_id, record in fetched.vectors.items():
+        metadata = record.metadata or {}
+        records.append((stored_id, metadata.get(self.text_key, ""), metadata.get("keywords", ""), record.values))
+    return sorted(self._score(vector, records), key=lambda result: result[1], reverse=True)
+
+  def findChunks(self, chunks):
+    """Find a similar stored chunk for every chunk of a document at once.
+
+    All texts are embedded in one request and the Pinecone queries run
+    concurrently. A chunk with no stored match is also checked against the
+    earlier chunks of the same batch, so near-identical chunks within one
+    document are flagged against each other.
+    """
+    if not chunks:
+      return []
+
+    # Exact duplicates are answered from the fingerprint index and never embedded
+    found = [self.findExact(chunk) for chunk in chunks]
+    missing = [i for i, doc in enumerate(found) if doc is None]
+    if not missing:
+      return found
+
+    vectors = embed_chunks(self.embeddings, [chunks[i] for i in missing])
+    with ThreadPoolExecutor(max_workers=min(self.query_concurrency, len(missing))) as executor:
+      # The executor threads keep the caller's request priority
+      matches = list(executor.map(with_context(self._search), [chunks[i] for i in missing], vectors))
+    remaining = self._findWithin([chunks[i] for i in missing], matches, vectors, missing)
+    for i, doc in zip(missing, remaining):
+      found[i] = doc
+    return found
+
+  def findWithinDocument(self, chunks, found):
+    """Fill the gaps in `found` with matches against earlier chunks of the same document."""
+    # The chunks carry the embeddings from their lookups, so this makes no API calls
+    vectors = embed_chunks(self.embeddings, chunks)
+    return self._findWithin(chunks, list(found), vectors, range(len(chunks)))
+
+  def _findWithin(self, chunks, found, vectors, positions):
+    # positions holds the document index of each chunk, for reporting the match
+    vectors = [np.asarray(vector, dtype=np.float32) for vector in vectors]
+    norms = [float(np.linalg.norm(vector)) or 1.0 for vector in vectors]
+    fps = [chunk.fingerprint for chunk in chunks]
+    for i in range(len(chunks)):
+      if found[i] is None:
+        for j in range(i):
+          score = 1.0 if fps[i] == fps[j] else float(vectors[i] @ vectors[j]) / (norms[i] * norms[j])
+          if score >= self.similarity_threshold:
+            log("within_document_match", chunk_index=positions[i], match_index=positions[j], score=score)
+            found[i] = Document(
+                page_content=chunks[j].text,
+                metadata={"keywords": chunks[j].metadata, "chunk_index": positions[j], "score": float(score)}
+            )
+            break
+    return found
+
+  def _terms(self, chunk):
+    # Chunks without keywords (e.g. looked up before keyword extraction) get a dense-only query
+    return keyword_terms(chunk.keywords) if chunk is not None and self.keyword_search != "off" else []
+
+  def _query(self, vector, chunk=None):
+    terms = self._terms(chunk)
+    vector = np.asarray(vector, dtype=np.float32).tolist()
+    with span("vector_db", operation="query") as values:
+      values["top_k"] = 3
+      values["keyword_search"] = self.keyword_search if terms else "off"
+      if terms and self.keyword_search == "hybrid":
+        return self._hybridQuery(vector, terms)
+      return self.vectorstore.similarity_search_by_vector_with_score(
+          vector,
+          k=3,  # Get top 3 results to filter
+          filter=self._filter(terms),
+          namespace=self.namespace
+      )
+
+  @staticmethod
+  def _filter(terms):
+    # Tombstoned chunks stay in the index until they are deleted, so the query itself
+    # leaves them out; filtering them from the top 3 could leave no live match
+    live = {"removed": {"$ne": True}}
+    return {**live, "keyword_terms": {"$in": terms}} if terms else live
+
+  def _hybridQuery(self, vector, terms):
+    # Convex combination of the dense and sparse scores; matches come back in hybrid
+    # order but are scored by dense cosine similarity, so the decision bands still apply
+    sparse = sparse_vector(terms)
+    query = np.asarray(vector, dtype=np.float32)
+    # Both parts are unit length, so alpha weighs them the same for any embedding model
+    query /= float(np.linalg.norm(query)) or 1.0
+    response = self.index.query(
+        vector=(query * self.hybrid_alpha).tolist(),
+        sparse_vector={"indices": sparse["indices"], "values": [value * (1 - self.hybrid_alpha) for value in sparse["values"]]},
+        top_k=3,
+        include_metadata=True,
+        include_values=True,
+        filter=self._filter([]),
+        namespace=self.namespace
     )
-    
+    results = []
+    for match in response["matches"]:
+      metadata = dict(match["metadata"] or {})
+      text = metadata.pop(self.text_key, "")
+      values = np.asarray(match["values"], dtype=np.float32)
+      score = float(query @ values) / (float(np.linalg.norm(values)) or 1.0)
+      results.append((Document(id=match["id"], page_content=text, metadata=metadata), score))
+    return results
+
+  def _bestMatch(self, results):
     if len(results) == 0:
         return None
 
     # Filter results based on similarity score and metadata
     for doc, score in results:
-        print("\033[93m- Checking similar doc with score", str(score))
-        #print('\033[0m' + doc.page_content + '\033[0m')
+        observe("similarity_score", float(score), store="pinecone")
         if score >= self.similarity_threshold:
+            doc.metadata["score"] = float(score)
             return doc
 
     return None
-  
@@ -2,7 +2,8 @@
 
 from __future__ import annotations
 
-from dataclasses import dataclass, fields
+import os
+from dataclasses import dataclass, field, fields
 from typing import Optional
 
 from langchain_core.runnables import RunnableConfig
@@ -11,6 +12,54 @@ from langchain_core.runnables import RunnableConfig
 @dataclass(kw_only=True)
 class Configuration:
     is_graph_studio: bool = False
+    # "pinecone", "local" (in-memory vector index), "fake" (fully offline) or
+    # "fake-pinecone" (offline, through the Pinecone store layer)
+    backend: str = field(default_factory=lambda: os.getenv("GRAPH_BACKEND", "pinecone"))
+    # "immediate" interrupts on every similar chunk, "deferred" queues them
+    # and asks for all decisions in one review at the end
+    review_mode: str = "immediate"
+    # Similar chunks scoring at least auto_skip_score are skipped and those
+    # below review_score are indexed without asking; only the band in between
+    # goes to review. Every automatic decision is logged with its score. The stores
+    # only report matches scoring at least 0.90, so a lower review_score acts as 0.90
+    auto_skip_score: float = 0.98
+    review_score: float = 0.90
+    # Reuse cached responses for prompts the LLM has already answered
+    llm_cache: bool = True
+    # "sequential" extracts keywords one chunk per iterate step,
+    # "parallel" extracts them for all chunks at once after adjust
+    keyword_mode: str = "sequential"
+    keyword_concurrency: int = 8
+    # "sonnet", "openai" (the small model) or "local" (no model call, TF-IDF
+    # weighted RAKE over the stored chunks)
+    keyword_engine: str = "sonnet"
+    # With a model engine, send up to this many chunks in one keyword prompt
+    keyword_batch_size: int = 1
+    # Stream the adjust response and start keyword extraction and lookups
+    # for each chunk as soon as it is complete
+    streaming: bool = False
+    # "llm" asks the model to split the text, "semantic" cuts it where the
+    # embeddings of adjacent sentences drift apart, and "hybrid" does the same
+    # but hands the regions around ambiguous cuts to the model. "fused" splits
+    # and adjusts in one JSON generation, falling back to "llm" when the result
+    # doesn't cover the text
+    splitter: str = "llm"
+    split_min_tokens: int = 40
+    split_max_tokens: int = 400
+    # Sentences further apart than this percentile of the document's adjacent
+    # distances start a new chunk; cuts within split_ambiguity of it are ambiguous
+    split_percentile: float = 80.0
+    split_ambiguity: float = 0.05
+    # Documents longer than this many tokens are split and adjusted in windows
+    # of this size, concurrently; 0 disables windowing
+    long_document_tokens: int = 6000
+    window_overlap: int = 1  # paragraphs repeated at the start of the next window
+    window_concurrency: int = 4
+    # Vector store namespace the document's chunks are looked up in and stored to,
+    # e.g. one per source or tenant
+    namespace: str = field(default_factory=lambda: os.getenv("PINECONE_NAMESPACE", ""))
+    # Look up similar chunks for the whole document in one batch before iterating
+    batch_lookup: bool = False
 
     @classmethod
     def from_runnable_config(
@@ -0,0 +1,127 @@
+"""Confidence bands for similar chunks and an audit log of every index/skip decision.
+
+Run `python decisions.py [log]` to replay a decision log and suggest thresholds.
+"""
+
+import argparse
+import json
+import threading
+import time
+from typing import Optional
+
+from fingerprints import fingerprint
+
+
+def confidence_band(score: Optional[float], auto_skip_score: float, review_score: float) -> str:
+    """Return "skip", "store" or "review" for a similar chunk found with `score`."""
+    if score is None:
+        return "review"
+    if score >= auto_skip_score:
+        return "skip"
+    if score < review_score:
+        return "store"
+    return "review"
+
+
+class DecisionLog:
+    """Append-only JSON lines log of decisions on chunks that have a similar stored chunk.
+
+    `source` is "auto" for decisions taken by the confidence bands and "human"
+    for answers given in review. Without a path the entries are only kept in memory.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.entries: list[dict] = []
+        self._lock = threading.Lock()
+
+    def record(self, chunk_index: int, text: str, score: Optional[float], decision: str,
+               source: str, thread_id: Optional[str] = None):
+        entry = {
+            "time": time.time(),
+            "thread_id": thread_id,
+            "chunk_index": chunk_index,
+            "fingerprint": fingerprint(text),
+            "score": score,
+            "decision": decision,
+            "source": source
+        }
+        with self._lock:
+            self.entries.append(entry)
+            if self.path:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry) + "\n")
+        return entry
+
+    @staticmethod
+    def read(path: str) -> list[dict]:
+        with open(path, encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+
+def suggest_thresholds(entries: list[dict], precision: float = 0.99, min_samples: int = 20) -> dict:
+    """Suggest auto_skip_score and review_score from past human decisions.
+
+    auto_skip_score is the lowest score above which at least `precision` of the
+    human answers were "skip", and review_score the highest score below which at
+    least `precision` were "store". Each band needs `min_samples` answers, otherwise
+    its threshold is None and that band should stay disabled.
+    """
+    human = sorted(
+        [(entry["score"], entry["decision"]) for entry in entries if entry["source"] == "human" and entry["score"] is not None],
+        key=lambda item: item[0]
+    )
+    scores = sorted({score for score, _ in human})
+
+    auto_skip_score = None
+    for threshold in reversed(scores):
+        band = [decision for score, decision in human if score >= threshold]
+        if len(band) < min_samples:
+            continue
+        if band.count("skip") / len(band) < precision:
+            break
+        auto_skip_score = threshold
+
+    review_score = None
+    for k, threshold in enumerate(scores):
+        band = [decision for score, decision in human if score <= threshold]
+        if len(band) < min_samples:
+            continue
+        if band.count("store") / len(band) < precision:
+            break
+        # Scores strictly below review_score are stored, so use the next observed score
+        review_score = scores[k + 1] if k + 1 < len(scores) else threshold + 1e-6
+    if auto_skip_score is not None and review_score is not None:
+        review_score = min(review_score, auto_skip_score)
+
+    automated = [
+        (score, decision) for score, decision in human
+        if confidence_band(score, auto_skip_score or float("inf"), review_score or float("-inf")) != "review"
+    ]
+    disagreements = [
+        (score, decision) for score, decision in automated
+        if confidence_band(score, auto_skip_score or float("inf"), review_score or float("-inf")) != decision
+    ]
+    return {
+        "human_decisions": len(human),
+        "auto_decisions": sum(1 for entry in entries if entry["source"] == "auto"),
+        "auto_skip_score": auto_skip_score,
+        "review_score": review_score,
+        "would_automate": len(automated),
+        "disagreements": len(disagreements)
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Suggest confidence band thresholds from a decision log")
+    parser.add_argument("log", nargs="?", default="decisions.jsonl")
+    parser.add_argument("--precision", type=float, default=0.99, help="required agreement with past human answers")
+    parser.add_argument("--min-samples", type=int, default=20, help="human answers needed per band")
+    args = parser.parse_args()
+
+    report = suggest_thresholds(DecisionLog.read(args.log), args.precision, args.min_samples)
+    print(f"{report['human_decisions']} human and {report['auto_decisions']} automatic decisions in {args.log}")
+    print("Suggested auto_skip_score:", report["auto_skip_score"] if report["auto_skip_score"] is not None else "not enough evidence")
+    print("Suggested review_score:", report["review_score"] if report["review_score"] is not None else "not enough evidence")
+    print(f"These would have automated {report['would_automate']} of the human decisions, "
+          f"{report['disagreements']} of them differently from the reviewer")
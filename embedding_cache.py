@@ -0,0 +1,110 @@
+import hashlib
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Optional
+
+from langchain_core.embeddings import Embeddings
+
+from instrumentation import count, span
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that embeds each distinct text only once.
+
+    Vectors are keyed by a hash of the model name and the text. They are kept in
+    an in-process LRU and, when a path is given, in a SQLite file so re-ingesting
+    unchanged text does not call the embedding API again.
+    """
+
+    def __init__(self, embeddings: Embeddings, max_size: int = 10000, path: Optional[str] = None):
+        self.embeddings = embeddings
+        self.max_size = max_size
+        self.model = getattr(embeddings, "model", None) or type(embeddings).__name__
+        self.hits = 0
+        self.misses = 0
+        self._memory: OrderedDict[str, list[float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+            self._db.commit()
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model}\0{text}".encode("utf-8")).hexdigest()
+
+    def _get(self, key: str) -> Optional[list[float]]:
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                return vector
+            if self._db is None:
+                return None
+            row = self._db.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        vector = array("f", row[0]).tolist()
+        self._put(key, vector, persist=False)
+        return vector
+
+    def _put(self, key: str, vector: list[float], persist: bool = True):
+        with self._lock:
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_size:
+                self._memory.popitem(last=False)
+            if persist and self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                    (key, array("f", vector).tobytes())
+                )
+                self._db.commit()
+
+    def _lookup(self, texts: list[str]) -> tuple[list[str], dict[str, list[float]], dict[str, str]]:
+        keys = [self.key(text) for text in texts]
+        found: dict[str, list[float]] = {}
+        missing: dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key in found or key in missing:
+                continue
+            vector = self._get(key)
+            if vector is None:
+                missing[key] = text
+            else:
+                found[key] = vector
+        self.hits += len(found)
+        self.misses += len(missing)
+        count("embedding_cache", len(found), result="hit")
+        count("embedding_cache", len(missing), result="miss")
+        return keys, found, missing
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        keys, found, missing = self._lookup(texts)
+        if missing:
+            with span("embedding", model=self.model) as values:
+                values["batch_size"] = len(missing)
+                vectors = self.embeddings.embed_documents(list(missing.values()))
+            for key, vector in zip(missing, vectors):
+                self._put(key, vector)
+                found[key] = vector
+        return [found[key] for key in keys]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        keys, found, missing = self._lookup(texts)
+        if missing:
+            with span("embedding", model=self.model) as values:
+                values["batch_size"] = len(missing)
+                vectors = await self.embeddings.aembed_documents(list(missing.values()))
+            for key, vector in zip(missing, vectors):
+                self._put(key, vector)
+                found[key] = vector
+        return [found[key] for key in keys]
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return (await self.aembed_documents([text]))[0]
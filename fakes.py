@@ -0,0 +1,233 @@
+"""Deterministic offline stand-ins for the models, embeddings and Pinecone index used by the graph."""
+
+import asyncio
+import json
+import re
+import time
+from types import SimpleNamespace
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding, Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model that answers the graph's prompts without calling an API.
+
+    Split and adjust prompts return their input unchanged (fused ones as
+    JSON with one chunk per paragraph), and keyword
+    prompts return the capitalized words of the text (one "<id>: keywords"
+    line per passage for batched ones). Every call waits
+    `latency` seconds, and streamed responses `token_latency` per word, to
+    stand in for API round trips.
+    """
+
+    latency: float = 0.0
+    token_latency: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    @staticmethod
+    def capitalized(text: str) -> str:
+        words = re.findall(r"\b[A-Z][\w-]*", text)
+        return ", ".join(dict.fromkeys(words)) or "none"
+
+    def respond(self, prompt: str) -> str:
+        passages = re.findall(r'<passage id="(\d+)">(.*?)</passage>', prompt, re.DOTALL)
+        if passages:
+            return "\n".join(f"{i}: {self.capitalized(text)}" for i, text in passages)
+        if "<document>" in prompt:
+            text = prompt.split("<document>", 1)[1].split("</document>", 1)[0].strip()
+            paragraphs = [paragraph.strip() for paragraph in text.split("\n\n") if paragraph.strip()]
+            return json.dumps({"chunks": [{"source": paragraph, "text": paragraph} for paragraph in paragraphs]})
+        if "<chunks>" in prompt:
+            return prompt.split("<chunks>", 1)[1].split("</chunks>", 1)[0].strip()
+        if "<text>" in prompt:
+            text = prompt.split("<text>", 1)[1].split("</text>", 1)[0].strip()
+            if "keywords" in prompt:
+                return self.capitalized(text)
+            return text
+        return ""
+
+    def _usage(self, prompt: str, content: str) -> dict:
+        # Token counts estimated at four characters per token, like windowing.estimate_tokens
+        usage = {"input_tokens": len(prompt) // 4 + 1, "output_tokens": len(content) // 4 + 1}
+        usage["total_tokens"] = usage["input_tokens"] + usage["output_tokens"]
+        return usage
+
+    def _result(self, messages) -> ChatResult:
+        prompt = messages[-1].content
+        content = self.respond(prompt)
+        message = AIMessage(content=content, usage_metadata=self._usage(prompt, content))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self.latency)
+        return self._result(messages)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return self._result(messages)
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        prompt = messages[-1].content
+        content = self.respond(prompt)
+        for token in re.split(r"(?<=\s)", content):
+            time.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self._usage(prompt, content)))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        prompt = messages[-1].content
+        content = self.respond(prompt)
+        for token in re.split(r"(?<=\s)", content):
+            await asyncio.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self._usage(prompt, content)))
+
+
+class FakeEmbeddings(Embeddings):
+    """DeterministicFakeEmbedding with a fixed wait per request."""
+
+    def __init__(self, size: int = 1536, latency: float = 0.0):
+        self.embeddings = DeterministicFakeEmbedding(size=size)
+        self.latency = latency
+        self.calls = 0
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        self.calls += 1
+        time.sleep(self.latency)
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        self.calls += 1
+        time.sleep(self.latency)
+        return self.embeddings.embed_query(text)
+
+
+class FakePineconeIndex:
+    """In-memory index with the subset of the Pinecone Index API that ChunkPineconeStore uses.
+
+    Queries support namespaces, `$in` metadata filters and sparse-dense
+    vectors; dense scores are cosine similarities.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        # Namespace -> id -> (values, metadata, sparse values)
+        self.namespaces: dict[str, dict[str, tuple[list[float], dict, dict]]] = {}
+        self.requests = 0
+        # Normalized matrix of each namespace's vectors, rebuilt on the first query after an upsert
+        self._matrices: dict[str, tuple[list[str], np.ndarray]] = {}
+
+    def _request(self):
+        self.requests += 1
+        time.sleep(self.latency)
+
+    def _records(self, namespace) -> dict:
+        return self.namespaces.setdefault(namespace or "", {})
+
+    @staticmethod
+    def _matches(metadata: dict, filter) -> bool:
+        # Only the {"field": {"$in": [...]}} and {"field": {"$ne": value}} forms are supported
+        for field, condition in (filter or {}).items():
+            value = metadata.get(field)
+            if "$ne" in condition:
+                if value == condition["$ne"]:
+                    return False
+                continue
+            values = value if isinstance(value, list) else [value]
+            if not set(values) & set(condition["$in"]):
+                return False
+        return True
+
+    def upsert(self, vectors, namespace=None, **kwargs):
+        self._request()
+        records = self._records(namespace)
+        for vector in vectors:
+            records[vector["id"]] = (list(vector["values"]), dict(vector.get("metadata") or {}), vector.get("sparse_values"))
+        self._matrices.pop(namespace or "", None)
+
+    def query(self, vector, top_k=3, include_metadata=True, include_values=False, namespace=None, filter=None,
+              sparse_vector=None, **kwargs):
+        self._request()
+        records = self._records(namespace)
+        if not records:
+            return {"matches": []}
+        if (namespace or "") not in self._matrices:
+            ids = list(records)
+            matrix = np.array([records[stored_id][0] for stored_id in ids], dtype=np.float32)
+            self._matrices[namespace or ""] = (ids, matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12))
+        ids, matrix = self._matrices[namespace or ""]
+        query = np.asarray(vector, dtype=np.float32)
+        if sparse_vector is None:
+            query = query / max(float(np.linalg.norm(query)), 1e-12)
+        scores = matrix @ query
+        if sparse_vector is not None:
+            # Dotproduct of the sparse parts; the dense query keeps its alpha scaling
+            weights = dict(zip(sparse_vector["indices"], sparse_vector["values"]))
+            for i, stored_id in enumerate(ids):
+                stored = records[stored_id][2] or {"indices": [], "values": []}
+                scores[i] += sum(weights.get(index, 0.0) * value for index, value in zip(stored["indices"], stored["values"]))
+        allowed = [i for i, stored_id in enumerate(ids) if self._matches(records[stored_id][1], filter)]
+        top = sorted(allowed, key=lambda i: -scores[i])[:top_k]
+        return {"matches": [
+            {
+                "id": ids[i],
+                "score": float(scores[i]),
+                "metadata": dict(records[ids[i]][1]),
+                **({"values": records[ids[i]][0]} if include_values else {})
+            }
+            for i in top
+        ]}
+
+    def update(self, id, set_metadata=None, namespace=None, **kwargs):
+        self._request()
+        records = self._records(namespace)
+        if id in records:
+            values, metadata, sparse = records[id]
+            records[id] = (values, {**metadata, **(set_metadata or {})}, sparse)
+
+    def delete(self, ids, namespace=None, **kwargs):
+        self._request()
+        records = self._records(namespace)
+        for stored_id in ids:
+            records.pop(stored_id, None)
+        self._matrices.pop(namespace or "", None)
+
+    def fetch(self, ids, namespace=None, **kwargs):
+        self._request()
+        records = self._records(namespace)
+        return SimpleNamespace(vectors={
+            stored_id: SimpleNamespace(values=records[stored_id][0], metadata=records[stored_id][1])
+            for stored_id in ids if stored_id in records
+        })
+
+    def list(self, namespace=None, limit=100, **kwargs):
+        ids = list(self._records(namespace))
+        for start in range(0, len(ids), limit):
+            self._request()
+            yield ids[start:start + limit]
+
+
+class FakeVectorStore:
+    """Stands in for PineconeVectorStore over a FakePineconeIndex."""
+
+    def __init__(self, index: FakePineconeIndex, text_key: str = "text"):
+        self.index = index
+        self.text_key = text_key
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4, filter=None, namespace=None, **kwargs):
+        results = []
+        for match in self.index.query(embedding, top_k=k, filter=filter, namespace=namespace)["matches"]:
+            metadata = match["metadata"]
+            text = metadata.pop(self.text_key, "")
+            results.append((Document(id=match["id"], page_content=text, metadata=metadata), match["score"]))
+        return results
@@ -0,0 +1,68 @@
+"""Normalized content fingerprints for exact-duplicate detection."""
+
+import hashlib
+import sqlite3
+import threading
+from typing import Optional
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(text.lower().split())
+
+def fingerprint(text: str) -> str:
+    """Hash of the case- and whitespace-normalized text."""
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class FingerprintIndex:
+    """Map from fingerprint to the stored chunk, optionally persisted to SQLite.
+
+    Entries are (stored_id, text, keywords) tuples. Only the first chunk stored
+    for a fingerprint is kept.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self._entries: dict[str, tuple[str, str, str]] = {}
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS fingerprints "
+                "(fingerprint TEXT PRIMARY KEY, stored_id TEXT, text TEXT, keywords TEXT)"
+            )
+            self._db.commit()
+            for row in self._db.execute("SELECT fingerprint, stored_id, text, keywords FROM fingerprints"):
+                self._entries[row[0]] = (row[1], row[2], row[3])
+
+    def get(self, fp: str) -> Optional[tuple[str, str, str]]:
+        return self._entries.get(fp)
+
+    def add(self, fp: str, stored_id: str, text: str, keywords: str):
+        with self._lock:
+            if fp in self._entries:
+                return
+            self._entries[fp] = (stored_id, text, keywords)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR IGNORE INTO fingerprints (fingerprint, stored_id, text, keywords) VALUES (?, ?, ?, ?)",
+                    (fp, stored_id, text, keywords)
+                )
+                self._db.commit()
+
+    def discard(self, stored_ids):
+        """Forget the fingerprints of the given stored chunks."""
+        stored_ids = set(stored_ids)
+        with self._lock:
+            removed = [fp for fp, entry in self._entries.items() if entry[0] in stored_ids]
+            for fp in removed:
+                del self._entries[fp]
+            if self._db is not None and removed:
+                self._db.executemany("DELETE FROM fingerprints WHERE fingerprint = ?", [(fp,) for fp in removed])
+                self._db.commit()
+
+    def __contains__(self, fp: str) -> bool:
+        return fp in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -1,50 +1,39 @@
+from backends import (
+    get_chat_model, get_checkpointer, get_decision_log, get_embeddings, get_keyword_frequencies, get_response_cache,
+    get_store
+)
 from chunk import Chunk
-from chunk_store import ChunkPineconeStore
 from configuration import Configuration
+from decisions import confidence_band
+from instrumentation import log, span, timed
+from keywords import extract_keywords as extract_local_keywords, format_passages, parse_batch_keywords
+from splitter import ambiguous_regions, chunk_text, covers_text, keeps_source, semantic_split, split_sentences
 from graph_state import GraphState
-from langchain_pinecone import PineconeVectorStore
-from pinecone import Pinecone, ServerlessSpec
+from windowing import build_context, estimate_tokens, group_chunks, make_windows, stitch_chunks
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai import OpenAIEmbeddings
-from langchain_openai import ChatOpenAI
-from langchain_anthropic import ChatAnthropic
 from langgraph.graph import StateGraph, START, END
 from langchain_core.runnables import RunnableConfig
 from langchain_core.callbacks import adispatch_custom_event
 from langgraph.errors import NodeInterrupt
-from langgraph.checkpoint.memory import MemorySaver
-from dotenv import load_dotenv
-import os
-
-load_dotenv()
-
-pc = Pinecone()
-pc_index_name = os.getenv("PINECONE_INDEX_NAME")
-
-if pc_index_name not in pc.list_indexes().names():
-    pc.create_index(
-        name=pc_index_name,
-        dimension=1536,
-        metric="cosine",
-        spec=ServerlessSpec(cloud="aws", region="us-east-1"),
-    )
-    print(f"Index '{pc_index_name}' created successfully.")
-else:
-    print(f"Index '{pc_index_name}' already exists.")
-
-index = pc.Index(pc_index_name)
-
-embeddings = OpenAIEmbeddings()
-vectorstore = PineconeVectorStore(
-    index=index,
-    embedding=embeddings,
-    text_key="text"
-)
-
-sonnet = ChatAnthropic(model='claude-3-5-sonnet-20241022', temperature=0)
-openai = ChatOpenAI(model="gpt-4o-mini", temperature=0)
-
-indexes = ChunkPineconeStore(vectorstore)
+from langgraph.types import Overwrite
+from llm_cache import CachedChain
+from typing import Optional
+import asyncio
+import json
+import re
+
+def get_sonnet(config: RunnableConfig):
+    return get_chat_model("sonnet", Configuration.from_runnable_config(config).backend)
+
+def get_indexes(config: RunnableConfig):
+    configuration = Configuration.from_runnable_config(config)
+    return get_store(configuration.backend, configuration.namespace)
+
+def get_chain(prompt: ChatPromptTemplate, model, config: RunnableConfig):
+    # All prompts run at temperature 0, so identical inputs can reuse a cached response
+    if Configuration.from_runnable_config(config).llm_cache:
+        return CachedChain(prompt, model, get_response_cache())
+    return prompt | model
 
 prompt = """You are a text processing assistant. Your task is to break a given text into self-contained chunks if possible. Here's the text you'll be working with:
 
@@ -115,6 +104,59 @@ adjust_prompt = ChatPromptTemplate.from_messages([
     ("human", prompt)
 ])
 
+# Adjust prompt for one window of a long document, with a summary of the preceding windows
+prompt = prompt.replace(
+    "Here's the text divided into chunks you'll be working with:",
+    "Here is a summary of the text that precedes these chunks:\n\n<context>\n{context}\n</context>\n\nHere's the text divided into chunks you'll be working with:"
+).replace(
+    "Locate the missing context in previous chunks",
+    "Locate the missing context in previous chunks or in the summary of the preceding text"
+)
+
+window_adjust_prompt = ChatPromptTemplate.from_messages([
+    ("system", ""),
+    ("human", prompt)
+])
+
+prompt = """You are a text processing assistant. Your task is to break a given text into self-contained chunks and to make sure each chunk has complete context. Here's the text you'll be working with:
+
+<document>
+{text}
+</document>
+
+Please follow these steps to process the text:
+
+1. Identify natural break points where the text can be divided into self-contained chunks:
+   - Each chunk should represent a complete thought or idea.
+   - Keep together sentences that complement each other such as a statement and an example of it.
+   - If the text is already self-contained, return it as a single chunk.
+
+2. For each chunk, resolve references that depend on earlier chunks, such as pronouns, demonstratives, undefined proper nouns and continuation phrases ("also", "additionally"), by inserting the minimal necessary context at the first relevant reference, using the exact wording of the earlier chunks. Do not change the meaning or tone, remove content or add information that is not in the text.
+
+3. Answer with a JSON object of this form and nothing else:
+{{"chunks": [{{"source": "...", "text": "..."}}]}}
+   - "source" is the chunk exactly as it appears in the text, with the original wording and punctuation
+   - "text" is the chunk with the missing context added, or the same as "source" if nothing is missing
+   - Chunks are listed in the order of the text, and together their sources contain the entire text"""
+
+fused_prompt = ChatPromptTemplate.from_messages([
+    ("system", ""),
+    ("human", prompt)
+])
+
+prompt = """Summarize the following text in at most three sentences. Keep the names of the people, companies, products, technologies and other entities it introduces, because the text that follows may refer to them. Here is the text:
+
+<text>
+{text}
+</text>
+
+Do not include any additional output besides the summary."""
+
+summary_prompt = ChatPromptTemplate.from_messages([
+    ("system", ""),
+    ("human", prompt)
+])
+
 prompt = """You will be given a short chunk of text. Your task is to extract keywords from this text. Here is the text:
 
 <text>
@@ -149,11 +191,132 @@ keyword_prompt = ChatPromptTemplate.from_messages([
     ("human", prompt)
 ])
 
+prompt = """You will be given several short passages of text. Your task is to extract keywords from each passage. Here are the passages:
+
+<passages>
+{passages}
+</passages>
+
+To extract keywords, follow these guidelines:
+1. Look for names or titles representing technologies, companies, products, or other entities.
+2. If there are no clear names or titles, identify unique terms that represent specific areas of work, industries, or concepts.
+3. Avoid verbs, common adjectives, and general nouns.
+4. Focus on nouns and proper nouns that are central to the main idea of the passage.
+5. Typically, you should aim to extract 1-5 keywords per passage, depending on its length and complexity.
+
+Answer with exactly one line per passage, in passage order, consisting of the passage id, a colon and the passage's keywords as a comma-separated list, for example:
+1: Apple, iPhone, AI
+
+Do not include any additional output besides these lines."""
+
+batch_keyword_prompt = ChatPromptTemplate.from_messages([
+    ("system", ""),
+    ("human", prompt)
+])
+
+# Chat model used by each model-backed keyword engine
+KEYWORD_MODELS = {"sonnet": "sonnet", "openai": "openai"}
+
+def is_long_document(text: str, configuration: Configuration) -> bool:
+    return 0 < configuration.long_document_tokens < estimate_tokens(text)
+
+def split_chunk_texts(content: str) -> list[str]:
+    return [chunk.strip() for chunk in content.split("\n\n") if chunk.strip()]
+
+def parse_fused_chunks(content: str, text: str) -> Optional[list[str]]:
+    """Adjusted chunk texts of a fused response, or None if it isn't valid.
+
+    The sources must cover the whole text, and every adjusted text must keep its
+    own source without adding words found nowhere in the document.
+    """
+    match = re.search(r"\{.*\}", content, re.DOTALL)
+    try:
+        items = json.loads(match.group())["chunks"]
+        sources = [item["source"].strip() for item in items]
+        texts = [item["text"].strip() for item in items]
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+    if not texts or not all(sources) or not all(texts) or not covers_text(text, sources):
+        return None
+    if not all(keeps_source(source, chunk_text, text) for source, chunk_text in zip(sources, texts)):
+        return None
+    # Blank lines separate chunks everywhere else
+    return [re.sub(r"\n\s*\n", "\n", chunk_text) for chunk_text in texts]
+
+async def split_fused(text: str, config: RunnableConfig) -> Optional[list[Chunk]]:
+    """Split and adjust in one generation; None when the response fails validation."""
+    chain = get_chain(fused_prompt, get_sonnet(config), config)
+    response = await chain.ainvoke({"text": text})
+    chunk_texts = parse_fused_chunks(response.content, text)
+    if chunk_texts is None:
+        log("fused_split_rejected", "warning", response_chars=len(response.content))
+        return None
+    for i, chunk_text in enumerate(chunk_texts):
+        log("chunk_split", index=i, text=chunk_text)
+    return [Chunk("", chunk_text) for chunk_text in chunk_texts]
+
+async def split_windows(chain, text: str, configuration: Configuration):
+    """Split a long document in overlapping windows concurrently and stitch the results."""
+    windows = make_windows(text, configuration.long_document_tokens, configuration.window_overlap)
+    log("split_windows", "info", windows=len(windows))
+    responses = await chain.abatch(
+        [{"text": window.text} for window in windows],
+        config=RunnableConfig(max_concurrency=configuration.window_concurrency)
+    )
+    chunk_texts = stitch_chunks(windows, [split_chunk_texts(response.content) for response in responses])
+    return [Chunk("", chunk_text) for chunk_text in chunk_texts]
+
+async def split_semantic(chain, text: str, configuration: Configuration):
+    """Split at drops in similarity between adjacent sentences; "hybrid" leaves ambiguous regions to the LLM."""
+    sentences = split_sentences(text)
+    vectors = []
+    if len(sentences) > 1:
+        # One embedding request for the whole document
+        vectors = await get_embeddings(configuration.backend).aembed_documents([sentence.text for sentence in sentences])
+    split = semantic_split(sentences, vectors, configuration.split_min_tokens, configuration.split_max_tokens,
+                           configuration.split_percentile)
+    if configuration.splitter == "semantic":
+        regions = [(start, end, False) for start, end in split.groups]
+    else:
+        regions = ambiguous_regions(split, configuration.split_ambiguity)
+
+    ambiguous = [(start, end) for start, end, is_ambiguous in regions if is_ambiguous]
+    responses = iter(await chain.abatch(
+        [{"text": chunk_text(sentences, start, end)} for start, end in ambiguous],
+        config=RunnableConfig(max_concurrency=configuration.window_concurrency)
+    ) if ambiguous else [])
+    chunk_texts = []
+    for start, end, is_ambiguous in regions:
+        if is_ambiguous:
+            chunk_texts.extend(split_chunk_texts(next(responses).content))
+        else:
+            chunk_texts.extend(chunk_text(sentences, *group) for group in split.groups if start <= group[0] < end)
+    log("semantic_split", "info", sentences=len(sentences), chunks=len(chunk_texts), llm_regions=len(ambiguous))
+    return [Chunk("", text) for text in chunk_texts]
+
 async def split_text(state: GraphState, config: RunnableConfig):
-    chain = split_prompt | sonnet
+    chain = get_chain(split_prompt, get_sonnet(config), config)
     if not state["text"] or state["text"].strip() == "Your input text here":
         raise ValueError("Please provide actual text content to process")
-    response = chain.invoke({"text": state["text"]})
+    configuration = Configuration.from_runnable_config(config)
+    if configuration.splitter in ("semantic", "hybrid"):
+        chunks = await split_semantic(chain, state["text"], configuration)
+        log("text_split", "info", chunks=len(chunks))
+        return {"chunks": chunks, "index": -1, "adjusted": False}
+    if configuration.splitter not in ("llm", "fused"):
+        raise ValueError(f"Unknown splitter '{configuration.splitter}'")
+    if is_long_document(state["text"], configuration):
+        # Windows are split and adjusted separately, so long documents are never fused
+        chunks = await split_windows(chain, state["text"], configuration)
+        log("text_split", "info", chunks=len(chunks))
+        return {"chunks": chunks, "index": -1, "adjusted": False}
+    if configuration.splitter == "fused":
+        chunks = await split_fused(state["text"], config)
+        if chunks is not None:
+            log("text_split", "info", chunks=len(chunks), fused=True)
+            return {"chunks": chunks, "index": -1, "adjusted": True}
+
+    response = await chain.ainvoke({"text": state["text"]})
 
     chunks = []
     for i, chunk in enumerate(response.content.split("\n\n")):
@@ -161,41 +324,180 @@ async def split_text(state: GraphState, config: RunnableConfig):
         if not chunk_text:
             continue
         
-        print('\nChunk #', i, '\033[93m', chunk_text, '\033[0m')
+        log("chunk_split", index=i, text=chunk_text)
         new_chunk = Chunk("", chunk_text)
         chunks.append(new_chunk)
 
-    print('Text split into', len(chunks), 'chunks\n')
+    log("text_split", "info", chunks=len(chunks))
 
-    return {"chunks": chunks, "index": -1}
+    return {"chunks": chunks, "index": -1, "adjusted": False}
 
 def get_chunk_from_state(state: GraphState, index: int) -> Chunk:
-    chunk_data = state["chunks"][index]
-    if isinstance(chunk_data, dict):
-        return Chunk(text=chunk_data['text'], metadata=chunk_data['metadata'])
-    return chunk_data
+    # Keywords live in the "keywords" channel; chunks in state are never modified, so
+    # they are applied to a copy. Copies share the embedding, so the one a lookup
+    # attaches is reused when the chunk is stored.
+    chunk = Chunk.coerce(state["chunks"][index])
+    keywords = (state.get("keywords") or {}).get(index)
+    if keywords is not None and keywords != chunk.metadata:
+        return chunk.with_metadata(keywords)
+    return chunk
+
+def new_document_state(chunks: list[Chunk], similar_chunks=None, similar_scores=None) -> dict:
+    # Per-document results are reset so a thread can process several documents
+    return {
+        "chunks": chunks,
+        "index": -1,
+        "similar_chunks": similar_chunks,
+        "similar_scores": similar_scores,
+        "keywords": Overwrite({}),
+        "stored_ids": Overwrite({}),
+        "review_queue": Overwrite([]),
+        "review_answers": None
+    }
+
+def chunk_from_document(doc) -> Chunk:
+    return Chunk(doc.metadata['keywords'], doc.page_content) if doc else None
+
+def score_from_document(doc) -> Optional[float]:
+    return doc.metadata.get('score') if doc else None
+
+async def get_keywords(texts: list[str], config: RunnableConfig) -> list[str]:
+    """Keywords for each text from the configured keyword engine."""
+    configuration = Configuration.from_runnable_config(config)
+    if configuration.keyword_engine == "local":
+        frequencies = get_keyword_frequencies(configuration.backend)
+        return [extract_local_keywords(text, frequencies) for text in texts]
+    if configuration.keyword_engine not in KEYWORD_MODELS:
+        raise ValueError(f"Unknown keyword engine '{configuration.keyword_engine}'")
+
+    model = get_chat_model(KEYWORD_MODELS[configuration.keyword_engine], configuration.backend)
+    run_config = RunnableConfig(max_concurrency=configuration.keyword_concurrency)
+    keywords: list[Optional[str]] = [None] * len(texts)
+    size = configuration.keyword_batch_size
+    if size > 1 and len(texts) > 1:
+        batches = [list(range(start, min(start + size, len(texts)))) for start in range(0, len(texts), size)]
+        chain = get_chain(batch_keyword_prompt, model, config)
+        responses = await chain.abatch(
+            [{"passages": format_passages([texts[i] for i in batch])} for batch in batches],
+            config=run_config
+        )
+        for batch, response in zip(batches, responses):
+            for position, found in parse_batch_keywords(response.content, len(batch)).items():
+                keywords[batch[position]] = found
+
+    # Texts missing from a batched answer get a prompt of their own
+    pending = [i for i, found in enumerate(keywords) if found is None]
+    if pending:
+        log("keyword_prompts", batched=len(texts) - len(pending), single=len(pending))
+        chain = get_chain(keyword_prompt, model, config)
+        responses = await chain.abatch([{"text": texts[i]} for i in pending], config=run_config)
+        for i, response in zip(pending, responses):
+            keywords[i] = response.content
+    return keywords
+
+async def add_chunk(config: RunnableConfig, chunk: Chunk) -> str:
+    # Store calls block on the scheduler's rate limits and retries, so they run off the
+    # event loop; otherwise async requests holding the same provider's slots could never finish
+    return await asyncio.to_thread(get_indexes(config).addChunk, chunk)
+
+def record_decision(state: GraphState, config: RunnableConfig, index: int, score, decision: str, source: str):
+    thread_id = (config.get("configurable") or {}).get("thread_id")
+    get_decision_log().record(index, get_chunk_from_state(state, index).text, score, decision, source, thread_id)
+
+async def stream_chunk_texts(chain, inputs):
+    """Yield chunk texts from a streamed response as each blank-line boundary arrives."""
+    buffer = ""
+    async for message in chain.astream(inputs):
+        buffer += message.content
+        while "\n\n" in buffer:
+            chunk_text, buffer = buffer.split("\n\n", 1)
+            if chunk_text.strip():
+                yield chunk_text.strip()
+    if buffer.strip():
+        yield buffer.strip()
+
+async def extract_keywords(state: GraphState, config: RunnableConfig):
+    configuration = Configuration.from_runnable_config(config)
+    if configuration.keyword_mode != "parallel":
+        return {}
+
+    chunks = [get_chunk_from_state(state, i) for i in range(len(state["chunks"]))]
+    # Exact duplicates of stored chunks reuse the stored keywords
+    indexes = get_indexes(config)
+    keywords = {}
+    for i, chunk in enumerate(chunks):
+        exact_doc = indexes.findExact(chunk) if not chunk.metadata else None
+        if exact_doc:
+            keywords[i] = exact_doc.metadata['keywords']
+            chunks[i] = chunk.with_metadata(keywords[i])
+    # Chunks handled by the streaming adjust pipeline already have keywords
+    pending = [i for i, chunk in enumerate(chunks) if not chunk.metadata]
+    if not pending:
+        return {"keywords": keywords}
+    log("extract_keywords", "info", chunks=len(pending), engine=configuration.keyword_engine,
+        concurrency=configuration.keyword_concurrency)
+
+    # Fan out the keyword requests, bounded by the configured concurrency
+    found = await get_keywords([chunks[i].text for i in pending], config)
+
+    for i, chunk_keywords in zip(pending, found):
+        keywords[i] = chunk_keywords
+        chunk = chunks[i].with_metadata(chunk_keywords)
+        await adispatch_custom_event(
+            "on_chunk_metadata_update",
+            {
+                "chunk_index": i,
+                "chunk": chunk
+            },
+            config=config
+        )
+
+    return {"keywords": keywords}
+
+async def lookup_chunks(state: GraphState, config: RunnableConfig):
+    configuration = Configuration.from_runnable_config(config)
+    if not configuration.batch_lookup or state.get("similar_chunks") is not None:
+        return {}
+
+    chunks = [get_chunk_from_state(state, i) for i in range(len(state["chunks"]))]
+    log("lookup_chunks", "info", chunks=len(chunks))
 
-async def iterate_chunks(state: GraphState):
+    # One embedding request and concurrent queries for the whole document
+    with span("store", operation="find_chunks") as values:
+        values["batch_size"] = len(chunks)
+        similar_docs = await asyncio.to_thread(get_indexes(config).findChunks, chunks)
+    return {
+        "similar_chunks": [chunk_from_document(doc) for doc in similar_docs],
+        "similar_scores": [score_from_document(doc) for doc in similar_docs]
+    }
+
+async def iterate_chunks(state: GraphState, config: RunnableConfig):
     currentIndex = state["index"] + 1
-    print("\033[91mIterate " + str(currentIndex + 1) + "/" + str(len(state["chunks"])) + "\033[0m")
     currentChunk = get_chunk_from_state(state, currentIndex)
-    print("Text:\033[92m", currentChunk.text, "\033[0m")
-    
-    # Get keywords for the current chunk
-    chain = keyword_prompt | sonnet
-    response = chain.invoke({"text": currentChunk.text})
-    currentChunk.metadata = response.content
-    print('Keywords:\033[92m', currentChunk.metadata, '\033[0m')
-
-    # Update the chunk in the state with its new metadata
-    state["chunks"][currentIndex] = currentChunk
-    state["index"] = currentIndex
+    log("iterate", index=currentIndex, total=len(state["chunks"]), text=currentChunk.text)
     
-    # Find similar chunks
-    similar_doc = find_similar_chunk(state)
-    if similar_doc:
-        print('\033[91mSimilar chunk found\033[0m')
-    state["similar_chunk"] = Chunk(similar_doc.metadata['keywords'], similar_doc.page_content) if similar_doc else None
+    # Exact duplicates of stored chunks need no keywords, embedding or vector query
+    exact_doc = get_indexes(config).findExact(currentChunk)
+    if exact_doc and not currentChunk.metadata:
+        currentChunk = currentChunk.with_metadata(exact_doc.metadata['keywords'])
+
+    # Get keywords for the current chunk unless the parallel pass already did
+    if not currentChunk.metadata:
+        currentChunk = currentChunk.with_metadata((await get_keywords([currentChunk.text], config))[0])
+    log("keywords", index=currentIndex, keywords=currentChunk.metadata)
+
+    # Find similar chunks, using the batch lookup result when there is one
+    if state.get("similar_chunks") is not None:
+        similar_chunk = state["similar_chunks"][currentIndex]
+        similar_score = (state.get("similar_scores") or [None] * len(state["chunks"]))[currentIndex]
+    elif exact_doc:
+        log("exact_duplicate", index=currentIndex)
+        similar_chunk, similar_score = chunk_from_document(exact_doc), score_from_document(exact_doc)
+    else:
+        similar_doc = await find_similar_chunk(currentChunk, config)
+        similar_chunk, similar_score = chunk_from_document(similar_doc), score_from_document(similar_doc)
+    if similar_chunk:
+        log("similar_chunk_found", "info", index=currentIndex, score=similar_score)
 
     # Dispatch event for UI update with new metadata
     await adispatch_custom_event(
@@ -207,24 +509,58 @@ async def iterate_chunks(state: GraphState):
         config=RunnableConfig()
     )
 
-    return state
+    # Only the per-chunk delta; the chunks list is not rewritten
+    return {
+        "index": currentIndex,
+        "keywords": {currentIndex: currentChunk.metadata},
+        "similar_chunk": similar_chunk,
+        "similar_score": similar_score if similar_chunk else None
+    }
 
-def find_similar_chunk(state: GraphState):
-    chunk = get_chunk_from_state(state, state["index"])
-    return indexes.findChunk(chunk)
+async def find_similar_chunk(chunk: Chunk, config: RunnableConfig):
+    with span("store", operation="find_chunk"):
+        return await asyncio.to_thread(get_indexes(config).findChunk, chunk)
 
-def chunk_action(state: GraphState):
+def get_band(state: GraphState, config: RunnableConfig) -> str:
+    configuration = Configuration.from_runnable_config(config)
+    return confidence_band(state.get("similar_score"), configuration.auto_skip_score, configuration.review_score)
+
+def chunk_action(state: GraphState, config: RunnableConfig):
     if state["similar_chunk"] is None:
         return "store"
+    elif get_band(state, config) != "review":
+        return "auto"
+    elif Configuration.from_runnable_config(config).review_mode == "deferred":
+        return "defer"
     else:
         return "prompt"
 
-async def index_chunk(state: GraphState):
-    print('\033[93mIndexing chunk\033[0m')
-    state["answer"] = None
+async def auto_decide(state: GraphState, config: RunnableConfig):
+    # Matches outside the review band are decided by score alone and logged for audit
+    band = get_band(state, config)
+    score = state.get("similar_score")
+    log("auto_decision", "info", index=state["index"], decision=band, score=score)
+    record_decision(state, config, state["index"], score, band, "auto")
+    if band == "skip":
+        await adispatch_custom_event(
+            "on_chunk_result",
+            {
+                "chunk_index": state["index"],
+                "result": f"Skipped automatically (score {score:.3f})"
+            },
+            config=config
+        )
+    return {}
+
+def auto_action(state: GraphState, config: RunnableConfig):
+    return "store" if get_band(state, config) == "store" else "endcheck"
+
+async def index_chunk(state: GraphState, config: RunnableConfig):
+    log("index_chunk", index=state["index"])
     chunk = get_chunk_from_state(state, state["index"])
     
-    indexes.addChunk(chunk)
+    with span("store", operation="add_chunk"):
+        stored_id = await add_chunk(config, chunk)
 
     await adispatch_custom_event(
         "on_chunk_result",
@@ -235,19 +571,15 @@ async def index_chunk(state: GraphState):
         config=RunnableConfig()
     )
 
-    return state
+    return {"answer": None, "stored_ids": {state["index"]: stored_id}}
 
 async def prompt_chunk(state: GraphState, config: RunnableConfig):
     answer = state.get("answer")
-    print("\033[91mEntering prompt_chunk\033[0m, answer:", answer)
-    similar_chunk = state["similar_chunk"]
-    print("similar_chunk:", similar_chunk)
-    if isinstance(similar_chunk, dict):
-        similar_chunk = Chunk(text=similar_chunk['text'], metadata=similar_chunk['metadata'])
+    log("prompt_chunk", index=state["index"], answer=answer)
+    similar_chunk = Chunk.coerce(state["similar_chunk"])
     
     if answer is not None:
         return {
-            **state,
             "answer": answer,
             "similar_chunk": None
         }
@@ -259,6 +591,7 @@ async def prompt_chunk(state: GraphState, config: RunnableConfig):
             "chunk_index": state["index"],
             "chunk_text": similar_chunk.text,
             "chunk_keywords": similar_chunk.metadata,
+            "score": state.get("similar_score"),
             "current_chunk": current_chunk  # Include the current chunk with its metadata
         }, 
         config=config
@@ -266,20 +599,17 @@ async def prompt_chunk(state: GraphState, config: RunnableConfig):
     
     if config.get("is_graph_studio"):
         return {
-            **state,
             "waiting_for_input": True,
             "options": ["y", "n"],
             "prompt_message": "Do you want to index this chunk?",
         }
     
-    print("\033[93mRaising interrupt for user decision\033[0m")
+    log("interrupt", "info", reason="similar_chunk", index=state["index"])
     raise NodeInterrupt("Do you want to index this chunk?")
 
-async def process_decision(state: GraphState):
-    print("\033[93mEntering process_decision with state\033[0m")
+async def process_decision(state: GraphState, config: RunnableConfig):
     answer = state.get("answer")
-    
-    print(f"\033[93mProcessing decision with answer: {answer}\033[0m")
+    record_decision(state, config, state["index"], state.get("similar_score"), "store" if answer == "y" else "skip", "human")
 
     if answer == "y":
         result = "store"
@@ -294,25 +624,230 @@ async def process_decision(state: GraphState):
             config=RunnableConfig()
         )
 
-    
-    print(f"\033[93mDecision result: {result}\033[0m")
+    log("process_decision", index=state["index"], answer=answer, result=result)
     return result
 
+async def defer_chunk(state: GraphState, config: RunnableConfig):
+    # Queue the conflict for the batch review at the end and keep going
+    log("defer_chunk", index=state["index"])
+    item = {
+        "chunk_index": state["index"],
+        "similar_chunk": state["similar_chunk"],
+        "score": state.get("similar_score")
+    }
+
+    await adispatch_custom_event(
+        "on_chunk_result",
+        {
+            "chunk_index": state["index"],
+            "result": "Queued for review"
+        },
+        config=config
+    )
+
+    return {"review_queue": [item], "similar_chunk": None}
+
+async def review_chunks(state: GraphState, config: RunnableConfig):
+    review_queue = state.get("review_queue") or []
+    answers = state.get("review_answers")
+    log("review_chunks", "info", pending=len(review_queue), answered=answers is not None)
+
+    if answers is not None:
+        # Keys are chunk indexes; they arrive as strings when set through JSON
+        answers = {int(index): answer for index, answer in answers.items()}
+        stored_ids = {}
+        for item in review_queue:
+            index = item["chunk_index"]
+            approved = answers.get(index) == "y"
+            record_decision(state, config, index, item.get("score"), "store" if approved else "skip", "human")
+            if approved:
+                stored_ids[index] = await add_chunk(config, get_chunk_from_state(state, index))
+            await adispatch_custom_event(
+                "on_chunk_result",
+                {
+                    "chunk_index": index,
+                    "result": "Indexed" if approved else "Skipped"
+                },
+                config=config
+            )
+        # The approved chunks are written in one batch by the flush node
+        return {"review_queue": Overwrite([]), "review_answers": None, "stored_ids": stored_ids}
+
+    await adispatch_custom_event(
+        "on_review_required",
+        {
+            "items": [
+                {
+                    "chunk_index": item["chunk_index"],
+                    "current_chunk": get_chunk_from_state(state, item["chunk_index"]),
+                    "score": item.get("score"),
+                    "similar_chunk": Chunk.coerce(item["similar_chunk"])
+                }
+                for item in review_queue
+            ]
+        },
+        config=config
+    )
+
+    if Configuration.from_runnable_config(config).is_graph_studio:
+        return {
+            "waiting_for_input": True,
+            "prompt_message": "Which of these chunks do you want to index?",
+        }
+
+    log("interrupt", "info", reason="batch_review", pending=len(review_queue))
+    raise NodeInterrupt(f"{len(review_queue)} chunks need review. Which of them do you want to index?")
+
 def end_check(state: GraphState):
-    state["answer"] = None
-    return state
+    return {"answer": None}
 
 def is_end(state: GraphState):
-    print("\033[91mIsEnd:" + str(state["index"] + 1) + "/" + str(len(state["chunks"])) + "\033[0m\n")
+    log("is_end", index=state["index"], total=len(state["chunks"]))
     if state["index"] >= len(state["chunks"])-1:
-        return END
+        return "review" if state.get("review_queue") else "flush"
     else:
         return "iterate"
 
+async def flush_chunks(state: GraphState, config: RunnableConfig):
+    # Write any chunks still buffered in the store before the graph ends
+    with span("store", operation="flush"):
+        stored_ids = await asyncio.to_thread(get_indexes(config).flush)
+    await adispatch_custom_event(
+        "on_chunks_flushed",
+        {
+            "count": len(stored_ids),
+            "stored_ids": state.get("stored_ids") or {}
+        },
+        config=config
+    )
+    return {}
+
+async def stream_adjusted_chunks(chain, chunks_text: str, config: RunnableConfig):
+    """Adjust chunks from a token stream, starting downstream work on each chunk as it completes.
+
+    Every completed chunk is shown through on_text_split right away and gets its
+    keywords and, with batch_lookup, its similarity lookup while the rest of the
+    response is still generating.
+    """
+    configuration = Configuration.from_runnable_config(config)
+    indexes = get_indexes(config)
+    semaphore = asyncio.Semaphore(configuration.keyword_concurrency)
+    adjusted_chunks = []
+    similar_docs = []
+    tasks = []
+
+    async def process_chunk(i: int, chunk: Chunk):
+        async with semaphore:
+            chunk = chunk.with_metadata((await get_keywords([chunk.text], config))[0])
+        # Chunks already shown through on_text_split are replaced, not modified
+        adjusted_chunks[i] = chunk
+        await adispatch_custom_event(
+            "on_chunk_metadata_update",
+            {
+                "chunk_index": i,
+                "chunk": chunk
+            },
+            config=config
+        )
+        if configuration.batch_lookup:
+            similar_docs[i] = await asyncio.to_thread(indexes.findChunk, chunk)
+
+    try:
+        async for chunk_text in stream_chunk_texts(chain, {"chunks": chunks_text}):
+            log("chunk_adjusted", index=len(adjusted_chunks), text=chunk_text)
+            chunk = Chunk("", chunk_text)
+            adjusted_chunks.append(chunk)
+            similar_docs.append(None)
+            await adispatch_custom_event(
+                "on_text_split",
+                {
+                    "chunk_count": len(adjusted_chunks),
+                    "chunks": list(adjusted_chunks),
+                    "complete": False
+                },
+                config=config
+            )
+            tasks.append(asyncio.create_task(process_chunk(len(adjusted_chunks) - 1, chunk)))
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    log("text_adjusted", "info", chunks=len(adjusted_chunks))
+
+    await adispatch_custom_event(
+        "on_text_split",
+        {
+            "chunk_count": len(adjusted_chunks),
+            "chunks": adjusted_chunks,
+            "complete": True
+        },
+        config=config
+    )
+
+    similar_chunks = similar_scores = None
+    if configuration.batch_lookup:
+        similar_docs = await asyncio.to_thread(indexes.findWithinDocument, adjusted_chunks, similar_docs)
+        similar_chunks = [chunk_from_document(doc) for doc in similar_docs]
+        similar_scores = [score_from_document(doc) for doc in similar_docs]
+
+    return new_document_state(adjusted_chunks, similar_chunks, similar_scores)
+
+async def adjust_windows(chunks: list[Chunk], config: RunnableConfig):
+    """Adjust a long document window by window, concurrently.
+
+    Every window gets a compact summary of the windows before it as context, so
+    references to earlier parts of the document can still be resolved.
+    """
+    configuration = Configuration.from_runnable_config(config)
+    groups = group_chunks([chunk.text for chunk in chunks], configuration.long_document_tokens)
+    texts = ["\n\n".join(chunks[i].text for i in group) for group in groups]
+    log("adjust_windows", "info", windows=len(texts))
+    run_config = RunnableConfig(max_concurrency=configuration.window_concurrency)
+
+    # Summaries come from the small model; the last window's summary is never needed
+    summary_chain = get_chain(summary_prompt, get_chat_model("openai", configuration.backend), config)
+    summaries = await summary_chain.abatch([{"text": text} for text in texts[:-1]], config=run_config)
+    summaries = [summary.content.strip() for summary in summaries]
+
+    chain = get_chain(window_adjust_prompt, get_sonnet(config), config)
+    responses = await chain.abatch(
+        [
+            {"chunks": text, "context": build_context(summaries[:k], configuration.long_document_tokens // 4)}
+            for k, text in enumerate(texts)
+        ],
+        config=run_config
+    )
+    return [
+        Chunk("", chunk_text)
+        for response in responses
+        for chunk_text in split_chunk_texts(response.content)
+    ]
+
 async def adjust_chunks(state: GraphState, config: RunnableConfig):
-    chain = adjust_prompt | sonnet
+    chain = get_chain(adjust_prompt, get_sonnet(config), config)
     chunks_text = "\n\n".join(chunk.text for chunk in state["chunks"])
-    response = chain.invoke({"chunks": chunks_text})
+    configuration = Configuration.from_runnable_config(config)
+    if state.get("adjusted") or is_long_document(state["text"], configuration):
+        if state.get("adjusted"):
+            adjusted_chunks = list(state["chunks"])
+        else:
+            adjusted_chunks = await adjust_windows(state["chunks"], config)
+        log("text_adjusted", "info", chunks=len(adjusted_chunks))
+        await adispatch_custom_event(
+            "on_text_split",
+            {
+                "chunk_count": len(adjusted_chunks),
+                "chunks": adjusted_chunks,
+                "complete": True
+            },
+            config=config
+        )
+        return new_document_state(adjusted_chunks)
+    if configuration.streaming:
+        return await stream_adjusted_chunks(chain, chunks_text, config)
+
+    response = await chain.ainvoke({"chunks": chunks_text})
     
     adjusted_chunks = []
     for i, chunk_text in enumerate(response.content.split("\n\n")):
@@ -320,45 +855,58 @@ async def adjust_chunks(state: GraphState, config: RunnableConfig):
         if not chunk_text:
             continue
         
-        print('\nAdjusted Chunk #', i, '\033[93m', chunk_text, '\033[0m')
+        log("chunk_adjusted", index=i, text=chunk_text)
         new_chunk = Chunk("", chunk_text)
         adjusted_chunks.append(new_chunk)
 
-    print('Adjusted', len(adjusted_chunks), 'chunks\n')
+    log("text_adjusted", "info", chunks=len(adjusted_chunks))
 
     await adispatch_custom_event(
         "on_text_split",
         {
             "chunk_count": len(adjusted_chunks),
-            "chunks": adjusted_chunks
+            "chunks": adjusted_chunks,
+            "complete": True
         },
         config=config
     )
 
-    return {"chunks": adjusted_chunks, "index": -1}
+    return new_document_state(adjusted_chunks)
 
 workflow = StateGraph(GraphState, config_schema=Configuration)
-workflow.add_node("split", split_text)
-workflow.add_node("adjust", adjust_chunks)
-workflow.add_node("iterate", iterate_chunks)
-workflow.add_node("prompt", prompt_chunk)
-workflow.add_node("store", index_chunk)
-workflow.add_node("endcheck", end_check)
+workflow.add_node("split", timed("split", split_text))
+workflow.add_node("adjust", timed("adjust", adjust_chunks))
+workflow.add_node("keywords", timed("keywords", extract_keywords))
+workflow.add_node("lookup", timed("lookup", lookup_chunks))
+workflow.add_node("iterate", timed("iterate", iterate_chunks))
+workflow.add_node("prompt", timed("prompt", prompt_chunk))
+workflow.add_node("store", timed("store", index_chunk))
+workflow.add_node("endcheck", timed("endcheck", end_check))
+workflow.add_node("auto", timed("auto", auto_decide))
+workflow.add_node("defer", timed("defer", defer_chunk))
+workflow.add_node("review", timed("review", review_chunks))
+workflow.add_node("flush", timed("flush", flush_chunks))
 
 workflow.add_edge(START, "split")
 workflow.add_edge("split", "adjust")
-workflow.add_edge("adjust", "iterate")
+workflow.add_edge("adjust", "keywords")
+workflow.add_edge("keywords", "lookup")
+workflow.add_edge("lookup", "iterate")
 workflow.add_conditional_edges("iterate", chunk_action)
 workflow.add_conditional_edges("prompt", process_decision)
+workflow.add_conditional_edges("auto", auto_action)
 workflow.add_edge("store", "endcheck")
+workflow.add_edge("defer", "endcheck")
 workflow.add_conditional_edges(
     "endcheck", 
     is_end,
-    {END: END, "iterate": "iterate"}
+    {"review": "review", "flush": "flush", "iterate": "iterate"}
 )
+workflow.add_edge("review", "flush")
+workflow.add_edge("flush", END)
 
-memory = MemorySaver()
-print("memory saver is rerun")
+memory = get_checkpointer()
+log("graph_compiled", "info", checkpointer=type(memory).__name__)
 app = workflow.compile(checkpointer=memory)
 
 def create_app():
@@ -1,10 +1,42 @@
-from typing import TypedDict, Optional, List
+from typing import Annotated, TypedDict, Optional, List
+
+from langgraph.channels.delta import DeltaChannel
 
 from chunk import Chunk
+
+# Per-chunk results are merged from small updates, so a step that finishes one
+# chunk writes a dict entry instead of a new copy of the chunks list. They live in
+# delta channels: a checkpoint stores only the step's update, and the full value
+# every SNAPSHOT_UPDATES updates. An Overwrite clears them when a new document
+# starts, which also snapshots them.
+SNAPSHOT_UPDATES = 25
+
+def merge_results(left: dict, updates: list[dict]) -> dict:
+  merged = dict(left)
+  for update in updates:
+    merged.update(update)
+  return merged
+
+def append_items(left: list, updates: list[list]) -> list:
+  return list(left) + [item for update in updates for item in update]
+
 class GraphState(TypedDict, total=False):
   text: str
+  # Written once per document; keywords found while iterating go to `keywords`
   chunks: list[Chunk]
+  # The chunks already carry their missing context (fused split), so adjust only publishes them
+  adjusted: bool
+  keywords: Annotated[dict[int, str], DeltaChannel(merge_results, snapshot_frequency=SNAPSHOT_UPDATES)]
   index: int
   similar_chunk: Optional[Chunk]
+  similar_chunks: Optional[list[Optional[Chunk]]]
+  # Similarity scores of similar_chunk and similar_chunks
+  similar_score: Optional[float]
+  similar_scores: Optional[list[Optional[float]]]
   prompt_message: str
-  answer: Optional[str]
\ No newline at end of file
+  answer: Optional[str]
+  stored_ids: Annotated[dict[int, str], DeltaChannel(merge_results, snapshot_frequency=SNAPSHOT_UPDATES)]
+  # Deferred review: conflicts queued as {"chunk_index", "similar_chunk", "score"} and the
+  # "y"/"n" answers keyed by chunk index
+  review_queue: Annotated[list[dict], DeltaChannel(append_items, snapshot_frequency=SNAPSHOT_UPDATES)]
+  review_answers: Optional[dict[int, str]]
\ No newline at end of file
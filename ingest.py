@@ -0,0 +1,315 @@
+"""Headless bulk ingestion of many documents into the chunk index.
+
+    python ingest.py docs/ "notes/**/*.md" corpus.jsonl --concurrency 8 --on-duplicate skip
+
+Directories are read recursively (.txt and .md files), other arguments are
+glob patterns, and .jsonl files hold one document per line as {"id", "text"}.
+Every document runs under its own thread_id. Finished documents are appended
+to the manifest, so running the same command again resumes where it stopped.
+
+With --incremental, every document is diffed paragraph by paragraph against
+the version ingested before (see revisions.py), and only the changed regions
+go through the graph:
+
+    python ingest.py docs/ --incremental --on-removed delete
+"""
+
+import argparse
+import asyncio
+import contextlib
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+from chunk import Chunk
+from fingerprints import fingerprint
+from revisions import DocumentRecord, StoredChunk, diff_document, source_paragraphs
+from scheduler import priority
+from windowing import split_paragraphs
+
+TEXT_SUFFIXES = (".txt", ".md")
+POLICIES = ("skip", "store", "defer")
+# What happens to the stored chunks of edited or removed paragraphs with --incremental
+REMOVED_POLICIES = ("keep", "delete", "tombstone")
+
+
+@dataclass
+class Document:
+    id: str
+    text: str
+
+    @property
+    def thread_id(self) -> str:
+        # Stable across runs so a checkpointed document resumes under the same thread
+        return "ingest-" + hashlib.sha256(self.id.encode("utf-8")).hexdigest()[:32]
+
+
+def read_jsonl(path: str) -> Iterator[Document]:
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if line.strip():
+                record = json.loads(line)
+                yield Document(str(record.get("id", f"{path}:{line_number}")), record["text"])
+
+def read_file(path: str) -> Iterator[Document]:
+    if path.endswith(".jsonl"):
+        yield from read_jsonl(path)
+    else:
+        with open(path, encoding="utf-8") as f:
+            yield Document(path, f.read())
+
+def iter_documents(sources: list[str]) -> Iterator[Document]:
+    for source in sources:
+        if os.path.isdir(source):
+            paths = sorted(
+                os.path.join(root, name)
+                for root, _, names in os.walk(source)
+                for name in names if name.endswith(TEXT_SUFFIXES)
+            )
+        elif os.path.isfile(source):
+            paths = [source]
+        else:
+            paths = sorted(glob.glob(source, recursive=True))
+        for path in paths:
+            yield from read_file(path)
+
+
+class Manifest:
+    """JSON lines record of every processed document; the last entry per id wins."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: dict[str, dict] = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.entries[entry["id"]] = entry
+
+    def status(self, document_id: str) -> Optional[str]:
+        entry = self.entries.get(document_id)
+        return entry["status"] if entry else None
+
+    def record(self, entry: dict):
+        self.entries[entry["id"]] = entry
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+
+
+class Progress:
+    def __init__(self, total: int):
+        self.total = total
+        self.done = 0
+        self.chunks = 0
+        self.started = time.time()
+
+    def report(self, entry: dict):
+        self.done += 1
+        self.chunks += entry.get("chunks", 0)
+        elapsed = max(time.time() - self.started, 1e-6)
+        print(
+            f"[{self.done}/{self.total}] {entry['status']:<12} {entry['id']} "
+            f"chunks={entry.get('chunks', 0)} stored={entry.get('stored', 0)} {entry['seconds']:.1f}s "
+            f"| {self.done / elapsed:.2f} docs/s {self.chunks / elapsed:.1f} chunks/s"
+            + (f" error: {entry['error']}" if entry.get("error") else ""),
+            file=sys.stderr
+        )
+
+
+async def ingest_document(app, document: Document, configurable: dict, policy: str, recursion_limit: int,
+                          callbacks: Optional[list] = None, keep_thread: bool = False) -> dict:
+    entry, _ = await run_document(app, document, configurable, policy, recursion_limit, callbacks, keep_thread)
+    return entry
+
+async def run_document(app, document: Document, configurable: dict, policy: str, recursion_limit: int,
+                       callbacks: Optional[list] = None, keep_thread: bool = False):
+    """Run the graph over `document` and return its manifest entry and final state."""
+    config = {
+        "callbacks": callbacks,
+        "recursion_limit": recursion_limit,
+        "configurable": {**configurable, "thread_id": document.thread_id, "review_mode": "deferred"}
+    }
+    started = time.time()
+    state = await app.aget_state(config)
+    # Resume an interrupted run of this document, otherwise start it over
+    await app.ainvoke(None if state.next else {"text": document.text}, config)
+    state = await app.aget_state(config)
+
+    if state.next and policy != "defer":
+        # The review band is answered by the duplicate policy instead of a person
+        answer = "y" if policy == "store" else "n"
+        answers = {item["chunk_index"]: answer for item in state.values.get("review_queue") or []}
+        await app.aupdate_state(config, {"review_answers": answers})
+        await app.ainvoke(None, config)
+        state = await app.aget_state(config)
+
+    entry = {
+        "id": document.id,
+        "thread_id": document.thread_id,
+        "status": "needs_review" if state.next else "done",
+        "chunks": len(state.values.get("chunks") or []),
+        "stored": len(state.values.get("stored_ids") or {}),
+        "seconds": time.time() - started
+    }
+    if not state.next and not keep_thread:
+        await app.checkpointer.adelete_thread(document.thread_id)
+    return entry, state
+
+async def ingest_revision(app, document: Document, configurable: dict, policy: str, recursion_limit: int,
+                          on_removed: str = "keep", callbacks: Optional[list] = None) -> dict:
+    """Ingest only the paragraphs of `document` that changed since it was last ingested.
+
+    Changed regions run through the graph as documents of their own. The stored
+    chunks of edited or removed paragraphs are removed first unless on_removed
+    is "keep", so the new versions are not reviewed against the old ones.
+    """
+    import backends
+    from configuration import Configuration
+
+    configuration = Configuration.from_runnable_config({"configurable": configurable})
+    manifest = backends.get_document_manifest(configuration.backend, configuration.namespace)
+    started = time.time()
+    paragraphs = split_paragraphs(document.text)
+    revision = diff_document(manifest.get(document.id), paragraphs)
+    # Chunks an earlier run kept stale only change the document when they are removed now
+    changed = revision.regions or any(not chunk.stale for chunk in revision.stale) or (revision.stale and on_removed != "keep")
+    entry = {
+        "id": document.id,
+        "thread_id": document.thread_id,
+        "status": "done" if changed else "unchanged",
+        "chunks": 0,
+        "stored": 0,
+        "kept": len(revision.kept),
+        "removed": 0,
+        "regions": len(revision.regions)
+    }
+    if revision.stale and on_removed != "keep":
+        store = backends.get_store(configuration.backend, configuration.namespace)
+        entry["removed"] = await asyncio.to_thread(
+            store.removeChunks, [chunk.stored_id for chunk in revision.stale], tombstone=on_removed == "tombstone"
+        )
+
+    chunks = list(revision.kept)
+    if on_removed == "keep":
+        # Kept chunks stay in the index, so the record keeps them for a later delete or tombstone
+        chunks.extend(StoredChunk(chunk.stored_id, [], stale=True) for chunk in revision.stale)
+    for start, end in revision.regions:
+        text = "\n\n".join(paragraphs[start:end])
+        # The region's text is part of its id, so an interrupted region only resumes while it is unchanged
+        region = Document(f"{document.id}#{fingerprint(text)[:16]}", text)
+        region_entry, state = await run_document(app, region, configurable, policy, recursion_limit, callbacks)
+        entry["chunks"] += region_entry["chunks"]
+        entry["stored"] += region_entry["stored"]
+        if region_entry["status"] != "done":
+            entry["status"] = region_entry["status"]
+            continue
+        region_chunks = state.values.get("chunks") or []
+        for index, stored_id in (state.values.get("stored_ids") or {}).items():
+            sources = source_paragraphs(paragraphs[start:end], Chunk.coerce(region_chunks[int(index)]).text)
+            chunks.append(StoredChunk(stored_id, [start + i for i in sources]))
+
+    # A document left for review is diffed against its previous version again next time
+    if entry["status"] == "done":
+        chunks.sort(key=lambda chunk: chunk.paragraphs[:1])
+        manifest.put(DocumentRecord(document.id, [fingerprint(paragraph) for paragraph in paragraphs], chunks))
+    entry["seconds"] = time.time() - started
+    return entry
+
+async def ingest(documents: list[Document], manifest: Manifest, concurrency: int, configurable: dict,
+                 policy: str, recursion_limit: int, incremental: bool = False, on_removed: str = "keep"):
+    from graph import create_app
+
+    app = create_app()
+    semaphore = asyncio.Semaphore(concurrency)
+    progress = Progress(len(documents))
+
+    async def run(document: Document):
+        async with semaphore:
+            started = time.time()
+            try:
+                if incremental:
+                    entry = await ingest_revision(app, document, configurable, policy, recursion_limit, on_removed)
+                else:
+                    entry = await ingest_document(app, document, configurable, policy, recursion_limit)
+            except Exception as e:
+                entry = {"id": document.id, "thread_id": document.thread_id, "status": "failed",
+                         "seconds": time.time() - started, "error": f"{type(e).__name__}: {e}"}
+            manifest.record(entry)
+            progress.report(entry)
+
+    # Interactive sessions in the same process go first when providers are saturated
+    with priority("bulk"):
+        await asyncio.gather(*(run(document) for document in documents))
+    return progress
+
+
+def parse_value(value: str):
+    try:
+        return json.loads(value)
+    except json.JSONDecodeError:
+        return value
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest documents into the chunk index without the UI")
+    parser.add_argument("sources", nargs="+", help="directories, glob patterns or .jsonl files")
+    parser.add_argument("--manifest", default="ingest_manifest.jsonl", help="progress record used to resume")
+    parser.add_argument("--concurrency", type=int, default=4, help="documents processed at once")
+    parser.add_argument("--on-duplicate", choices=POLICIES, default="skip",
+                        help="answer for chunks in the review band; 'defer' leaves them for a later review")
+    parser.add_argument("--retry", action="store_true", help="also rerun documents left for review")
+    parser.add_argument("--incremental", action="store_true",
+                        help="diff every document against its previous version and process only changed paragraphs")
+    parser.add_argument("--on-removed", choices=REMOVED_POLICIES, default="keep",
+                        help="with --incremental, what to do with chunks of edited or removed paragraphs")
+    parser.add_argument("--backend", help="pinecone, local or fake (default GRAPH_BACKEND)")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="Configuration option, e.g. --set keyword_mode=parallel")
+    parser.add_argument("--recursion-limit", type=int, default=10000)
+    parser.add_argument("--verbose", action="store_true", help="show the graph's own output")
+    args = parser.parse_args()
+
+    configurable = dict(item.split("=", 1) for item in args.set)
+    configurable = {key: parse_value(value) for key, value in configurable.items()}
+    if args.backend:
+        configurable["backend"] = args.backend
+
+    if args.incremental:
+        import backends
+        from configuration import Configuration
+
+        # An in-memory document manifest starts empty, so every document would be ingested again in full
+        configuration = Configuration.from_runnable_config({"configurable": configurable})
+        if not backends.get_document_manifest(configuration.backend, configuration.namespace).persistent:
+            parser.error("--incremental needs a persistent document manifest: the pinecone backend and DOCUMENT_MANIFEST_PATH")
+
+    manifest = Manifest(args.manifest)
+    skipped = ("done", "needs_review") if not args.retry else ("done",)
+    if args.incremental:
+        # Documents are checked for changes instead; unchanged ones cost one diff
+        skipped = ()
+    # The same id listed twice (e.g. a file matched by two patterns) is ingested once
+    documents = list({
+        document.id: document for document in iter_documents(args.sources) if manifest.status(document.id) not in skipped
+    }.values())
+    print(f"{len(documents)} documents to ingest, {len(manifest.entries)} already in {args.manifest}", file=sys.stderr)
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+        progress = asyncio.run(ingest(documents, manifest, args.concurrency, configurable,
+                                      args.on_duplicate, args.recursion_limit, args.incremental, args.on_removed))
+    elapsed = time.time() - progress.started
+    statuses = [manifest.status(document.id) for document in documents]
+    print(
+        f"Ingested {progress.done} documents and {progress.chunks} chunks in {elapsed:.1f}s: "
+        + ", ".join(f"{statuses.count(status)} {status}" for status in ("done", "unchanged", "needs_review", "failed")),
+        file=sys.stderr
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""Structured events, timing spans and metrics for the graph, sent to pluggable sinks.
+
+Sinks are chosen with INSTRUMENTATION_SINKS (comma separated, default
+"console,metrics"):
+
+- "console": one readable line per record on stdout
+- "json": one JSON object per record, to INSTRUMENTATION_LOG_PATH or stderr
+- "metrics": an in-process MetricsRegistry of counters and summaries, dumped in
+  Prometheus text format to METRICS_PATH at exit when that is set
+
+Records below INSTRUMENTATION_LEVEL (default "info") are dropped, and console
+and JSON sinks keep only INSTRUMENTATION_SAMPLE_RATE of the debug and info
+records. Warnings and errors are always kept, and the registry aggregates every
+record regardless of level or sampling.
+"""
+
+import atexit
+from contextlib import contextmanager
+import functools
+import inspect
+import json
+import os
+import random
+import sys
+import threading
+import time
+from typing import Any, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langgraph.errors import GraphInterrupt
+
+LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+COLORS = {"debug": "\033[90m", "info": "\033[92m", "warning": "\033[93m", "error": "\033[91m"}
+
+
+class Sink:
+    """Receives every record at or above `level`; `sample_rate` thins out debug and info records."""
+
+    sampled = True
+
+    def __init__(self, level: str = "debug", sample_rate: float = 1.0):
+        self.level = LEVELS[level]
+        self.sample_rate = sample_rate
+        self._lock = threading.Lock()
+
+    def accepts(self, record: dict) -> bool:
+        level = LEVELS[record["level"]]
+        if level < self.level:
+            return False
+        return not self.sampled or level >= LEVELS["warning"] or random.random() < self.sample_rate
+
+    def emit(self, record: dict):
+        raise NotImplementedError
+
+
+class ConsoleSink(Sink):
+    def emit(self, record: dict):
+        fields = {**record.get("labels", {}), **record.get("values", {})}
+        if "duration_ms" in record:
+            fields["duration_ms"] = round(record["duration_ms"], 2)
+        text = " ".join(f"{key}={value}" for key, value in fields.items())
+        with self._lock:
+            print(f"{COLORS[record['level']]}{record['name']}\033[0m {text}".rstrip())
+
+
+class JsonLogSink(Sink):
+    def __init__(self, path: Optional[str] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.stream = open(path, "a", encoding="utf-8") if path else sys.stderr
+
+    def emit(self, record: dict):
+        line = json.dumps(record, default=str)
+        with self._lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+
+class MetricsRegistry(Sink):
+    """Counters and summaries (count, sum, min, max) keyed by metric name and labels.
+
+    Spans become a `<name>_seconds` summary plus one summary per numeric value
+    they carry, metrics become `<name>` summaries and counts `<name>_total` counters.
+    """
+
+    sampled = False
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.counters: dict[tuple, float] = {}
+        self.summaries: dict[tuple, list[float]] = {}
+
+    def _observe(self, name: str, labels: dict, value: float):
+        key = (name, tuple(sorted(labels.items())))
+        summary = self.summaries.get(key)
+        if summary is None:
+            self.summaries[key] = [1, value, value, value]
+        else:
+            summary[0] += 1
+            summary[1] += value
+            summary[2] = min(summary[2], value)
+            summary[3] = max(summary[3], value)
+
+    def emit(self, record: dict):
+        labels = {key: str(value) for key, value in record.get("labels", {}).items()}
+        with self._lock:
+            if record["kind"] == "span":
+                self._observe(record["name"] + "_seconds", labels, record["duration_ms"] / 1000)
+                for key, value in record.get("values", {}).items():
+                    if isinstance(value, (int, float)) and not isinstance(value, bool):
+                        self._observe(f"{record['name']}_{key}", labels, value)
+            elif record["kind"] == "metric":
+                self._observe(record["name"], labels, record["values"]["value"])
+            elif record["kind"] == "count":
+                key = (record["name"] + "_total", tuple(sorted(labels.items())))
+                self.counters[key] = self.counters.get(key, 0) + record["values"]["value"]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "counters": {_series(name, labels): value for (name, labels), value in self.counters.items()},
+                "summaries": {
+                    _series(name, labels): {"count": s[0], "sum": s[1], "min": s[2], "max": s[3]}
+                    for (name, labels), s in self.summaries.items()
+                }
+            }
+
+    def prometheus_text(self) -> str:
+        lines = []
+        with self._lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append(f"{_series(name, labels)} {value}")
+            for (name, labels), (count, total, low, high) in sorted(self.summaries.items()):
+                lines.append(f"{_series(name + '_count', labels)} {count}")
+                lines.append(f"{_series(name + '_sum', labels)} {total}")
+                lines.append(f"{_series(name + '_min', labels)} {low}")
+                lines.append(f"{_series(name + '_max', labels)} {high}")
+        return "\n".join(lines) + "\n"
+
+def _series(name: str, labels: tuple) -> str:
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+_sinks: Optional[list[Sink]] = None
+_registry: Optional[MetricsRegistry] = None
+_config_lock = threading.Lock()
+
+def configure(sinks: Optional[list[Sink]] = None):
+    """Replace the sinks; without arguments they are rebuilt from the environment."""
+    global _sinks, _registry
+    with _config_lock:
+        if sinks is None:
+            sinks = _sinks_from_env()
+        _sinks = sinks
+        _registry = next((sink for sink in sinks if isinstance(sink, MetricsRegistry)), None)
+
+def _sinks_from_env() -> list[Sink]:
+    level = os.getenv("INSTRUMENTATION_LEVEL", "info").lower()
+    sample_rate = float(os.getenv("INSTRUMENTATION_SAMPLE_RATE", "1"))
+    sinks = []
+    for name in os.getenv("INSTRUMENTATION_SINKS", "console,metrics").split(","):
+        name = name.strip()
+        if name == "console":
+            sinks.append(ConsoleSink(level=level, sample_rate=sample_rate))
+        elif name == "json":
+            sinks.append(JsonLogSink(os.getenv("INSTRUMENTATION_LOG_PATH"), level=level, sample_rate=sample_rate))
+        elif name == "metrics":
+            sinks.append(MetricsRegistry())
+        elif name:
+            raise ValueError(f"Unknown instrumentation sink '{name}'")
+    return sinks
+
+def get_sinks() -> list[Sink]:
+    if _sinks is None:
+        configure()
+    return _sinks
+
+def registry() -> Optional[MetricsRegistry]:
+    get_sinks()
+    return _registry
+
+
+def emit(kind: str, name: str, level: str = "debug", labels: Optional[dict] = None,
+         values: Optional[dict] = None, duration_ms: Optional[float] = None):
+    record: dict[str, Any] = {"time": time.time(), "kind": kind, "level": level, "name": name}
+    if labels:
+        record["labels"] = labels
+    if values:
+        record["values"] = values
+    if duration_ms is not None:
+        record["duration_ms"] = duration_ms
+    for sink in get_sinks():
+        if sink.accepts(record):
+            sink.emit(record)
+
+def log(name: str, level: str = "debug", **values):
+    """A plain event, the replacement for a print()."""
+    emit("event", name, level, values=values)
+
+def observe(name: str, value: float, level: str = "debug", **labels):
+    emit("metric", name, level, labels, {"value": value})
+
+def count(name: str, value: float = 1, level: str = "debug", **labels):
+    emit("count", name, level, labels, {"value": value})
+
+@contextmanager
+def span(name: str, level: str = "debug", **labels):
+    """Time the block. Values added to the yielded dict are recorded with the span."""
+    values: dict[str, Any] = {}
+    started = time.perf_counter()
+    labels["status"] = "ok"
+    try:
+        yield values
+    except GraphInterrupt:
+        labels["status"] = "interrupt"
+        raise
+    except BaseException:
+        labels["status"] = "error"
+        raise
+    finally:
+        emit("span", name, level, labels, values, (time.perf_counter() - started) * 1000)
+
+def timed(node: str, func):
+    """Wrap a graph node so every run produces a `node` span labelled with its name."""
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            with span("node", node=node):
+                return await func(*args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with span("node", node=node):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+class LLMInstrumentation(BaseCallbackHandler):
+    """Records an `llm` span with latency and token counts for every chat model call."""
+
+    def __init__(self, model: str):
+        self.model = model
+        self._started: dict = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        started = self._started.pop(run_id, None)
+        if started is None:
+            return
+        usage = {}
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or usage
+        emit(
+            "span", "llm", "debug", {"model": self.model, "status": "ok"},
+            {"input_tokens": usage.get("input_tokens", 0), "output_tokens": usage.get("output_tokens", 0)},
+            (time.perf_counter() - started) * 1000
+        )
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        started = self._started.pop(run_id, None)
+        if started is not None:
+            emit("span", "llm", "warning", {"model": self.model, "status": "error"},
+                 {"error": str(error)}, (time.perf_counter() - started) * 1000)
+
+
+def _dump_metrics():
+    path = os.getenv("METRICS_PATH")
+    if path and _registry is not None:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(_registry.prometheus_text())
+
+atexit.register(_dump_metrics)
@@ -0,0 +1,183 @@
+"""Keyword extraction without a model call, and parsing of batched keyword prompts.
+
+The local engine scores RAKE-style candidate phrases (runs of words between
+stopwords and punctuation) by word degree over frequency, weighted by the
+inverse document frequency of each word among the stored chunks. Names and
+other capitalized words inside a sentence count double, since the keyword
+prompt asks for entities first.
+"""
+
+import math
+import re
+import sqlite3
+import threading
+import zlib
+from collections import Counter, defaultdict
+from typing import Iterable, Optional
+
+STOPWORDS = frozenset("""
+a about above after again against all also am an and any are as at be because been before being below
+between both but by can could did do does doing down during each either few for from further had has
+have having he her here hers herself him himself his how however i if in into is it its itself just
+last least less like made make many may me might more most much must my myself new no nor not now of
+off often on once one only or other our ours ourselves out over own per same she should since so some
+such than that the their theirs them themselves then there these they this those through to too under
+until up upon us use used using very via was we well were what when where whether which while who whom
+whose why will with within without would yet you your yours yourself yourselves
+""".split())
+
+# Punctuation that ends a candidate phrase; "." only when a space or the end follows, so "Node.js" stays whole
+BOUNDARY = re.compile(r"[,;:!?()\[\]{}\"“”]|\.(?=\s|$)|\s[-–—]\s|\n")
+SENTENCE_END = re.compile(r"[.!?](?=\s|$)|\n")
+WORD = re.compile(r"[^\W_][\w+#'.-]*[\w+#]|[^\W_]")
+
+
+class DocumentFrequencies:
+    """How many stored chunks contain each word, optionally persisted to SQLite."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.documents = 0
+        self._counts: Counter = Counter()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS terms (term TEXT PRIMARY KEY, documents INTEGER)")
+            self._db.commit()
+            for term, documents in self._db.execute("SELECT term, documents FROM terms"):
+                if term:
+                    self._counts[term] = documents
+                else:
+                    # The empty term holds the number of chunks
+                    self.documents = documents
+
+    def add(self, text: str):
+        terms = {word.lower() for word in WORD.findall(text)}
+        with self._lock:
+            self.documents += 1
+            self._counts.update(terms)
+            if self._db is not None:
+                self._db.executemany(
+                    "INSERT INTO terms (term, documents) VALUES (?, 1) "
+                    "ON CONFLICT(term) DO UPDATE SET documents = documents + 1",
+                    [(term,) for term in terms | {""}]
+                )
+                self._db.commit()
+
+    def remove(self, text: str):
+        """Stop counting a chunk that was removed from the store."""
+        terms = {word.lower() for word in WORD.findall(text)}
+        with self._lock:
+            self.documents = max(self.documents - 1, 0)
+            for term in terms:
+                if self._counts[term] > 1:
+                    self._counts[term] -= 1
+                else:
+                    del self._counts[term]
+            if self._db is not None:
+                self._db.executemany(
+                    "UPDATE terms SET documents = MAX(documents - 1, 0) WHERE term = ?",
+                    [(term,) for term in terms | {""}]
+                )
+                self._db.commit()
+
+    def idf(self, term: str) -> float:
+        # Smoothed, so words never seen before score as rare rather than failing
+        return math.log((1 + self.documents) / (1 + self._counts.get(term, 0))) + 1
+
+
+def candidate_phrases(text: str, max_words: int = 3) -> list[tuple[list[str], bool]]:
+    """Runs of non-stopwords, as (words, contains a capitalized word that doesn't start a sentence)."""
+    phrases = []
+    sentence_starts = {0} | {match.end() for match in SENTENCE_END.finditer(text)}
+    for start, part in _fragments(text):
+        words: list[str] = []
+        named = False
+        for match in WORD.finditer(part):
+            word = match.group()
+            stop = _is_stopword(word)
+            if stop or len(words) == max_words:
+                if words:
+                    phrases.append((words, named))
+                words, named = [], False
+                if stop:
+                    continue
+            position = start + match.start()
+            starts_sentence = not text[:position].strip() or _after_sentence_end(text, position, sentence_starts)
+            named = named or (word[0].isupper() and not starts_sentence) or word.isupper() and len(word) > 1
+            words.append(word)
+        if words:
+            phrases.append((words, named))
+    return phrases
+
+def _is_stopword(word: str) -> bool:
+    # Lowercase past tense verbs ("released", "unveiled") also end a phrase; keywords are nouns
+    return word.lower() in STOPWORDS or word.isdigit() or (word.islower() and word.endswith("ed"))
+
+def _fragments(text: str):
+    start = 0
+    for match in BOUNDARY.finditer(text):
+        yield start, text[start:match.start()]
+        start = match.end()
+    yield start, text[start:]
+
+def _after_sentence_end(text: str, position: int, sentence_starts: set[int]) -> bool:
+    # The word starts a sentence when only whitespace separates it from a sentence end
+    i = position
+    while i > 0 and text[i - 1].isspace():
+        i -= 1
+    return i in sentence_starts
+
+def extract_keywords(text: str, frequencies: Optional[DocumentFrequencies] = None, max_keywords: int = 5) -> str:
+    """Comma separated keywords of `text`, like the keyword prompt returns."""
+    phrases = candidate_phrases(text)
+    frequency: Counter = Counter()
+    degree: defaultdict = defaultdict(int)
+    for words, _ in phrases:
+        for word in words:
+            frequency[word.lower()] += 1
+            degree[word.lower()] += len(words)
+
+    scores: dict[str, float] = {}
+    originals: dict[str, str] = {}
+    for words, named in phrases:
+        key = " ".join(word.lower() for word in words)
+        score = sum(
+            degree[word.lower()] / frequency[word.lower()] * (frequencies.idf(word.lower()) if frequencies else 1.0)
+            for word in words
+        ) * (2.0 if named else 1.0)
+        if score > scores.get(key, 0.0):
+            scores[key] = score
+            originals[key] = " ".join(words)
+    best = sorted(scores, key=lambda key: scores[key], reverse=True)[:max_keywords]
+    return ", ".join(originals[key] for key in best)
+
+
+def keyword_terms(keywords: Iterable[str]) -> list[str]:
+    """Lowercase, whitespace-collapsed keywords without surrounding punctuation or duplicates, for metadata filters."""
+    terms = []
+    for keyword in keywords:
+        term = " ".join(keyword.lower().split()).strip(".,;:!?\"'()[]{}")
+        if term and term != "none" and term not in terms:
+            terms.append(term)
+    return terms
+
+def sparse_vector(terms: list[str]) -> dict:
+    """Unit-length sparse vector over hashed terms and the words in them, for sparse-dense queries."""
+    tokens = set(terms) | {word for term in terms for word in term.split()}
+    indices = sorted({zlib.crc32(token.encode("utf-8")) for token in tokens})
+    value = 1.0 / math.sqrt(len(indices)) if indices else 0.0
+    return {"indices": indices, "values": [value] * len(indices)}
+
+
+def format_passages(texts: list[str]) -> str:
+    return "\n".join(f'<passage id="{i}">\n{text}\n</passage>' for i, text in enumerate(texts, 1))
+
+def parse_batch_keywords(content: str, size: int) -> dict[int, str]:
+    """Map the "<id>: keywords" lines of a batched response to 0-based positions; missing ids are left out."""
+    keywords = {}
+    for line in content.splitlines():
+        match = re.match(r"\s*(?:passage\s*)?(\d+)\s*[:.)\-]\s*(.*\S)", line, re.IGNORECASE)
+        if match and 1 <= int(match.group(1)) <= size:
+            keywords[int(match.group(1)) - 1] = match.group(2).strip()
+    return keywords
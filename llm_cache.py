@@ -0,0 +1,165 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Iterator, Optional
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import Runnable, RunnableConfig
+
+
+class ResponseCache:
+    """Cache of LLM responses with an in-process LRU tier and an optional SQLite tier.
+
+    Entries expire after `ttl` seconds (if set). The memory tier keeps at most
+    `max_size` entries and the SQLite tier at most `max_rows`, evicting the
+    least recently used ones.
+    """
+
+    def __init__(self, max_size: int = 1000, path: Optional[str] = None,
+                 ttl: Optional[float] = None, max_rows: int = 100000):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.hits = 0
+        self.misses = 0
+        self._memory: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, value TEXT, created REAL, accessed REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+            self._db.commit()
+
+    @staticmethod
+    def key(prompt: ChatPromptTemplate, inputs: dict, model_name: str) -> str:
+        template = [
+            [type(message).__name__, getattr(getattr(message, "prompt", None), "template", str(message))]
+            for message in prompt.messages
+        ]
+        payload = json.dumps({"prompt": template, "inputs": inputs, "model": model_name}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _expired(self, created: float) -> bool:
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and not self._expired(entry[1]):
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self._memory.pop(key, None)
+
+            if self._db is not None:
+                row = self._db.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None and not self._expired(row[1]):
+                    self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key))
+                    self._db.commit()
+                    self._remember(key, row[0], row[1])
+                    self.hits += 1
+                    return row[0]
+                if row is not None:
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._db.commit()
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: str):
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                    (key, value, now, now)
+                )
+                self._db.execute(
+                    "DELETE FROM responses WHERE key IN "
+                    "(SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                    (self.max_rows,)
+                )
+                self._db.commit()
+
+    def _remember(self, key: str, value: str, created: float):
+        self._memory[key] = (value, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "memory_entries": len(self._memory)
+        }
+
+
+class CachedChain(Runnable):
+    """`prompt | model` that answers repeated inputs from a ResponseCache.
+
+    Returns an AIMessage like the plain chain, so callers keep using
+    `response.content`. Streaming a cached response yields it as one chunk.
+    """
+
+    def __init__(self, prompt: ChatPromptTemplate, model, cache: ResponseCache):
+        self.prompt = prompt
+        self.chain = prompt | model
+        self.cache = cache
+        self.model_name = getattr(model, "model", None) or getattr(model, "model_name", None) or type(model).__name__
+
+    def _key(self, input: dict) -> str:
+        return self.cache.key(self.prompt, input, self.model_name)
+
+    def invoke(self, input: dict, config: Optional[RunnableConfig] = None, **kwargs: Any) -> AIMessage:
+        key = self._key(input)
+        content = self.cache.get(key)
+        if content is not None:
+            return AIMessage(content=content)
+        response = self.chain.invoke(input, config, **kwargs)
+        self.cache.put(key, response.content)
+        return response
+
+    async def ainvoke(self, input: dict, config: Optional[RunnableConfig] = None, **kwargs: Any) -> AIMessage:
+        key = self._key(input)
+        content = self.cache.get(key)
+        if content is not None:
+            return AIMessage(content=content)
+        response = await self.chain.ainvoke(input, config, **kwargs)
+        self.cache.put(key, response.content)
+        return response
+
+    def stream(self, input: dict, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Iterator[AIMessageChunk]:
+        key = self._key(input)
+        content = self.cache.get(key)
+        if content is not None:
+            yield AIMessageChunk(content=content)
+            return
+        parts = []
+        for message in self.chain.stream(input, config, **kwargs):
+            parts.append(message.content)
+            yield message
+        self.cache.put(key, "".join(parts))
+
+    async def astream(self, input: dict, config: Optional[RunnableConfig] = None, **kwargs: Any) -> AsyncIterator[AIMessageChunk]:
+        key = self._key(input)
+        content = self.cache.get(key)
+        if content is not None:
+            yield AIMessageChunk(content=content)
+            return
+        parts = []
+        async for message in self.chain.astream(input, config, **kwargs):
+            parts.append(message.content)
+            yield message
+        self.cache.put(key, "".join(parts))
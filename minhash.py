@@ -0,0 +1,106 @@
+"""MinHash signatures with LSH banding for cheap near-duplicate candidate lookup."""
+
+from collections import defaultdict
+import hashlib
+import sqlite3
+import threading
+from typing import Optional
+
+import numpy as np
+
+from fingerprints import normalize_text
+
+# Mersenne prime 2^31 - 1 keeps a * x + b inside uint64 for 31-bit inputs
+PRIME = np.uint64((1 << 31) - 1)
+
+
+class MinHashLSH:
+    """MinHash signature index over character shingles of chunk text.
+
+    Signatures are split into `bands` bands. Two texts become candidates when any
+    band is identical, which happens with high probability once their shingle
+    Jaccard similarity is above roughly (1 / bands) ** (1 / rows). Signatures
+    are optionally persisted to SQLite so the index survives restarts.
+    """
+
+    def __init__(self, num_perm: int = 128, bands: int = 32, shingle_size: int = 4,
+                 path: Optional[str] = None, seed: int = 1):
+        if num_perm % bands != 0:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, int(PRIME), num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, int(PRIME), num_perm, dtype=np.uint64)
+        self._buckets: list[dict[bytes, set[str]]] = [defaultdict(set) for _ in range(bands)]
+        self._signatures: dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS signatures (key TEXT PRIMARY KEY, signature BLOB)")
+            self._db.commit()
+            for key, blob in self._db.execute("SELECT key, signature FROM signatures"):
+                signature = np.frombuffer(blob, dtype=np.uint32)
+                if signature.shape[0] != num_perm:
+                    raise ValueError(f"Stored signatures have {signature.shape[0]} permutations, expected {num_perm}")
+                self._index(key, signature)
+
+    def shingles(self, text: str) -> set[str]:
+        text = normalize_text(text)
+        if len(text) <= self.shingle_size:
+            return {text}
+        return {text[i:i + self.shingle_size] for i in range(len(text) - self.shingle_size + 1)}
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = np.fromiter(
+            (int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little") for s in self.shingles(text)),
+            dtype=np.uint64
+        ) % PRIME
+        return ((np.outer(hashes, self._a) + self._b) % PRIME).min(axis=0).astype(np.uint32)
+
+    def _bands(self, signature: np.ndarray):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def _index(self, key: str, signature: np.ndarray):
+        self._signatures[key] = signature
+        for band, band_key in self._bands(signature):
+            self._buckets[band][band_key].add(key)
+
+    def add(self, key: str, text: str):
+        signature = self.signature(text)
+        with self._lock:
+            self._index(key, signature)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO signatures (key, signature) VALUES (?, ?)",
+                    (key, signature.tobytes())
+                )
+                self._db.commit()
+
+    def remove(self, key: str):
+        with self._lock:
+            signature = self._signatures.pop(key, None)
+            if signature is None:
+                return
+            for band, band_key in self._bands(signature):
+                self._buckets[band][band_key].discard(key)
+            if self._db is not None:
+                self._db.execute("DELETE FROM signatures WHERE key = ?", (key,))
+                self._db.commit()
+
+    def candidates(self, text: str) -> list[tuple[str, float]]:
+        """Return (key, estimated Jaccard similarity) for every bucket match, best first."""
+        signature = self.signature(text)
+        with self._lock:
+            keys = set()
+            for band, band_key in self._bands(signature):
+                keys.update(self._buckets[band].get(band_key, ()))
+            scored = [(key, float(np.mean(self._signatures[key] == signature))) for key in keys]
+        return sorted(scored, key=lambda item: item[1], reverse=True)
+
+    def __len__(self) -> int:
+        return len(self._signatures)
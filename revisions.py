@@ -0,0 +1,136 @@
+"""Document manifest for incremental re-ingestion of revised documents.
+
+For every ingested document the manifest keeps the fingerprints of its
+paragraphs and, for every stored chunk, its stored ID and the paragraphs it
+came from. A revision is diffed against it paragraph by paragraph: chunks whose
+source paragraphs are all unchanged are kept, chunks with an edited or removed
+source are stale, and only the new paragraphs (plus the unchanged sources of
+stale chunks) are processed again, in contiguous regions.
+"""
+
+from dataclasses import asdict, dataclass, field
+from difflib import SequenceMatcher
+import json
+import sqlite3
+import threading
+from typing import Optional
+
+from fingerprints import fingerprint, normalize_text
+from splitter import split_sentences
+
+
+@dataclass
+class StoredChunk:
+    stored_id: str
+    # Indices of the document paragraphs the chunk came from
+    paragraphs: list[int]
+    # The chunk's source was edited or removed, but the chunk was kept in the index
+    stale: bool = False
+
+
+@dataclass
+class DocumentRecord:
+    id: str
+    # Fingerprint of every paragraph, in document order
+    paragraphs: list[str]
+    chunks: list[StoredChunk] = field(default_factory=list)
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self))
+
+    @classmethod
+    def from_json(cls, data: str) -> "DocumentRecord":
+        record = json.loads(data)
+        return cls(record["id"], record["paragraphs"], [StoredChunk(**chunk) for chunk in record["chunks"]])
+
+
+@dataclass
+class Revision:
+    # Stored chunks to keep, with their paragraphs renumbered for the new text
+    kept: list[StoredChunk]
+    # Stored chunks whose source was edited or removed, with their old paragraph numbers
+    stale: list[StoredChunk]
+    # Paragraph ranges [start, end) of the new text to process
+    regions: list[tuple[int, int]]
+
+
+def diff_document(record: Optional[DocumentRecord], paragraphs: list[str]) -> Revision:
+    """Compare a document's paragraphs with its manifest record; without one, everything is new."""
+    fingerprints = [fingerprint(paragraph) for paragraph in paragraphs]
+    if record is None:
+        return Revision([], [], [(0, len(paragraphs))] if paragraphs else [])
+
+    # Old paragraph index -> new index, for paragraphs that survived unchanged
+    moved: dict[int, int] = {}
+    matcher = SequenceMatcher(None, record.paragraphs, fingerprints, autojunk=False)
+    for tag, old_start, old_end, new_start, new_end in matcher.get_opcodes():
+        if tag == "equal":
+            moved.update(zip(range(old_start, old_end), range(new_start, new_end)))
+
+    kept, stale = [], []
+    for chunk in record.chunks:
+        if not chunk.stale and all(i in moved for i in chunk.paragraphs):
+            kept.append(StoredChunk(chunk.stored_id, [moved[i] for i in chunk.paragraphs]))
+        else:
+            stale.append(chunk)
+
+    # A stale chunk's unchanged paragraphs lost their chunk, so they are processed again too
+    dirty = set(range(len(paragraphs))) - set(moved.values())
+    for chunk in stale:
+        dirty.update(moved[i] for i in chunk.paragraphs if i in moved)
+
+    regions = []
+    for i in sorted(dirty):
+        if regions and regions[-1][1] == i:
+            regions[-1] = (regions[-1][0], i + 1)
+        else:
+            regions.append((i, i + 1))
+    return Revision(kept, stale, regions)
+
+def source_paragraphs(paragraphs: list[str], text: str) -> list[int]:
+    """Paragraphs a chunk came from: those containing one of its sentences, else the one sharing most words."""
+    normalized = [normalize_text(paragraph) for paragraph in paragraphs]
+    sources = {
+        i for sentence in split_sentences(text)
+        for i, paragraph in enumerate(normalized) if normalize_text(sentence.text) in paragraph
+    }
+    if sources or not paragraphs:
+        return sorted(sources)
+    # Adjusted chunks can be reworded throughout
+    words = set(normalize_text(text).split())
+    return [max(range(len(paragraphs)), key=lambda i: len(words & set(normalized[i].split())))]
+
+
+class DocumentManifest:
+    """Map from document ID to its DocumentRecord, optionally persisted to SQLite."""
+
+    def __init__(self, path: Optional[str] = None):
+        self._records: dict[str, DocumentRecord] = {}
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS documents (id TEXT PRIMARY KEY, record TEXT)")
+            self._db.commit()
+            for document_id, data in self._db.execute("SELECT id, record FROM documents"):
+                self._records[document_id] = DocumentRecord.from_json(data)
+
+    @property
+    def persistent(self) -> bool:
+        return self._db is not None
+
+    def get(self, document_id: str) -> Optional[DocumentRecord]:
+        return self._records.get(document_id)
+
+    def put(self, record: DocumentRecord):
+        with self._lock:
+            self._records[record.id] = record
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO documents (id, record) VALUES (?, ?)",
+                    (record.id, record.to_json())
+                )
+                self._db.commit()
+
+    def __len__(self) -> int:
+        return len(self._records)
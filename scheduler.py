@@ -0,0 +1,440 @@
+"""Rate-limit aware scheduling of the model, embedding and index requests.
+
+Every request to a provider goes through one Scheduler per process, which
+
+- waits for the provider's request and token buckets (requests and tokens per
+  minute),
+- runs at most the provider's current concurrency limit at once, raising it
+  by one every `limit` successes and halving it when the provider throttles,
+- retries throttled and transient failures with jittered exponential backoff,
+  honouring Retry-After,
+- lets "interactive" requests (the UI) go before "bulk" ones (ingest.py,
+  bench.py) when both are waiting for a slot.
+
+Limits come from the environment, per provider (ANTHROPIC, OPENAI,
+OPENAI_EMBEDDINGS, PINECONE): RATE_LIMIT_<PROVIDER>_RPM, _TPM and
+_CONCURRENCY. Unset rates are not limited.
+"""
+
+import asyncio
+import contextvars
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Optional
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from pydantic import ConfigDict
+
+from instrumentation import count, log, observe
+from windowing import estimate_tokens
+
+PRIORITIES = ("interactive", "bulk")
+_priority: contextvars.ContextVar[str] = contextvars.ContextVar("scheduler_priority", default="interactive")
+
+# Polling interval of async requests waiting for a concurrency slot
+ASYNC_POLL_SECONDS = 0.01
+
+
+@contextmanager
+def priority(name: str):
+    """Run the requests made in this block (and the tasks and threads it starts) at `name` priority."""
+    if name not in PRIORITIES:
+        raise ValueError(f"Unknown priority '{name}', expected one of {', '.join(PRIORITIES)}")
+    token = _priority.set(name)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+def with_context(func: Callable) -> Callable:
+    """Bind `func` to the caller's context, for executor threads that don't copy it."""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.copy().run(func, *args, **kwargs)
+
+
+class TokenBucket:
+    """Refills `per_minute` units a minute up to a one minute burst.
+
+    Callers reserve units up front and wait out the returned delay, so the
+    bucket may go into debt and later callers queue behind earlier ones.
+    """
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= min(amount, self.capacity)
+            return max(0.0, -self.tokens / self.rate)
+
+    def adjust(self, amount: float):
+        """Take `amount` more units (or give them back when negative) once the real cost is known."""
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class Provider:
+    """Buckets, adaptive concurrency and backoff state of one provider."""
+
+    def __init__(self, name: str, rpm: Optional[float] = None, tpm: Optional[float] = None,
+                 concurrency: int = 16, max_retries: int = 6, base_delay: float = 0.5, max_delay: float = 60.0):
+        self.name = name
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.max_concurrency = concurrency
+        self.limit = float(concurrency)
+        self.in_flight = 0
+        self.interactive_waiting = 0
+        self.blocked_until = 0.0
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._lock = threading.Condition()
+
+    def delay(self, tokens: int) -> float:
+        delays = [self.blocked_until - time.monotonic()]
+        if self.requests is not None:
+            delays.append(self.requests.reserve(1))
+        if self.tokens is not None and tokens:
+            delays.append(self.tokens.reserve(tokens))
+        return max(0.0, *delays)
+
+    def try_acquire(self, priority: str) -> bool:
+        with self._lock:
+            if self.in_flight >= int(self.limit):
+                return False
+            if priority == "bulk" and self.interactive_waiting:
+                return False
+            self.in_flight += 1
+            return True
+
+    def acquire(self, priority: str):
+        with self._lock:
+            if priority == "interactive":
+                self.interactive_waiting += 1
+            try:
+                while not self.try_acquire(priority):
+                    self._lock.wait(0.1)
+            finally:
+                if priority == "interactive":
+                    self.interactive_waiting -= 1
+
+    async def aacquire(self, priority: str):
+        with self._lock:
+            if priority == "interactive":
+                self.interactive_waiting += 1
+        try:
+            while not self.try_acquire(priority):
+                await asyncio.sleep(ASYNC_POLL_SECONDS)
+        finally:
+            if priority == "interactive":
+                with self._lock:
+                    self.interactive_waiting -= 1
+
+    def release(self, throttled: bool = False, retry_after: Optional[float] = None, success: bool = True):
+        with self._lock:
+            self.in_flight -= 1
+            if throttled:
+                # Multiplicative decrease, and everyone pauses for Retry-After
+                self.limit = max(1.0, self.limit / 2)
+                if retry_after:
+                    self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+            elif success:
+                # Additive increase: one more slot per `limit` successes
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+            self._lock.notify_all()
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        # Full jitter, but never sooner than the provider asked for
+        return max(retry_after or 0.0, random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)))
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+def is_throttled(error: Exception) -> bool:
+    text = f"{type(error).__name__} {error}".lower()
+    return _status_code(error) in (429, 529) or "ratelimit" in text or "rate limit" in text or "overloaded" in text
+
+def is_transient(error: Exception) -> bool:
+    status = _status_code(error)
+    if status is not None and status >= 500:
+        return True
+    name = type(error).__name__.lower()
+    return isinstance(error, (TimeoutError, ConnectionError)) or "timeout" in name or "connection" in name
+
+def retry_after(error: Exception) -> Optional[float]:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class Scheduler:
+    def __init__(self, providers: Optional[dict[str, Provider]] = None):
+        self.providers: dict[str, Provider] = providers or {}
+        self._lock = threading.Lock()
+
+    def provider(self, name: str) -> Provider:
+        with self._lock:
+            provider = self.providers.get(name)
+            if provider is None:
+                prefix = "RATE_LIMIT_" + name.upper().replace("-", "_")
+                rpm, tpm = os.getenv(prefix + "_RPM"), os.getenv(prefix + "_TPM")
+                provider = self.providers[name] = Provider(
+                    name,
+                    rpm=float(rpm) if rpm else None,
+                    tpm=float(tpm) if tpm else None,
+                    concurrency=int(os.getenv(prefix + "_CONCURRENCY", "16"))
+                )
+            return provider
+
+    def _failed(self, provider: Provider, error: Exception, attempt: int) -> Optional[float]:
+        """Release the slot of a failed attempt and return the wait before retrying, or None to give up."""
+        throttled = is_throttled(error)
+        after = retry_after(error)
+        provider.release(throttled=throttled, retry_after=after, success=False)
+        if not (throttled or is_transient(error)) or attempt >= provider.max_retries:
+            return None
+        count("scheduler_retry", provider=provider.name, reason="throttled" if throttled else "transient")
+        log("scheduler_retry", "warning" if throttled else "info", provider=provider.name,
+            attempt=attempt + 1, limit=round(provider.limit, 2), error=str(error)[:200])
+        return provider.backoff(attempt, after)
+
+    def _waited(self, provider: Provider, started: float, priority: str):
+        observe("scheduler_wait_seconds", time.monotonic() - started, provider=provider.name, priority=priority)
+
+    def call(self, name: str, func: Callable[[], Any], tokens: int = 0,
+             usage: Optional[Callable[[Any], Optional[int]]] = None) -> Any:
+        """Run `func()` as a request to provider `name` costing about `tokens` tokens.
+
+        `usage` maps the result to the real token count, which corrects the bucket.
+        """
+        provider = self.provider(name)
+        priority = _priority.get()
+        for attempt in range(provider.max_retries + 1):
+            started = time.monotonic()
+            time.sleep(provider.delay(tokens))
+            provider.acquire(priority)
+            self._waited(provider, started, priority)
+            released = False
+            try:
+                result = func()
+            except Exception as e:
+                released = True
+                wait = self._failed(provider, e, attempt)
+                if wait is None:
+                    raise
+                time.sleep(wait)
+                continue
+            finally:
+                if not released:
+                    provider.release()
+            self._reconcile(provider, tokens, usage, result)
+            return result
+
+    async def acall(self, name: str, func: Callable[[], Any], tokens: int = 0,
+                    usage: Optional[Callable[[Any], Optional[int]]] = None) -> Any:
+        """Async `call`; `func()` returns an awaitable."""
+        provider = self.provider(name)
+        priority = _priority.get()
+        for attempt in range(provider.max_retries + 1):
+            started = time.monotonic()
+            await asyncio.sleep(provider.delay(tokens))
+            await provider.aacquire(priority)
+            self._waited(provider, started, priority)
+            released = False
+            try:
+                result = await func()
+            except Exception as e:
+                released = True
+                wait = self._failed(provider, e, attempt)
+                if wait is None:
+                    raise
+                await asyncio.sleep(wait)
+                continue
+            finally:
+                if not released:
+                    provider.release()
+            self._reconcile(provider, tokens, usage, result)
+            return result
+
+    def stream(self, name: str, func: Callable[[], Any], tokens: int = 0):
+        """Yield from the iterator `func()` returns, retrying only until the first item arrives."""
+        provider = self.provider(name)
+        priority = _priority.get()
+        for attempt in range(provider.max_retries + 1):
+            started = time.monotonic()
+            time.sleep(provider.delay(tokens))
+            provider.acquire(priority)
+            self._waited(provider, started, priority)
+            released = streaming = False
+            try:
+                for item in func():
+                    streaming = True
+                    yield item
+                return
+            except Exception as e:
+                if streaming:
+                    raise
+                released = True
+                wait = self._failed(provider, e, attempt)
+                if wait is None:
+                    raise
+                time.sleep(wait)
+            finally:
+                if not released:
+                    provider.release()
+
+    async def astream(self, name: str, func: Callable[[], Any], tokens: int = 0):
+        """Async `stream`; `func()` returns an async iterator."""
+        provider = self.provider(name)
+        priority = _priority.get()
+        for attempt in range(provider.max_retries + 1):
+            started = time.monotonic()
+            await asyncio.sleep(provider.delay(tokens))
+            await provider.aacquire(priority)
+            self._waited(provider, started, priority)
+            released = streaming = False
+            try:
+                async for item in func():
+                    streaming = True
+                    yield item
+                return
+            except Exception as e:
+                if streaming:
+                    raise
+                released = True
+                wait = self._failed(provider, e, attempt)
+                if wait is None:
+                    raise
+                await asyncio.sleep(wait)
+            finally:
+                if not released:
+                    provider.release()
+
+    @staticmethod
+    def _reconcile(provider: Provider, tokens: int, usage, result):
+        if provider.tokens is not None and usage is not None:
+            actual = usage(result)
+            if actual is not None:
+                provider.tokens.adjust(actual - tokens)
+
+
+def _message_tokens(messages) -> int:
+    return sum(estimate_tokens(str(message.content)) for message in messages)
+
+def _result_tokens(result) -> Optional[int]:
+    for generation in result.generations:
+        usage = getattr(generation.message, "usage_metadata", None)
+        if usage:
+            return usage.get("total_tokens") or usage.get("input_tokens", 0) + usage.get("output_tokens", 0)
+    return None
+
+
+class ScheduledChatModel(BaseChatModel):
+    """Chat model whose requests to `inner` go through the scheduler.
+
+    Output tokens are estimated as large as the prompt until the response
+    reports its real usage.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    inner: BaseChatModel
+    provider: str
+    scheduler: Any
+
+    @property
+    def _llm_type(self) -> str:
+        return self.inner._llm_type
+
+    @property
+    def model(self) -> str:
+        # Keeps response cache keys the same as for the unwrapped model
+        return getattr(self.inner, "model", None) or getattr(self.inner, "model_name", None) or type(self.inner).__name__
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        return self.scheduler.call(
+            self.provider, lambda: self.inner._generate(messages, stop=stop, run_manager=run_manager, **kwargs),
+            tokens=2 * _message_tokens(messages), usage=_result_tokens
+        )
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        return await self.scheduler.acall(
+            self.provider, lambda: self.inner._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs),
+            tokens=2 * _message_tokens(messages), usage=_result_tokens
+        )
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        yield from self.scheduler.stream(
+            self.provider, lambda: self.inner._stream(messages, stop=stop, run_manager=run_manager, **kwargs),
+            tokens=2 * _message_tokens(messages)
+        )
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        async for chunk in self.scheduler.astream(
+            self.provider, lambda: self.inner._astream(messages, stop=stop, run_manager=run_manager, **kwargs),
+            tokens=2 * _message_tokens(messages)
+        ):
+            yield chunk
+
+
+class ScheduledEmbeddings(Embeddings):
+    def __init__(self, embeddings: Embeddings, scheduler: Scheduler, provider: str):
+        self.embeddings = embeddings
+        self.scheduler = scheduler
+        self.provider = provider
+        self.model = getattr(embeddings, "model", None) or type(embeddings).__name__
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        tokens = sum(estimate_tokens(text) for text in texts)
+        return self.scheduler.call(self.provider, lambda: self.embeddings.embed_documents(texts), tokens=tokens)
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.scheduler.call(self.provider, lambda: self.embeddings.embed_query(text), tokens=estimate_tokens(text))
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        tokens = sum(estimate_tokens(text) for text in texts)
+        return await self.scheduler.acall(self.provider, lambda: self.embeddings.aembed_documents(texts), tokens=tokens)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return await self.scheduler.acall(self.provider, lambda: self.embeddings.aembed_query(text), tokens=estimate_tokens(text))
+
+
+class ScheduledIndex:
+    """Pinecone index proxy that sends upsert, query, fetch, update, delete and list pages through the scheduler."""
+
+    REQUESTS = ("upsert", "query", "fetch", "update", "delete")
+
+    def __init__(self, index, scheduler: Scheduler, provider: str = "pinecone"):
+        self._index = index
+        self._scheduler = scheduler
+        self._provider = provider
+
+    def __getattr__(self, name):
+        attribute = getattr(self._index, name)
+        if name not in self.REQUESTS:
+            return attribute
+        return lambda *args, **kwargs: self._scheduler.call(self._provider, lambda: attribute(*args, **kwargs))
+
+    def list(self, *args, **kwargs):
+        pages = self._index.list(*args, **kwargs)
+        while True:
+            page = self._scheduler.call(self._provider, lambda: next(pages, None))
+            if page is None:
+                return
+            yield page
@@ -0,0 +1,172 @@
+"""Split text into chunks at semantic boundaries found from sentence embeddings.
+
+The text is segmented into sentences, adjacent sentences are compared by the
+cosine distance of their embeddings, and the text is cut where the distance
+jumps: at boundaries above the document's `percentile` of distances, subject to
+the chunk size limits. Boundaries whose distance is within `margin` of that
+threshold are ambiguous; the regions around them can be handed to the LLM
+splitter instead.
+"""
+
+from dataclasses import dataclass
+import re
+
+import numpy as np
+
+from fingerprints import normalize_text
+from windowing import estimate_tokens, split_paragraphs
+
+# Words ending in a period that don't end a sentence
+ABBREVIATIONS = frozenset("""
+mr mrs ms dr prof sr jr st vs etc e.g i.e cf fig no vol approx inc ltd co corp dept est jan feb mar apr jun
+jul aug sep sept oct nov dec u.s u.k a.m p.m
+""".split())
+
+# A sentence ends at ., ! or ? (plus closing quotes or brackets) followed by whitespace
+SENTENCE_END = re.compile(r"(?<=[.!?])[\"')\]]*\s+")
+
+# Paragraph breaks count as this much extra distance, so chunks rarely span them
+PARAGRAPH_BONUS = 0.1
+
+# An adjusted chunk must keep this share of its source's words, and this share of
+# its own words must occur in the document (added context comes from elsewhere in it)
+MIN_SOURCE_KEPT = 0.6
+MIN_TEXT_SUPPORTED = 0.75
+
+
+@dataclass
+class Sentence:
+    text: str
+    # The sentence starts a new paragraph of the source text
+    paragraph_start: bool = False
+
+
+def split_sentences(text: str) -> list[Sentence]:
+    sentences = []
+    for paragraph in split_paragraphs(text):
+        start = 0
+        first = True
+        for match in SENTENCE_END.finditer(paragraph):
+            candidate = paragraph[start:match.start()].rstrip()
+            last_word = candidate.rsplit(None, 1)[-1].rstrip(".").lower() if candidate else ""
+            following = paragraph[match.end():match.end() + 1]
+            # Not a sentence end after an abbreviation or initial, or before a lowercase word
+            if last_word in ABBREVIATIONS or len(last_word) == 1 and last_word.isalpha() or following.islower():
+                continue
+            sentence = paragraph[start:match.end()].strip()
+            if sentence:
+                sentences.append(Sentence(sentence, first))
+                first = False
+            start = match.end()
+        rest = paragraph[start:].strip()
+        if rest:
+            sentences.append(Sentence(rest, first))
+    return sentences
+
+def covers_text(text: str, parts: list[str]) -> bool:
+    """Whether every sentence of `text` appears, in order, in the joined parts (ignoring case and whitespace)."""
+    joined = normalize_text(" ".join(parts))
+    position = 0
+    for sentence in split_sentences(text):
+        found = joined.find(normalize_text(sentence.text), position)
+        if found < 0:
+            return False
+        position = found + len(normalize_text(sentence.text))
+    return True
+
+def words(text: str) -> list[str]:
+    return re.findall(r"\w+", text.lower())
+
+def keeps_source(source: str, text: str, document: str) -> bool:
+    """Whether an adjusted chunk text keeps most of its source and adds little that isn't in the document."""
+    source_words, text_words = set(words(source)), words(text)
+    if not source_words or not text_words:
+        return False
+    known = set(words(document))
+    kept = len(source_words & set(text_words)) / len(source_words)
+    supported = sum(word in known for word in text_words) / len(text_words)
+    return kept >= MIN_SOURCE_KEPT and supported >= MIN_TEXT_SUPPORTED
+
+def boundary_distances(vectors, sentences: list[Sentence]) -> np.ndarray:
+    """Cosine distance between each sentence and the next, plus PARAGRAPH_BONUS at paragraph breaks."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    vectors = vectors / norms
+    distances = 1.0 - np.einsum("ij,ij->i", vectors[:-1], vectors[1:])
+    paragraph_starts = np.array([sentence.paragraph_start for sentence in sentences[1:]], dtype=bool)
+    return distances + PARAGRAPH_BONUS * paragraph_starts
+
+@dataclass
+class Split:
+    # Sentence index ranges [start, end) of the chunks
+    groups: list[tuple[int, int]]
+    # Distance above which a boundary is a break
+    threshold: float
+    distances: np.ndarray
+
+def semantic_split(sentences: list[Sentence], vectors, min_tokens: int = 40, max_tokens: int = 400,
+                   percentile: float = 80.0) -> Split:
+    """Cut at the largest distances until no chunk is over max_tokens and no boundary above the threshold is left.
+
+    A cut is only made where both sides keep at least min_tokens, unless a
+    chunk over max_tokens has no such boundary.
+    """
+    if len(sentences) < 2:
+        return Split([(0, len(sentences))], 0.0, np.zeros(0, dtype=np.float32))
+    distances = boundary_distances(vectors, sentences)
+    threshold = float(np.percentile(distances, percentile))
+    # offsets[i] is the number of tokens before sentence i
+    offsets = np.concatenate([[0], np.cumsum([estimate_tokens(sentence.text) for sentence in sentences])])
+
+    groups = []
+    pending = [(0, len(sentences))]
+    while pending:
+        start, end = pending.pop()
+        if end - start < 2:
+            groups.append((start, end))
+            continue
+        # Boundary b is between sentences b and b + 1
+        boundaries = np.arange(start, end - 1)
+        scores = distances[start:end - 1]
+        before = offsets[boundaries + 1] - offsets[start]
+        after = offsets[end] - offsets[boundaries + 1]
+        allowed = (before >= min_tokens) & (after >= min_tokens)
+        too_long = offsets[end] - offsets[start] > max_tokens
+        if too_long and not allowed.any():
+            allowed = np.ones_like(allowed)
+        elif not too_long:
+            allowed &= scores > threshold
+        if not allowed.any():
+            groups.append((start, end))
+            continue
+        cut = int(boundaries[np.argmax(np.where(allowed, scores, -np.inf))]) + 1
+        pending.extend([(cut, end), (start, cut)])
+    return Split(sorted(groups), threshold, distances)
+
+def chunk_text(sentences: list[Sentence], start: int, end: int) -> str:
+    # Chunks never contain blank lines, which separate chunks in the LLM prompts
+    text = ""
+    for sentence in sentences[start:end]:
+        if text:
+            text += "\n" if sentence.paragraph_start else " "
+        text += sentence.text
+    return text
+
+def ambiguous_regions(split: Split, margin: float) -> list[tuple[int, int, bool]]:
+    """Sentence ranges between confident cuts, each flagged when a boundary inside it is within margin of the threshold.
+
+    Cuts forced by max_tokens count as confident, so a region never grows
+    past the chunks around an ambiguous boundary.
+    """
+    groups = split.groups
+    regions = []
+    start = groups[0][0]
+    for i, (_, end) in enumerate(groups):
+        if i < len(groups) - 1 and split.threshold < split.distances[end - 1] < split.threshold + margin:
+            # A cut just above the threshold: keep the next chunk in this region
+            continue
+        ambiguous = bool((np.abs(split.distances[start:end - 1] - split.threshold) < margin).any())
+        regions.append((start, end, ambiguous))
+        start = end
+    return regions
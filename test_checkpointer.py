@@ -0,0 +1,73 @@
+import pytest
+from langgraph.graph import END, StateGraph
+
+from checkpointer import ChunkSerializer, SqliteCheckpointer
+from chunk import Chunk
+from graph_state import SNAPSHOT_UPDATES, GraphState
+
+CONFIG = {"configurable": {"thread_id": "doc"}}
+
+
+def build_app(saver, steps, fail_at=None):
+    def find_keyword(state):
+        index = state.get("index", 0)
+        if index == fail_at:
+            raise RuntimeError("worker stopped")
+        return {"index": index + 1, "keywords": {index: f"keyword {index}"}}
+
+    graph = StateGraph(GraphState)
+    graph.add_node("find_keyword", find_keyword)
+    graph.set_entry_point("find_keyword")
+    graph.add_conditional_edges("find_keyword", lambda state: "find_keyword" if state["index"] < steps else END)
+    return graph.compile(checkpointer=saver)
+
+def run_steps(saver, steps):
+    return build_app(saver, steps).invoke({"index": 0}, {**CONFIG, "recursion_limit": steps + 10})
+
+def keyword_bytes(saver):
+    # Bytes of every stored keywords write, and of every stored full keywords value
+    writes = [len(value) for (value,) in saver.conn.execute("SELECT value FROM writes WHERE channel = 'keywords'")]
+    values = [len(value) for (value,) in saver.conn.execute("SELECT value FROM blobs WHERE channel = 'keywords' AND type != 'empty'")]
+    return writes, values
+
+
+def test_per_step_checkpoint_bytes_stay_bounded(tmp_path):
+    measured = {}
+    for steps in (50, 200):
+        saver = SqliteCheckpointer(str(tmp_path / f"{steps}.db"), keep=None)
+        state = run_steps(saver, steps)
+        assert state["keywords"] == {index: f"keyword {index}" for index in range(steps)}
+        measured[steps] = keyword_bytes(saver)
+
+    short_writes, _ = measured[50]
+    long_writes, long_values = measured[200]
+    # A step stores only its own keyword, however many came before it
+    assert len(long_writes) == 200
+    assert max(long_writes) <= max(short_writes) + 2
+    # The full value is stored only at the snapshots
+    assert len(long_values) <= 200 // SNAPSHOT_UPDATES
+
+def test_pruning_keeps_the_replayed_ancestors_only(tmp_path):
+    saver = SqliteCheckpointer(str(tmp_path / "checkpoints.db"), keep=3)
+    run_steps(saver, 100)
+    checkpoints = saver.conn.execute("SELECT COUNT(*) FROM checkpoints").fetchone()[0]
+    # The kept checkpoints, plus the ancestors back to the keywords' last snapshot
+    assert checkpoints <= 3 + SNAPSHOT_UPDATES
+    blobs = saver.conn.execute("SELECT COUNT(*) FROM blobs").fetchone()[0]
+    assert blobs < 100
+    state = build_app(saver, 100).get_state(CONFIG).values
+    assert state["keywords"] == {index: f"keyword {index}" for index in range(100)}
+
+def test_interrupted_run_resumes_from_a_new_connection(tmp_path):
+    path = str(tmp_path / "checkpoints.db")
+    chunks = [Chunk("Apple", "Apple makes the iPhone."), Chunk("Google", "Google makes Gemini.")]
+    app = build_app(SqliteCheckpointer(path, serde=ChunkSerializer()), 60, fail_at=40)
+    with pytest.raises(RuntimeError):
+        app.invoke({"index": 0, "chunks": chunks}, {**CONFIG, "recursion_limit": 70})
+
+    # A restarted worker only has the file
+    resumed = build_app(SqliteCheckpointer(path, serde=ChunkSerializer()), 60)
+    assert resumed.get_state(CONFIG).values["index"] == 40
+    state = resumed.invoke(None, {**CONFIG, "recursion_limit": 70})
+    assert state["keywords"] == {index: f"keyword {index}" for index in range(60)}
+    assert [chunk.text for chunk in state["chunks"]] == [chunk.text for chunk in chunks]
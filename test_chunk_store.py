@@ -0,0 +1,99 @@
+import numpy as np
+
+from chunk import Chunk
+from chunk_store import ChunkLocalStore, ChunkPineconeStore
+from fakes import FakeEmbeddings, FakePineconeIndex, FakeVectorStore
+from keywords import DocumentFrequencies
+
+
+def make_store(**kwargs):
+  index = FakePineconeIndex()
+  # Chunks carry their embeddings, so the store never calls an embeddings model
+  return ChunkPineconeStore(FakeVectorStore(index), None, index, flush_interval=0, **kwargs), index
+
+def near_duplicates():
+  vector = np.zeros(8, dtype=np.float32)
+  vector[0] = 1.0
+  similar = vector.copy()
+  similar[1] = 0.33  # cosine similarity ~0.95
+  return vector, similar
+
+def test_near_duplicate_of_buffered_chunk_is_found():
+  store, index = make_store(batch_size=50)
+  vector, similar = near_duplicates()
+  stored_id = store.addChunk(Chunk("Apple", "Apple makes the iPhone.", embedding=vector))
+  assert not index.namespaces.get("")
+
+  match = store.findChunk(Chunk("Apple", "Apple makes iPhones.", embedding=similar))
+  assert match is not None
+  assert match.id == stored_id
+  assert 0.9 < match.metadata["score"] < 1.0
+
+def test_near_duplicate_of_flushed_chunk_is_found():
+  store, index = make_store(batch_size=1)
+  vector, similar = near_duplicates()
+  stored_id = store.addChunk(Chunk("Apple", "Apple makes the iPhone.", embedding=vector))
+  assert stored_id in index.namespaces[""]
+
+  match = store.findChunk(Chunk("Apple", "Apple makes iPhones.", embedding=similar))
+  assert match is not None
+  assert match.id == stored_id
+
+def test_buffered_chunk_below_threshold_is_not_a_match():
+  store, _ = make_store(batch_size=50)
+  vector, _ = near_duplicates()
+  other = np.zeros(8, dtype=np.float32)
+  other[2] = 1.0
+  store.addChunk(Chunk("Apple", "Apple makes the iPhone.", embedding=vector))
+  assert store.findChunk(Chunk("Google", "Google makes Gemini.", embedding=other)) is None
+
+def test_removed_chunks_stay_removed_after_save_and_load(tmp_path):
+  store = ChunkLocalStore(FakeEmbeddings(size=8))
+  kept = store.addChunk(Chunk("Apple", "Apple makes the iPhone."))
+  removed = store.addChunk(Chunk("Google", "Google makes Gemini."))
+  store.removeChunks([removed])
+  store.save(tmp_path / "store")
+
+  loaded = ChunkLocalStore.load(tmp_path / "store", FakeEmbeddings(size=8))
+  assert loaded.findChunk(Chunk("Google", "Google makes Gemini.")) is None
+  assert loaded.findChunk(Chunk("Apple", "Apple makes the iPhone.")).id == kept
+
+def test_removed_chunks_stop_counting_in_document_frequencies():
+  frequencies = DocumentFrequencies()
+  store = ChunkLocalStore(FakeEmbeddings(size=8), frequencies=frequencies)
+  store.addChunk(Chunk("Apple", "Apple makes the iPhone."))
+  removed = store.addChunk(Chunk("Google", "Google makes Gemini."))
+  store.removeChunks([removed])
+  store.removeChunks([removed])
+  assert frequencies.documents == 1
+  assert frequencies.idf("gemini") == frequencies.idf("unseen")
+  assert frequencies.idf("apple") < frequencies.idf("gemini")
+
+def test_store_with_a_path_is_saved_on_flush(tmp_path):
+  store = ChunkLocalStore(FakeEmbeddings(size=8), path=tmp_path / "store")
+  stored_id = store.addChunk(Chunk("Apple", "Apple makes the iPhone."))
+  store.addChunk(Chunk("Google", "Google makes Gemini."))
+  store.flush()
+
+  frequencies = DocumentFrequencies()
+  loaded = ChunkLocalStore.load(tmp_path / "store", FakeEmbeddings(size=8), frequencies=frequencies)
+  assert loaded.findChunk(Chunk("Apple", "Apple makes the iPhone.")).id == stored_id
+  assert frequencies.documents == 2
+
+  # Saving again over the memory-mapped matrix keeps it readable
+  loaded.path = tmp_path / "store"
+  loaded.addChunk(Chunk("Meta", "Meta makes Llama."))
+  loaded.flush()
+  assert len(ChunkLocalStore.load(tmp_path / "store", FakeEmbeddings(size=8)).ids) == 3
+
+def test_tombstoned_chunks_do_not_hide_a_live_match():
+  for keyword_search in ("off", "hybrid"):
+    store, _ = make_store(batch_size=1, keyword_search=keyword_search)
+    vector, similar = near_duplicates()
+    tombstoned = [store.addChunk(Chunk("Apple", f"Apple makes the iPhone {i}.", embedding=vector)) for i in range(3)]
+    live = store.addChunk(Chunk("Apple", "Apple makes iPhones.", embedding=similar))
+    store.removeChunks(tombstoned, tombstone=True)
+
+    match = store.findChunk(Chunk("Apple", "Apple makes the iPhone.", embedding=vector))
+    assert match is not None
+    assert match.id == live
@@ -0,0 +1,44 @@
+from decisions import DecisionLog, confidence_band, suggest_thresholds
+
+
+def answered(log, scores, decision, source="human"):
+    for score in scores:
+        log.record(0, "Apple makes the iPhone.", score, decision, source)
+
+def test_thresholds_separate_the_consistent_answers():
+    log = DecisionLog()
+    answered(log, [0.80 + i / 1000 for i in range(30)], "store")
+    answered(log, [0.95 + i / 1000 for i in range(30)], "skip")
+    # Reviewers disagreed with the score between 0.90 and 0.95
+    answered(log, [0.90], "skip")
+    answered(log, [0.92], "store")
+    answered(log, [0.99, None], "skip", source="auto")
+    answered(log, [None], "store")
+
+    report = suggest_thresholds(log.entries)
+    assert report["human_decisions"] == 62
+    assert report["auto_decisions"] == 2
+    assert report["auto_skip_score"] == 0.95
+    assert report["review_score"] == 0.90
+    assert confidence_band(0.92, report["auto_skip_score"], report["review_score"]) == "review"
+    assert report["would_automate"] == 60
+    assert report["disagreements"] == 0
+
+def test_bands_without_enough_answers_stay_disabled():
+    log = DecisionLog()
+    answered(log, [0.80 + i / 1000 for i in range(5)], "store")
+    answered(log, [0.95 + i / 1000 for i in range(30)], "skip")
+
+    report = suggest_thresholds(log.entries)
+    assert report["auto_skip_score"] == 0.95
+    assert report["review_score"] is None
+
+def test_lower_precision_accepts_some_disagreement():
+    log = DecisionLog()
+    answered(log, [0.95 + i / 1000 for i in range(19)], "skip")
+    answered(log, [0.97], "store")
+
+    assert suggest_thresholds(log.entries)["auto_skip_score"] is None
+    report = suggest_thresholds(log.entries, precision=0.9)
+    assert report["auto_skip_score"] == 0.95
+    assert report["disagreements"] == 1
@@ -0,0 +1,44 @@
+from fingerprints import fingerprint
+from revisions import DocumentRecord, StoredChunk, diff_document
+
+PARAGRAPHS = ["Apple unveiled the iPhone.", "Google released Gemini.", "Meta shipped Llama."]
+
+
+def record(paragraphs, chunks):
+    return DocumentRecord("doc", [fingerprint(paragraph) for paragraph in paragraphs], chunks)
+
+def test_chunks_of_stale_sources_carried_forward_stay_stale():
+    kept = record(PARAGRAPHS, [StoredChunk("a", [0]), StoredChunk("b", [], stale=True)])
+    revision = diff_document(kept, PARAGRAPHS)
+    assert [chunk.stored_id for chunk in revision.kept] == ["a"]
+    assert [chunk.stored_id for chunk in revision.stale] == ["b"]
+    assert revision.regions == []
+
+def test_stale_flag_survives_the_manifest_round_trip():
+    saved = record(PARAGRAPHS, [StoredChunk("b", [], stale=True)])
+    assert DocumentRecord.from_json(saved.to_json()).chunks == [StoredChunk("b", [], stale=True)]
+
+def test_document_without_a_record_is_one_region():
+    revision = diff_document(None, PARAGRAPHS)
+    assert (revision.kept, revision.stale, revision.regions) == ([], [], [(0, 3)])
+
+def test_chunks_of_unchanged_paragraphs_are_kept_and_renumbered():
+    saved = record(PARAGRAPHS, [StoredChunk("a", [0]), StoredChunk("b", [1]), StoredChunk("c", [2])])
+    revision = diff_document(saved, ["OpenAI launched GPT-4."] + PARAGRAPHS)
+    assert revision.kept == [StoredChunk("a", [1]), StoredChunk("b", [2]), StoredChunk("c", [3])]
+    assert revision.stale == []
+    assert revision.regions == [(0, 1)]
+
+def test_edited_paragraph_makes_its_chunks_stale():
+    saved = record(PARAGRAPHS, [StoredChunk("a", [0]), StoredChunk("b", [1, 2])])
+    revision = diff_document(saved, ["Apple unveiled the iPhone.", "Google released Gemini 2.", "Meta shipped Llama."])
+    assert revision.kept == [StoredChunk("a", [0])]
+    assert [chunk.stored_id for chunk in revision.stale] == ["b"]
+    # The unchanged paragraph of the stale chunk is processed again with the edited one
+    assert revision.regions == [(1, 3)]
+
+def test_whitespace_and_case_edits_keep_the_chunks():
+    saved = record(PARAGRAPHS, [StoredChunk("a", [0]), StoredChunk("b", [1])])
+    revision = diff_document(saved, ["apple  unveiled the iPhone.", "Google released Gemini."])
+    assert revision.kept == [StoredChunk("a", [0]), StoredChunk("b", [1])]
+    assert revision.regions == []
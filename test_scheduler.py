@@ -0,0 +1,98 @@
+import time
+
+import pytest
+
+from fakes import FakeEmbeddings, FakePineconeIndex
+from scheduler import Provider, ScheduledEmbeddings, ScheduledIndex, Scheduler, TokenBucket
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+    def __init__(self, retry_after=None):
+        super().__init__("rate limited")
+        self.response = type("Response", (), {"headers": {"retry-after": retry_after} if retry_after else {}})()
+
+class ThrottledEmbeddings(FakeEmbeddings):
+    """Answers 429 to the first `throttled` requests."""
+
+    def __init__(self, throttled: int, retry_after=None):
+        super().__init__(size=8)
+        self.throttled = throttled
+        self.retry_after = retry_after
+
+    def embed_query(self, text: str) -> list[float]:
+        self.calls += 1
+        if self.calls <= self.throttled:
+            raise RateLimitError(self.retry_after)
+        return self.embeddings.embed_query(text)
+
+
+def scheduled(embeddings, **provider):
+    scheduler = Scheduler({"openai-embeddings": Provider("openai-embeddings", base_delay=0, **provider)})
+    return ScheduledEmbeddings(embeddings, scheduler, "openai-embeddings"), scheduler.provider("openai-embeddings")
+
+def test_throttled_request_is_retried_and_halves_the_concurrency_limit():
+    embeddings = ThrottledEmbeddings(throttled=2)
+    scheduled_embeddings, provider = scheduled(embeddings, concurrency=8)
+    assert len(scheduled_embeddings.embed_query("Apple makes the iPhone.")) == 8
+    assert embeddings.calls == 3
+    # Halved twice, then one success adds 1 / limit
+    assert provider.limit == pytest.approx(2.5)
+    assert provider.in_flight == 0
+
+def test_successes_raise_the_limit_back_additively():
+    scheduled_embeddings, provider = scheduled(FakeEmbeddings(size=8), concurrency=4)
+    provider.limit = 1.0
+    scheduled_embeddings.embed_query("Apple makes the iPhone.")
+    assert provider.limit == pytest.approx(2.0)
+    for _ in range(20):
+        scheduled_embeddings.embed_query("Apple makes the iPhone.")
+    assert provider.limit == 4.0
+
+def test_retry_waits_for_retry_after():
+    scheduled_embeddings, provider = scheduled(ThrottledEmbeddings(throttled=1, retry_after="0.2"))
+    started = time.monotonic()
+    scheduled_embeddings.embed_query("Apple makes the iPhone.")
+    assert time.monotonic() - started >= 0.2
+
+def test_gives_up_after_max_retries():
+    embeddings = ThrottledEmbeddings(throttled=10)
+    scheduled_embeddings, _ = scheduled(embeddings, max_retries=2)
+    with pytest.raises(RateLimitError):
+        scheduled_embeddings.embed_query("Apple makes the iPhone.")
+    assert embeddings.calls == 3
+
+def test_other_errors_are_not_retried():
+    index = FakePineconeIndex()
+    scheduler = Scheduler({"pinecone": Provider("pinecone", base_delay=0)})
+    calls = []
+
+    def fetch(**kwargs):
+        calls.append(kwargs)
+        raise ValueError("bad request")
+
+    index.fetch = fetch
+    with pytest.raises(ValueError):
+        ScheduledIndex(index, scheduler).fetch(ids=["a"])
+    assert len(calls) == 1
+    assert scheduler.provider("pinecone").limit == 16
+
+def test_token_bucket_delays_requests_over_the_per_minute_limit():
+    bucket = TokenBucket(60)
+    assert bucket.reserve(60) == 0.0
+    # One unit a second: the next 30 wait half a minute
+    assert bucket.reserve(30) == pytest.approx(30, abs=0.1)
+    bucket.adjust(-30)
+    assert bucket.reserve(1) == pytest.approx(1, abs=0.1)
+
+def test_request_and_token_limits_both_apply():
+    provider = Provider("openai", rpm=120, tpm=600)
+    assert provider.delay(600) == 0.0
+    # The token bucket is the tighter one: 600 tokens need a minute
+    assert provider.delay(600) == pytest.approx(60, abs=0.1)
+
+def test_token_bucket_is_corrected_with_the_real_usage():
+    scheduler = Scheduler({"anthropic": Provider("anthropic", tpm=1000)})
+    assert scheduler.call("anthropic", lambda: "answer", tokens=500, usage=lambda result: 100) == "answer"
+    assert scheduler.provider("anthropic").tokens.tokens == pytest.approx(900, abs=1)
@@ -0,0 +1,46 @@
+import numpy as np
+
+from splitter import Sentence, covers_text, keeps_source, semantic_split
+
+TEXT = "Apple unveiled the iPhone. It was a hit.\n\nGoogle released Gemini."
+
+
+def test_adjusted_text_with_resolved_reference_keeps_its_source():
+    assert keeps_source("Apple unveiled the iPhone. It was a hit.",
+                        "Apple unveiled the iPhone. The iPhone was a hit.", TEXT)
+
+def test_invented_text_does_not_keep_its_source():
+    assert not keeps_source("Google released Gemini.", "Bananas are yellow.", TEXT)
+
+def test_truncated_text_does_not_keep_its_source():
+    assert not keeps_source("Google released Gemini.", "Gemini.", TEXT)
+    assert not keeps_source("Apple unveiled the iPhone. It was a hit.", "Apple unveiled the iPhone.", TEXT)
+
+def test_sources_must_cover_every_sentence_in_order():
+    assert covers_text(TEXT, ["Apple unveiled the iPhone.", "It was a hit. Google released Gemini."])
+    assert not covers_text(TEXT, ["Apple unveiled the iPhone.", "Google released Gemini."])
+    assert not covers_text(TEXT, ["Google released Gemini.", "Apple unveiled the iPhone. It was a hit."])
+
+def topic_vectors(topics):
+    # One unit vector per topic, so sentences of the same topic are identical
+    return np.eye(max(topics) + 1, dtype=np.float32)[topics]
+
+def test_cuts_where_the_topic_changes():
+    sentences = [Sentence(f"Sentence {i} about one topic.") for i in range(6)]
+    split = semantic_split(sentences, topic_vectors([0, 0, 0, 1, 1, 1]), min_tokens=1)
+    assert split.groups == [(0, 3), (3, 6)]
+
+def test_no_cut_leaves_a_chunk_under_min_tokens():
+    sentences = [Sentence("Short one.")] + [Sentence("A much longer sentence that says a lot more. " * 4) for _ in range(3)]
+    vectors = topic_vectors([0, 1, 1, 2])
+    vectors[3] = [0, 0.6, 0.8]
+    # The largest jump, after the short sentence, would leave it alone in a chunk
+    split = semantic_split(sentences, vectors, min_tokens=20, percentile=40)
+    assert split.groups == [(0, 3), (3, 4)]
+
+def test_chunks_over_max_tokens_are_cut_without_a_topic_change():
+    sentences = [Sentence("The same topic again and again, sentence after sentence.") for _ in range(8)]
+    split = semantic_split(sentences, topic_vectors([0] * 8), min_tokens=1, max_tokens=40)
+    assert len(split.groups) > 1
+    assert all(end - start <= 2 for start, end in split.groups)
+    assert split.groups[0][0] == 0 and split.groups[-1][1] == 8
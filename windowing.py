@@ -0,0 +1,91 @@
+"""Helpers for processing long documents in token-budgeted windows."""
+
+from dataclasses import dataclass
+import re
+
+from fingerprints import normalize_text as normalize
+
+
+def estimate_tokens(text: str) -> int:
+    # Roughly four characters per token for English text
+    return len(text) // 4 + 1
+
+def split_paragraphs(text: str) -> list[str]:
+    return [paragraph.strip() for paragraph in re.split(r"\n\s*\n", text) if paragraph.strip()]
+
+@dataclass
+class Window:
+    paragraphs: list[str]
+    # Number of leading paragraphs repeated from the previous window
+    overlap: int = 0
+
+    @property
+    def text(self) -> str:
+        return "\n\n".join(self.paragraphs)
+
+def make_windows(text: str, max_tokens: int, overlap: int = 1) -> list[Window]:
+    """Segment text at paragraph boundaries into windows of at most max_tokens.
+
+    Each window after the first starts with the last `overlap` paragraphs of the
+    previous one. A single paragraph longer than the budget gets its own window.
+    """
+    windows = []
+    current: list[str] = []
+    current_overlap = 0
+    size = 0
+    for paragraph in split_paragraphs(text):
+        tokens = estimate_tokens(paragraph)
+        if current and size + tokens > max_tokens:
+            windows.append(Window(current, current_overlap))
+            current = current[-overlap:] if overlap else []
+            size = sum(estimate_tokens(p) for p in current)
+            if size + tokens > max_tokens:
+                current, size = [], 0
+            current_overlap = len(current)
+        current.append(paragraph)
+        size += tokens
+    if current:
+        windows.append(Window(current, current_overlap))
+    return windows
+
+def stitch_chunks(windows: list[Window], window_chunks: list[list[str]]) -> list[str]:
+    """Join the chunks split from each window, dropping chunks repeated from the overlap."""
+    stitched: list[str] = []
+    for window, chunks in zip(windows, window_chunks):
+        if window.overlap and stitched:
+            overlap_text = normalize("\n\n".join(window.paragraphs[:window.overlap]))
+            recent = {normalize(chunk) for chunk in stitched[-len(chunks):]}
+            start = 0
+            while start < len(chunks):
+                chunk = normalize(chunks[start])
+                if chunk not in recent and chunk not in overlap_text:
+                    break
+                start += 1
+            chunks = chunks[start:]
+        stitched.extend(chunks)
+    return stitched
+
+def group_chunks(chunk_texts: list[str], max_tokens: int) -> list[list[int]]:
+    """Group consecutive chunk indices so each group fits in max_tokens."""
+    groups: list[list[int]] = []
+    size = 0
+    for i, text in enumerate(chunk_texts):
+        tokens = estimate_tokens(text)
+        if not groups or size + tokens > max_tokens:
+            groups.append([])
+            size = 0
+        groups[-1].append(i)
+        size += tokens
+    return groups
+
+def build_context(summaries: list[str], max_tokens: int) -> str:
+    """Join the most recent summaries that fit in max_tokens, oldest first."""
+    selected: list[str] = []
+    size = 0
+    for summary in reversed(summaries):
+        tokens = estimate_tokens(summary)
+        if selected and size + tokens > max_tokens:
+            break
+        selected.append(summary)
+        size += tokens
+    return "\n".join(reversed(selected)) or "This is the beginning of the document."
@@ -0,0 +1,114 @@
+"""Background graph execution for the Streamlit app.
+
+A GraphWorker runs the compiled graph on its own event loop thread, shared by
+every browser session of the process. Each session holds a Session with its own
+thread_id and event queue, so a run keeps going between Streamlit reruns,
+resuming after a decision is a state update plus a continuation, and sessions
+never wait on each other.
+"""
+
+import asyncio
+import queue
+import threading
+import uuid
+from typing import Optional
+
+from instrumentation import log
+
+# Every chunk takes a few graph steps, so the default limit of 25 is too low
+RECURSION_LIMIT = 10000
+
+
+class Session:
+    """One browser session: the current document's thread and what the UI shows of it.
+
+    The worker fills `events`; `poll()` applies them to `chunks`, `results` and
+    `prompt` on the UI side.
+    """
+
+    def __init__(self):
+        self.thread_id: Optional[str] = None
+        self.config: dict = {}
+        self.events: queue.Queue = queue.Queue()
+        self.status = "idle"  # running, waiting, completed or failed
+        self.error: Optional[str] = None
+        self.chunks: list = []
+        self.results: dict[int, str] = {}
+        # The on_similar_chunk_found or on_review_required event awaiting an answer
+        self.prompt: Optional[tuple[str, dict]] = None
+
+    @property
+    def busy(self) -> bool:
+        return self.status == "running"
+
+    def poll(self) -> int:
+        """Apply the events queued since the last poll and return how many there were."""
+        applied = 0
+        while True:
+            try:
+                name, data = self.events.get_nowait()
+            except queue.Empty:
+                return applied
+            self.apply(name, data)
+            applied += 1
+
+    def apply(self, name: str, data: dict):
+        if name == "on_text_split":
+            self.chunks = list(data["chunks"])
+        elif name == "on_chunk_metadata_update":
+            self.chunks[data["chunk_index"]] = data["chunk"]
+        elif name == "on_chunk_result":
+            self.results[data["chunk_index"]] = data["result"]
+        elif name in ("on_similar_chunk_found", "on_review_required"):
+            self.prompt = (name, data)
+
+
+class GraphWorker:
+    def __init__(self, app=None):
+        if app is None:
+            from graph import app
+        self.app = app
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="graph-worker", daemon=True)
+        self.thread.start()
+
+    def start(self, session: Session, text: str, configurable: Optional[dict] = None):
+        """Process `text` under a new thread_id; a finished document's checkpoints are dropped."""
+        if session.busy:
+            raise RuntimeError("This session is already processing a document")
+        session.thread_id = str(uuid.uuid4())
+        session.config = {
+            "recursion_limit": RECURSION_LIMIT,
+            "configurable": {**(configurable or {}), "thread_id": session.thread_id}
+        }
+        session.chunks, session.results, session.prompt, session.error = [], {}, None, None
+        self._submit(session, self._run(session, {"text": text}))
+
+    def resume(self, session: Session, values: dict):
+        """Answer the pending prompt, e.g. {"answer": "y"} or {"review_answers": {...}}, and continue."""
+        if session.status != "waiting":
+            raise RuntimeError(f"Cannot resume a session that is {session.status}")
+        session.prompt = None
+        self._submit(session, self._run(session, None, values))
+
+    def _submit(self, session: Session, coro):
+        session.status = "running"
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    async def _run(self, session: Session, input: Optional[dict], values: Optional[dict] = None):
+        try:
+            if values is not None:
+                await self.app.aupdate_state(session.config, values)
+            async for event in self.app.astream_events(input, session.config, version="v2"):
+                if event["event"] == "on_custom_event":
+                    session.events.put((event["name"], event["data"]))
+            state = await self.app.aget_state(session.config)
+            if state.next:
+                session.status = "waiting"
+            else:
+                await self.app.checkpointer.adelete_thread(session.thread_id)
+                session.status = "completed"
+        except Exception as e:
+            log("session_failed", "error", thread_id=session.thread_id, error=str(e))
+            session.error = f"{type(e).__name__}: {e}"
+            session.status = "failed"